@@ -24,18 +24,21 @@ def main(argv):
                    default='news')
     p.add_argument('-p', '--port', help='Server port',
                    type=int, default=119)
+    p.add_argument('-r', '--retries', help='Retries after failure',
+                   type=int, default=0)
     p.add_argument('GROUP', help='Group name', type=str)
     p.add_argument('-d', '--debug', help='Enable debugging',
                    action='store_const', const='DEBUG', default='INFO')
     r=p.parse_args(argv)
     logging.basicConfig(level=r.debug)
-    dump_group(r.server, r.port, r.GROUP)
+    dump_group(r.server, r.port, r.GROUP, r.retries)
 
-def dump_group(server, port, group):
-    with nntpbits.ClientConnection((server,port)) as client:
-        (count, low, high)=client.group(group)
+def dump_group(server, port, group, retries=0):
+    with nntpbits.ClientConnection((server,port), retries=retries) as client:
+        (count, low, high, numbers)=client.listgroup(group=group,
+                                                     compact=True)
         linesep=bytes(os.linesep, 'ascii')
-        for number in range(low, high+1):
+        for number in numbers:
             _,_,article=client.article(number)
             if article is not None:
                 with open("%s:%d" % (group,number), "wb") as f:
@@ -43,6 +43,8 @@ email = b'invalid@invalid.invalid'
 group = b'local.test'
 hierarchy = None
 localserveraddress = ('*', 1119)
+localservermode = 'threads'
+profile = None
 timelimit = 10
 trigger = None
 trigger_timeout = 2
@@ -50,6 +52,8 @@ nnrp_user = b'user'
 nnrp_password = b'password'
 nntp_user = None
 nntp_password = None
+# Latency histograms for all test connections
+latency = nntpbits.LatencyAggregator()
 
 
 def configure(**kwargs):
@@ -64,6 +68,8 @@ def configure(**kwargs):
     email -- email address for test postings.  Default invalid@invalid.invalid.
     domain -- domain for message IDs.  Default test.terraraq.uk.
     localserveraddress -- address for local server as (name,port) tuple.
+    localservermode -- 'threads', 'selector' or 'asyncio'.  Default threads.
+    profile -- inntest.FaultProfile (or string) for the local server.
     timelimit -- how log to wait for propagation.
     trigger -- command to trigger peering, etc.
     nnrp_user -- NNRP login username
@@ -74,6 +80,7 @@ def configure(**kwargs):
     """
 
     global address, domain, email, group, hierarchy, localserveraddress
+    global localservermode, profile
     global timelimit, trigger, trigger_timeout
     for name, value in kwargs.items():
         if value is None:
@@ -90,6 +97,15 @@ def configure(**kwargs):
             hierarchy = nntpbits._normalize(value)
         elif name == 'localserveraddress':
             localserveraddress = value
+        elif name == 'localservermode':
+            if value not in ('threads', 'selector', 'asyncio'):
+                raise Exception("inntest.configure: unknown local server"
+                                " mode: %s" % value)
+            localservermode = value
+        elif name == 'profile':
+            if isinstance(value, str):
+                value = FaultProfile.parse(value)
+            profile = value
         elif name == 'timelimit':
             timelimit = int(value)
         elif name == 'trigger':
@@ -113,8 +129,10 @@ def connection():
     Return a connection to the news server to test.
 
     """
-    return nntpbits.ClientConnection(inntest.address,
+    conn = nntpbits.ClientConnection(inntest.address,
                                      nnrp_user=nnrp_user,
                                      nnrp_password=nnrp_password,
                                      nntp_user=nntp_user,
                                      nntp_password=nntp_password)
+    conn.add_observer(latency)
+    return conn
@@ -0,0 +1,393 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import asyncio
+import random
+import socket
+import struct
+import time
+from nntpbits.ServerConnection import _message_id_re
+
+# Fault responses that can be injected, by command
+_fault_codes = {
+    b'CHECK': (431, 438),
+    b'IHAVE': (436,),
+    b'TAKETHIS': (439,),
+}
+
+
+class FaultProfile(object):
+    """inntest.FaultProfile(...) -> PROFILE
+
+    Misbehaviour for inntest.TestServer, used to measure how a feeder
+    (innfeed, nntpsend, ...) copes with a slow or unreliable peer.
+
+    Optional arguments:
+    delay -- delay before every command
+    delays -- dict mapping verbs to delays, overriding delay
+    faults -- dict mapping 431, 436, 438 and 439 to probabilities
+    reset -- reset the connection at every RESET'th TAKETHIS
+    bandwidth -- limit on each connection's traffic in bytes/second
+    drop -- probability of closing a connection as soon as it is accepted
+    seed -- random number seed
+
+    Delays are distributions, given as a number of seconds (a fixed
+    delay) or a string:
+      fixed:SECONDS
+      uniform:LOW:HIGH
+      exponential:MEAN
+      normal:MEAN:SD (negative samples are treated as 0)
+
+    Faults are answered instead of processing the command: 431 or 438
+    for CHECK, 436 for IHAVE and 439 for TAKETHIS (after the article
+    has been received).  Resets happen after the TAKETHIS command
+    line has been read but before the article; the connection is
+    closed with a TCP reset.  The bandwidth limit is applied by
+    pausing after each command, so it holds on average rather than
+    within a single article.
+
+    With inntest.localservermode='selector' a delay or bandwidth
+    pause stalls every connection, not just the one it applies to.
+
+    """
+
+    def __init__(self, delay=None, delays=None, faults=None, reset=None,
+                 bandwidth=None, drop=0.0, seed=None):
+        self.delay = _distribution(delay)
+        self.delays = {}
+        for verb, value in (delays or {}).items():
+            self.delays[nntpbits._normalize(verb).upper()] = \
+                _distribution(value)
+        self.faults = {}
+        for code, probability in (faults or {}).items():
+            code = int(code)
+            if not any(code in codes for codes in _fault_codes.values()):
+                raise Exception("inntest.FaultProfile: cannot inject %d"
+                                % code)
+            self.faults[code] = float(probability)
+        for verb, codes in _fault_codes.items():
+            if sum(self.faults.get(code, 0) for code in codes) > 1:
+                raise Exception("inntest.FaultProfile: %s fault"
+                                " probabilities exceed 1"
+                                % str(verb, 'ascii'))
+        self.reset = None if reset is None else int(reset)
+        self.bandwidth = None if bandwidth is None else float(bandwidth)
+        self.drop = float(drop)
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def parse(spec):
+        """inntest.FaultProfile.parse(SPEC) -> PROFILE
+
+        Create a profile from a string, for instance from the command
+        line.  SPEC is a comma-separated list of NAME=VALUE items:
+          delay=DISTRIBUTION
+          delay.VERB=DISTRIBUTION
+          431=PROBABILITY (and likewise 436, 438, 439)
+          reset=COUNT
+          bandwidth=BYTES-PER-SECOND
+          drop=PROBABILITY
+          seed=SEED
+
+        For example: delay=exponential:0.01,431=0.05,reset=1000
+
+        """
+        kwargs = {'delays': {}, 'faults': {}}
+        for item in spec.split(','):
+            if item == '':
+                continue
+            name, sep, value = item.partition('=')
+            if sep == '':
+                raise Exception("inntest.FaultProfile: malformed item: %s"
+                                % item)
+            if name.startswith('delay.'):
+                kwargs['delays'][name[6:]] = value
+            elif name.isdigit():
+                kwargs['faults'][int(name)] = value
+            elif name in ('delay', 'reset', 'bandwidth', 'drop', 'seed'):
+                kwargs[name] = value
+            else:
+                raise Exception("inntest.FaultProfile: unrecognized item: %s"
+                                % item)
+        return FaultProfile(**kwargs)
+
+    def command_delay(self, verb):
+        """p.command_delay(VERB) -> SECONDS
+
+        Returns the delay to apply before processing a command.
+
+        """
+        return _sample(self.random, self.delays.get(verb, self.delay))
+
+    def fault(self, verb):
+        """p.fault(VERB) -> CODE | None
+
+        Returns the fault response to give to a command, or None to
+        process it normally.
+
+        """
+        codes = _fault_codes.get(verb, ())
+        if len(codes) == 0 or len(self.faults) == 0:
+            return None
+        r = self.random.random()
+        for code in codes:
+            r -= self.faults.get(code, 0)
+            if r < 0:
+                return code
+        return None
+
+    def dropped(self):
+        """p.dropped() -> BOOL
+
+        Returns True if a newly accepted connection should be closed.
+
+        """
+        return self.drop > 0 and self.random.random() < self.drop
+
+    def throttle(self, count, elapsed):
+        """p.throttle(COUNT, ELAPSED) -> SECONDS
+
+        Returns how long to pause a connection which has transferred
+        COUNT bytes in ELAPSED seconds, to keep within the bandwidth
+        limit.
+
+        """
+        if self.bandwidth is None:
+            return 0
+        return max(count / self.bandwidth - elapsed, 0)
+
+
+def _distribution(value):
+    """_distribution(VALUE) -> (KIND, ARGS) | None
+
+    Parse a delay distribution.
+
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return ('fixed', (float(value),))
+    fields = value.split(':')
+    kind, args = fields[0], fields[1:]
+    if kind not in ('fixed', 'uniform', 'exponential', 'normal'):
+        if len(fields) == 1:
+            # A bare number
+            return ('fixed', (float(value),))
+        raise Exception("inntest.FaultProfile: unknown distribution: %s"
+                        % value)
+    nargs = {'fixed': 1, 'uniform': 2, 'exponential': 1, 'normal': 2}[kind]
+    if len(args) != nargs:
+        raise Exception("inntest.FaultProfile: malformed distribution: %s"
+                        % value)
+    return (kind, tuple(float(arg) for arg in args))
+
+
+def _sample(rng, distribution):
+    """_sample(RANDOM, DISTRIBUTION) -> SECONDS
+
+    Pick a delay from a distribution returned by _distribution().
+
+    """
+    if distribution is None:
+        return 0
+    kind, args = distribution
+    if kind == 'fixed':
+        return args[0]
+    if kind == 'uniform':
+        return rng.uniform(args[0], args[1])
+    if kind == 'exponential':
+        return rng.expovariate(1 / args[0]) if args[0] > 0 else 0
+    return max(rng.gauss(args[0], args[1]), 0)
+
+
+class _Faults(object):
+    """Fault injection shared by inntest.TestConnection and
+    inntest.AsyncTestConnection.
+
+    """
+
+    def _reset(self):
+        super()._reset()
+        self._started = time.monotonic()
+        self._takethis_count = 0
+
+    def _fault(self, verb, arguments):
+        """s._fault(VERB, ARGUMENTS) -> CODE | None
+
+        Returns the fault response to give to a command, or None.
+
+        """
+        profile = self.server.profile
+        if profile is None or not _message_id_re.match(arguments):
+            return None
+        return profile.fault(verb)
+
+    def _reset_due(self, arguments):
+        """s._reset_due(ARGUMENTS) -> BOOL
+
+        Count a TAKETHIS command and return True if the connection
+        should be reset.
+
+        """
+        profile = self.server.profile
+        if (profile is None or profile.reset is None
+                or not _message_id_re.match(arguments)):
+            return False
+        self._takethis_count += 1
+        return self._takethis_count % profile.reset == 0
+
+    def _command_delay(self, cmd):
+        """s._command_delay(CMD) -> SECONDS
+
+        Returns how long to wait before processing command CMD.
+
+        """
+        verb = cmd.split(None, 1)[0].upper() if len(cmd) > 0 else b''
+        return self.server.profile.command_delay(verb)
+
+    def _throttle(self):
+        """s._throttle() -> SECONDS
+
+        Returns how long to pause to keep within the bandwidth limit.
+
+        """
+        return self.server.profile.throttle(
+            self.bytes_sent + self.bytes_received,
+            time.monotonic() - self._started)
+
+    @staticmethod
+    def _linger(sock):
+        """_linger(SOCKET)
+
+        Arrange for SOCKET to be reset, rather than shut down cleanly,
+        when it is closed.
+
+        """
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                        struct.pack('ii', 1, 0))
+
+
+class TestConnection(_Faults, nntpbits.ServerConnection):
+    """inntest.TestConnection(SERVER) -> CONNECTION
+
+    Server connection for inntest.TestServer.  If the server's
+    profile attribute is an inntest.FaultProfile then it misbehaves
+    accordingly; otherwise it is the same as
+    nntpbits.ServerConnection.
+
+    """
+
+    def connected(self):
+        profile = self.server.profile
+        if profile is not None and profile.dropped():
+            return self.disconnect()
+        nntpbits.ServerConnection.connected(self)
+
+    def start_events(self, s):
+        nntpbits.ServerConnection.start_events(self, s)
+        profile = self.server.profile
+        if profile is not None and profile.dropped():
+            # Discard the greeting; the event loop will close the socket
+            self.w.data.clear()
+            self.finished = True
+
+    def command(self, cmd):
+        if self.server.profile is None:
+            return nntpbits.ServerConnection.command(self, cmd)
+        delay = self._command_delay(cmd)
+        if delay > 0:
+            time.sleep(delay)
+        nntpbits.ServerConnection.command(self, cmd)
+        delay = self._throttle()
+        if delay > 0:
+            time.sleep(delay)
+
+    def check(self, arguments):
+        code = self._fault(b'CHECK', arguments)
+        if code is not None:
+            return self.respond(code, arguments)
+        nntpbits.ServerConnection.check(self, arguments)
+
+    def ihave(self, arguments):
+        code = self._fault(b'IHAVE', arguments)
+        if code is not None:
+            return self.respond(code, detail=arguments)
+        nntpbits.ServerConnection.ihave(self, arguments)
+
+    def takethis(self, arguments):
+        if self._reset_due(arguments):
+            self._linger(self.sock)
+            if self.events:
+                self.w.data.clear()
+            self.finished = True
+            return
+        code = self._fault(b'TAKETHIS', arguments)
+        if code is not None:
+            return self.receive_article(
+                lambda article: self.respond(code, arguments), spill=True)
+        nntpbits.ServerConnection.takethis(self, arguments)
+
+
+class AsyncTestConnection(_Faults, nntpbits.AsyncServerConnection):
+    """inntest.AsyncTestConnection(SERVER) -> CONNECTION
+
+    As inntest.TestConnection but for inntest.AsyncTestServer.
+
+    """
+
+    async def run(self, reader, writer):
+        profile = self.server.profile
+        if profile is not None and profile.dropped():
+            writer.close()
+            return
+        await nntpbits.AsyncServerConnection.run(self, reader, writer)
+
+    async def command(self, cmd):
+        if self.server.profile is None:
+            return await nntpbits.AsyncServerConnection.command(self, cmd)
+        delay = self._command_delay(cmd)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await nntpbits.AsyncServerConnection.command(self, cmd)
+        delay = self._throttle()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def check(self, arguments):
+        code = self._fault(b'CHECK', arguments)
+        if code is not None:
+            return self.respond(code, arguments)
+        await nntpbits.AsyncServerConnection.check(self, arguments)
+
+    async def ihave(self, arguments):
+        code = self._fault(b'IHAVE', arguments)
+        if code is not None:
+            return self.respond(code, detail=arguments)
+        await nntpbits.AsyncServerConnection.ihave(self, arguments)
+
+    async def takethis(self, arguments):
+        if self._reset_due(arguments):
+            self._linger(self.w.writer.get_extra_info('socket'))
+            self.finished = True
+            return
+        code = self._fault(b'TAKETHIS', arguments)
+        if code is not None:
+            article = await self.receive_article_async(spill=True)
+            if isinstance(article, nntpbits.SpooledArticle):
+                article.close()
+            return self.respond(code, arguments)
+        await nntpbits.AsyncServerConnection.takethis(self, arguments)
@@ -77,8 +77,9 @@ def _check_posted(conn, ident):
         fail("article cannot be retrieved from group")
 
 
-def test_post_propagates(ident=None, description=b'posting propagation test'):
-    """inntest.Tests.test_post_propagates([ident=IDENT][description=SUBJECT])
+def test_post_propagates(ident=None, description=b'posting propagation test',
+                         profile=None):
+    """inntest.Tests.test_post_propagates([ident=IDENT][description=SUBJECT][profile=PROFILE])
 
     Posts to the test newsgroup and verifies that the article
     propagates to the test server (which is really us with a funny hat on).
@@ -88,22 +89,29 @@ def test_post_propagates(ident=None, description=b'posting propagation test'):
 
     If DESCRIPTION is specified then it will appear in the subject
     line.
+
+    If PROFILE is specified then the test server misbehaves according
+    to it; see inntest.FaultProfile.parse().
     """
-    _check_post_propagation(ident, description, test_post, features='peering')
+    _check_post_propagation(ident, description, test_post, features='peering',
+                            profile=profile)
 
 
 def _check_post_propagation(ident, description,
-                            do_post, features=[], behavior="accept", *args, **kwargs):
+                            do_post, features=[], behavior="accept",
+                            profile=None, *args, **kwargs):
     """inntest.Tests._check_post_propagation(IDENT, DESCRIPTION, DO_POST, ...)
 
     Call do_post(ident=IDENT, description=DESCRIPTION, ..) to post
     a message and then verify it is fed back to us.
 
+    PROFILE is passed to inntest.local_server().
+
     """
     ident = inntest.ident(ident)
     if features is None:
         features = 'peering'
-    with inntest.local_server(features=features) as s:
+    with inntest.local_server(features=features, profile=profile) as s:
         do_post(*args, ident=ident, description=description, **kwargs)
         next_trigger = 0
         limit = time.time()+inntest.timelimit
@@ -121,13 +129,12 @@ def _check_post_propagation(ident, description,
                     failhard("Trigger wait status: %#04x" % rc)
                 next_trigger = time.time()+inntest.trigger_timeout
             time.sleep(0.5)
-        ihave_checked = s.ihave_checked
-        ihave_submitted = s.ihave_submitted
+        submitted = ident in s.ihave_submitted
+        count = s.offer_count(ident)
     if behavior == 'check':
-        if ident not in ihave_submitted:
+        if not submitted:
             fail("article never propagated")
     if behavior == 'reject':
-        count = ihave_checked.count(ident)
         if count == 0:
             fail("article never submitted")
         if count > 1:
@@ -197,8 +204,9 @@ def test_ihave(ident=None, description=b"ihave test", _pathhost=None):
         _check_posted(conn, ident)
 
 
-def test_ihave_propagates(ident=None, description=b'ihave propagation test'):
-    """inntest.Tests.test_ihave_propagates([ident=IDENT][description=SUBJECT])
+def test_ihave_propagates(ident=None, description=b'ihave propagation test',
+                          profile=None):
+    """inntest.Tests.test_ihave_propagates([ident=IDENT][description=SUBJECT][profile=PROFILE])
 
     Feed a post to the test newsgroup and verifies that the article
     propagates to the test server (which is really us with a funny hat on).
@@ -208,11 +216,15 @@ def test_ihave_propagates(ident=None, description=b'ihave propagation test'):
 
     If DESCRIPTION is specified then it will appear in the subject
     line.
+
+    If PROFILE is specified then the test server misbehaves according
+    to it; see inntest.FaultProfile.parse().
     """
     # Need a nondefault pathhost so it will propagate back to us
     _check_post_propagation(ident, description,
                             test_ihave,
                             features=['ihave'],  # prevent use of streaming
+                            profile=profile,
                             _pathhost=b'nonesuch.' + inntest.domain)
 
 
@@ -265,6 +277,44 @@ def test_streaming_propagation_error_501(description=b'propagation error handlin
                             behavior='reject',
                             _pathhost=b'nonesuch.' + inntest.domain)
 
+
+def test_ihave_retry_deferred(description=b'ihave retry test'):
+    """inntest.Tests.test_ihave_retry_deferred([description=SUBJECT])
+
+    Verify that nntpbits.ClientConnection re-offers an article after
+    a 436 response when it has an offer cache, by feeding the local
+    test server, which defers the first offer.  The news server under
+    test is not involved.
+
+    If DESCRIPTION is specified then it will appear in the subject
+    line in the test message.
+    """
+    ident = inntest.ident(None)
+    article = [b'Path: ' + inntest.domain + b'!not-for-mail',
+               b'Newsgroups: ' + inntest.group,
+               b'From: ' + inntest.email,
+               b'Subject: [nntpbits] ' +
+               nntpbits._normalize(description) + b' (ignore)',
+               b'Message-ID: ' + ident,
+               b'Date: ' + inntest.newsdate(),
+               b'',
+               b'nntpbits.Test test posting']
+    # With this seed the first offer gets 436 and the second does not
+    profile = inntest.FaultProfile(faults={436: 0.5}, seed='0')
+    (host, port) = inntest.localserveraddress
+    if host in ('*', '*localhost'):
+        host = 'localhost'
+    with inntest.local_server(features=['ihave'], profile=profile) as s:
+        with nntpbits.ClientConnection((host, port), retries=2, backoff=0.01,
+                                       offer_cache=nntpbits.OfferCache()) \
+                as conn:
+            code = conn.ihave(article)
+        count = s.offer_count(ident)
+    if code != 235:
+        fail("IHAVE returned %d after %d retries" % (code, conn.retry_count))
+    if count != 1:
+        fail("article offered %d times after deferral" % count)
+
 # -----------------------------------------------------------------------------
 # Testing RFC4644 streaming commands
 
@@ -312,8 +362,9 @@ def test_takethis(ident=None, description=b"takethis test", _pathhost=None):
         _check_posted(conn, ident)
 
 
-def test_takethis_propagates(ident=None, description=b'takethis propagation test'):
-    """inntest.Tests.test_takethis_propagates([ident=IDENT][description=SUBJECT])
+def test_takethis_propagates(ident=None, description=b'takethis propagation test',
+                             profile=None):
+    """inntest.Tests.test_takethis_propagates([ident=IDENT][description=SUBJECT][profile=PROFILE])
 
     Feed a post to the test newsgroup and verifies that the article
     propagates to the test server.
@@ -323,9 +374,13 @@ def test_takethis_propagates(ident=None, description=b'takethis propagation test
 
     If DESCRIPTION is specified then it will appear in the subject
     line.
+
+    If PROFILE is specified then the test server misbehaves according
+    to it; see inntest.FaultProfile.parse().
     """
     # Need a nondefault pathhost so it will propagate back to us
     _check_post_propagation(ident, description,
                             test_takethis,
                             features=['peering'],
+                            profile=profile,
                             _pathhost=b'nonesuch.' + inntest.domain)
@@ -17,6 +17,7 @@
 import inntest
 import nntpbits
 import base64
+import collections
 import hashlib
 import os
 import re
@@ -24,6 +25,7 @@ import struct
 import threading
 import time
 from inntest.running import *
+from inntest.faults import *
 
 _seed = os.urandom(32)
 _sequence = 0
@@ -115,12 +117,92 @@ class TestServer(nntpbits.NewsServer):
     """inntest.TestServer() -> SERVER
 
     News server class that accepts all articles fed to it.
+
+    Optional arguments:
+    bounded -- if True, use a fixed amount of memory
+    max_ids -- number of message IDs remembered in bounded mode
+    spool -- path to an append-only file to store articles in
+    profile -- an inntest.FaultProfile, or a string to parse as one
+
+    By default every offered message ID is recorded in
+    s.ihave_checked and every accepted article is kept in
+    s.ihave_submitted.  In bounded mode, s.ihave_checked is None and
+    s.ihave_submitted maps message IDs to (DIGEST, SIZE, OFFSET)
+    tuples, where OFFSET is the article's position in the spool (or
+    None); only the most recent max_ids message IDs are remembered.
+
+    Use s.offer_count() and s.article() to query either mode.
+
+    If a profile is given then the server misbehaves as it describes,
+    provided the connection class is (a subclass of)
+    inntest.TestConnection or inntest.AsyncTestConnection.  It can be
+    changed by setting s.profile.
+
     """
 
-    def __init__(self, conncls=nntpbits.ServerConnection):
+    def __init__(self, conncls=TestConnection, bounded=False,
+                 max_ids=1 << 20, spool=None, profile=None):
         nntpbits.NewsServer.__init__(self, conncls=conncls)
-        self.ihave_checked = []
-        self.ihave_submitted = {}
+        if isinstance(profile, str):
+            profile = FaultProfile.parse(profile)
+        self.profile = profile
+        self.bounded = bounded
+        self.max_ids = max_ids
+        self.ihave_checked = None if bounded else []
+        self.ihave_submitted = collections.OrderedDict() if bounded else {}
+        self.offers = collections.OrderedDict() if bounded else {}
+        self.spool = None if spool is None else open(spool, 'ab+')
+
+    def close(self):
+        """s.close()
+
+        Close the spool file, if there is one.
+
+        """
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+    def _remember(self, table, ident, value):
+        """s._remember(TABLE, IDENT, VALUE)
+
+        Set TABLE[IDENT] = VALUE, discarding the least recently set
+        entry if that would exceed the limit in bounded mode.  Call
+        with s.lock held.
+
+        """
+        table[ident] = value
+        if self.bounded:
+            table.move_to_end(ident)
+            if len(table) > self.max_ids:
+                table.popitem(last=False)
+
+    def offer_count(self, ident):
+        """s.offer_count(IDENT) -> COUNT
+
+        Returns the number of times IDENT has been offered.
+
+        """
+        with self.lock:
+            return self.offers.get(ident, 0)
+
+    def article(self, ident):
+        """s.article(IDENT) -> LIST | None
+
+        Returns the accepted article IDENT as a list of bytes objects,
+        or None if it was not accepted or is not available.
+
+        """
+        with self.lock:
+            entry = self.ihave_submitted.get(ident)
+            if entry is None or not self.bounded:
+                return entry
+            (digest, size, offset) = entry
+            if offset is None or self.spool is None:
+                return None
+            self.spool.flush()
+            data = os.pread(self.spool.fileno(), size, offset)
+        return data.split(b'\r\n')[:-1]
 
     def __enter__(self):
         return self
@@ -129,12 +211,15 @@ class TestServer(nntpbits.NewsServer):
         if et is not None:
             log().debug("TestServer.__exit__: %s / %s / %s" % (et, ev, etb))
         nntpbits.stop()
+        self.close()
         return False
 
     def ihave_check(self, ident):
         # Capture the list of message IDs we've seen
         with self.lock:
-            self.ihave_checked.append(ident)
+            if self.ihave_checked is not None:
+                self.ihave_checked.append(ident)
+            self._remember(self.offers, ident, self.offers.get(ident, 0) + 1)
         # Reject message IDs that match the rejection pattern
         m = _reject_mid_re.match(ident)
         if m:
@@ -146,21 +231,53 @@ class TestServer(nntpbits.NewsServer):
         with self.lock:
             if ident in self.ihave_submitted:
                 return (435, b'Duplicate')
-            self.ihave_submitted[ident] = article
+            if not self.bounded:
+                self.ihave_submitted[ident] = article
+                return (235, b'OK')
+            data = b''.join(line + b'\r\n' for line in article)
+            offset = None
+            if self.spool is not None:
+                offset = self.spool.seek(0, os.SEEK_END)
+                self.spool.write(data)
+            self._remember(self.ihave_submitted, ident,
+                           (hashlib.sha256(data).digest(), len(data), offset))
         return (235, b'OK')
 
 
-def local_server(features=[]):
-    """inntest.local_server([FEATURES]) -> SERVER
+class AsyncTestServer(nntpbits.AsyncNewsServer, TestServer):
+    """inntest.AsyncTestServer() -> SERVER
+
+    As inntest.TestServer but served by an asyncio event loop.
+    """
+
+    def __init__(self, conncls=AsyncTestConnection, **kwargs):
+        TestServer.__init__(self, conncls=conncls, **kwargs)
+
+
+def local_server(features=[], profile=None):
+    """inntest.local_server([FEATURES][, PROFILE]) -> SERVER
 
     Create an inntest.TestServer and bind it to the local server
     address.  This is used by propagation tests.
 
+    The server is run as configured by inntest.localservermode.  It
+    misbehaves according to PROFILE (see inntest.TestServer) if it is
+    set, or else according to inntest.profile.
+
     """
-    ls = TestServer()
-    ls.listen_address(inntest.localserveraddress[0],
-                      inntest.localserveraddress[1],
-                      wait=False,
-                      daemon=True,
-                      features=features)
+    if profile is None:
+        profile = inntest.profile
+    if inntest.localservermode == 'asyncio':
+        ls = AsyncTestServer(profile=profile)
+    else:
+        ls = TestServer(profile=profile)
+    if inntest.localservermode == 'selector':
+        listen = ls.listen_selector
+    else:
+        listen = ls.listen_address
+    listen(inntest.localserveraddress[0],
+           inntest.localserveraddress[1],
+           wait=False,
+           daemon=True,
+           features=features)
     return ls
@@ -0,0 +1,155 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import bisect
+import re
+
+# Regexp matching a LIST ACTIVE or NEWGROUPS line
+_active_re = re.compile(b'^(\\S+) +(\\d+) +(\\d+) +(\\S+)$')
+
+
+class ActiveList(object):
+    """Parsed, indexed copy of a server's active file
+
+    Construction:
+    nntpbits.ActiveList() -> empty active list
+
+    Each group maps to a tuple (HIGH, LOW, STATUS) where HIGH and LOW
+    are ints and STATUS is a bytes object (b'y', b'm', b'=group', etc).
+
+    Use refresh() to load the list from a server and update() to
+    bring it up to date afterwards without transferring the whole
+    active file again.  ClientConnection.active() manages this
+    automatically.
+
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self._sorted = None
+        self.date = None
+
+    def __contains__(self, name):
+        return nntpbits._normalize(name) in self.groups
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __iter__(self):
+        return iter(self._names())
+
+    def lookup(self, name):
+        """a.lookup(NAME) -> (HIGH, LOW, STATUS) | None
+
+        Returns the details of group NAME, or None if it is not known.
+
+        """
+        return self.groups.get(nntpbits._normalize(name))
+
+    def match(self, wildmat):
+        """a.match(WILDMAT) -> LIST
+
+        Returns the sorted list of group names that match WILDMAT,
+        which may be a bytes object, a string or an nntpbits.Wildmat.
+
+        """
+        if not isinstance(wildmat, nntpbits.Wildmat):
+            wildmat = nntpbits.Wildmat(wildmat)
+        names = self._names()
+        if wildmat.literal is not None:
+            return [wildmat.literal] if wildmat.literal in self.groups else []
+        prefix = wildmat.prefix()
+        if prefix is None:
+            return [name for name in names if wildmat.match(name)]
+        result = []
+        for i in range(bisect.bisect_left(names, prefix), len(names)):
+            name = names[i]
+            if not name.startswith(prefix):
+                break
+            if wildmat.match(name):
+                result.append(name)
+        return result
+
+    def _names(self):
+        """a._names() -> LIST
+
+        Returns the sorted list of all group names.
+
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self.groups)
+        return self._sorted
+
+    def parse(self, lines):
+        """a.parse(LINES)
+
+        Add or replace groups from LIST ACTIVE or NEWGROUPS output.
+
+        """
+        for line in lines:
+            m = _active_re.match(line)
+            if not m:
+                raise Exception("malformed active line: %s" % line)
+            name = m.group(1)
+            if name not in self.groups:
+                self._sorted = None
+            self.groups[name] = (int(m.group(2)), int(m.group(3)),
+                                 m.group(4))
+
+    def refresh(self, conn, wildmat=None):
+        """a.refresh(CONN[, WILDMAT])
+
+        Reload the active list using LIST ACTIVE on the client
+        connection CONN.  If WILDMAT is specified then only matching
+        groups are reloaded; groups that match but were not returned
+        by the server are removed.
+
+        """
+        if wildmat is None:
+            self.date = conn.date()
+        lines = conn.list(b'ACTIVE', wildmat)
+        if wildmat is None:
+            self.groups = {}
+            self._sorted = None
+        else:
+            returned = set(line.split(b' ', 1)[0] for line in lines)
+            for name in self.match(wildmat):
+                if name not in returned:
+                    del self.groups[name]
+                    self._sorted = None
+        self.parse(lines)
+
+    def update(self, conn, wildmat=None):
+        """a.update(CONN[, WILDMAT])
+
+        Bring the active list up to date using the client connection
+        CONN.  Groups created since the last refresh() or update()
+        are added using NEWGROUPS.  If WILDMAT is specified then the
+        high and low water marks of matching groups are also
+        refreshed with LIST ACTIVE WILDMAT.
+
+        Groups removed from the server are only noticed by a refresh.
+
+        """
+        if self.date is None:
+            return self.refresh(conn)
+        date = conn.date()
+        new_groups = conn.newgroups(self.date)
+        self.parse(new_groups)
+        self.date = date
+        if wildmat is not None:
+            self.refresh(conn, wildmat)
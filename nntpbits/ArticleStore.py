@@ -0,0 +1,135 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import threading
+
+
+class ArticleStore(object):
+    """Article storage for news servers
+
+    Construction:
+    nntpbits.ArticleStore() -> store
+
+    Articles are stored in wire format: dot-stuffed, with each line
+    followed by CRLF, but without the terminating '.' line.  So a
+    server can send a stored article with a single write.  Retrieval
+    returns a memoryview of the stored bytes, which is only valid
+    until the article is removed or overwritten.
+
+    This implementation keeps articles in memory.  Subclasses (for
+    instance nntpbits.CycBuffStore) override store(), store_article(),
+    retrieve(), __contains__() and __len__(), and may override
+    locate(), sync() and close().
+
+    """
+
+    def __init__(self):
+        self.articles = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, ident):
+        with self.lock:
+            return nntpbits._normalize(ident) in self.articles
+
+    def __len__(self):
+        return len(self.articles)
+
+    def store(self, ident, lines):
+        """s.store(IDENT, LINES) -> BOOL
+
+        Store the article IDENT, which is a list of bytes objects.
+        Returns True on success and False if there is no space.  An
+        existing article with the same message ID is replaced.
+
+        """
+        data = ArticleStore.encode(lines)
+        with self.lock:
+            self.articles[nntpbits._normalize(ident)] = data
+        return True
+
+    def store_article(self, ident, header, article):
+        """s.store_article(IDENT, HEADER, ARTICLE) -> BOOL
+
+        As s.store(), but the article is made up of HEADER, a list of
+        bytes objects, and the body of ARTICLE, an
+        nntpbits.SpooledArticle.  The body is copied in wire format,
+        without being split into lines.
+
+        """
+        data = (ArticleStore.encode(header + [b''])
+                + article.read(article.body_offset()))
+        with self.lock:
+            self.articles[nntpbits._normalize(ident)] = data
+        return True
+
+    def retrieve(self, ident):
+        """s.retrieve(IDENT) -> VIEW | None
+
+        Returns the article IDENT as a memoryview of its wire format,
+        or None if it is not stored.
+
+        """
+        with self.lock:
+            data = self.articles.get(nntpbits._normalize(ident))
+        return None if data is None else memoryview(data)
+
+    def locate(self, ident):
+        """s.locate(IDENT) -> (FILE, OFFSET, LENGTH) | None
+
+        Returns the location of the wire format of article IDENT in a
+        file, for use with socket.sendfile(), or None if it is not
+        stored in a file.
+
+        """
+        return None
+
+    def sync(self):
+        """s.sync()
+
+        Ensure that stored articles are written to stable storage.
+
+        """
+        pass
+
+    def close(self):
+        """s.close()
+
+        Release any resources held by the store.
+
+        """
+        pass
+
+    @staticmethod
+    def encode(lines):
+        """ArticleStore.encode(LINES) -> BYTES
+
+        Convert a list of bytes objects to wire format.
+
+        """
+        return b''.join((b'.' + line if line[0:1] == b'.' else line)
+                        + b'\r\n' for line in lines)
+
+    @staticmethod
+    def decode(data):
+        """ArticleStore.decode(DATA) -> LIST
+
+        Convert wire format (a bytes-like object) back to a list of
+        bytes objects.
+
+        """
+        return [line[1:] if line[0:1] == b'.' else line
+                for line in bytes(data).split(b'\r\n')[:-1]]
@@ -0,0 +1,596 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import asyncio
+import logging
+from nntpbits.ClientConnection import _group_re
+from nntpbits.Connection import _allocate_key
+
+
+class AsyncClientConnection(object):
+    """asyncio NNTP client endpoint
+
+    Construction:
+    nntpbits.AsyncClientConnection() -> NNTP client object
+
+    Optional arguments:
+    user -- AUTHINFO username
+    password -- AUTHINFO password
+    response_timeout -- deadline for each response in seconds
+
+    Call (and await) the connect() method to establish a connection.
+
+    The command methods are coroutines with the same arguments and
+    results as the corresponding nntpbits.ClientConnection methods.
+    Commands may be issued concurrently from several tasks; they are
+    pipelined, i.e. each is sent immediately and the responses are
+    matched up in order.  POST and IHAVE need a reply before the
+    article can be sent, so they wait for earlier commands to finish
+    and hold up later ones.
+
+    An AsyncClientConnection may be used as an asynchronous context
+    manager.  If the connection is still live on exit from the suite,
+    a QUIT command is automatically issued.
+
+    """
+
+    parse = nntpbits.Connection.parse
+
+    def __init__(self, user=None, password=None, response_timeout=None):
+        self.user = nntpbits._normalize(user)
+        self.password = nntpbits._normalize(password)
+        self.response_timeout = response_timeout
+        self.reader = None
+        self.writer = None
+        self.log = logging.getLogger(__name__)
+        self.key = _allocate_key()
+        self._reset()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, et, ev, etb):
+        if self.writer is not None:
+            await self.quit()
+        return False
+
+    def _reset(self):
+        """n._reset()
+
+        Reset the state of this connection.
+
+        """
+        self.service = None
+        self.posting = None
+        self.capability_set = None
+        self.rfc4644 = None
+        self.current_group = None
+        self.response = None
+        self._broken = False
+        self._last = None
+        self._send_lock = asyncio.Lock()
+
+    # -------------------------------------------------------------------------
+    # Connection management
+
+    async def connect(self, address, timeout=None, reader=False):
+        """await n.connect(ADDRESS[, TIMEOUT][, reader=READER]) -> SERVICE
+
+        Connect to ADDRESS, a host,port tuple.  If READER is True then
+        the connection is switched to reader mode if necessary.
+
+        Returns True if the server offers service and False if it
+        refused the connection.
+
+        """
+        self.log.debug("Connecting to %s port %s" % address)
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(address[0], address[1]), timeout)
+        code, arg, _ = await self._wait()
+        # 3977 5.1.1
+        if code == 200 or code == 201:
+            self.service = True
+            self.posting = (code == 200)
+        elif code == 400 or code == 502:
+            self.service = False
+            await self.disconnect()
+            return False
+        else:
+            raise ValueError("invalid initial connection response: %s"
+                             % self.response)
+        if self.user is not None:
+            await self._authorize()
+        if reader:
+            await self.mode_reader()
+        return True
+
+    async def disconnect(self):
+        """await n.disconnect()
+
+        Disconnect from the server without sending QUIT.
+
+        """
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.reader = None
+        self.writer = None
+
+    async def quit(self):
+        """await n.quit()
+
+        Disconnect from the server.
+
+        """
+        try:
+            await self.transact(b'QUIT')
+        except nntpbits.ConnectionLost:
+            pass
+        await self.disconnect()
+        self._reset()
+
+    # -------------------------------------------------------------------------
+    # Low-level IO
+
+    def _send(self, line):
+        """n._send(LINE)
+
+        Queue a line for sending.  LINE may be a bytes object, a
+        string or a list, as for nntpbits.Connection.send_line().
+
+        """
+        if isinstance(line, list):
+            line = b' '.join(nntpbits._normalize(line))
+        line = nntpbits._normalize(line)
+        self.log.debug("%08x SEND %s" % (self.key, line))
+        self.writer.write(line + b'\r\n')
+
+    def _send_lines(self, lines):
+        """n._send_lines(LINES)
+
+        Queue a dot-stuffed article for sending.
+
+        """
+        lines = nntpbits._normalize(lines)
+        if isinstance(lines, bytes):
+            lines = lines.splitlines()
+        self.writer.write(b''.join((b'.' + line if line[0:1] == b'.'
+                                    else line) + b'\r\n'
+                                   for line in lines) + b'.\r\n')
+
+    async def _receive_line(self):
+        """await n._receive_line() -> LINE
+
+        Receive a line, without its line ending.
+
+        """
+        try:
+            line = await self.reader.readuntil(b'\r\n')
+        except asyncio.IncompleteReadError:
+            self._broken = True
+            raise nntpbits.ConnectionLost("connection closed by peer")
+        line = line[:-2]
+        self.log.debug("%08x RECV %s" % (self.key, line))
+        return line
+
+    async def _receive_lines(self):
+        """await n._receive_lines() -> LIST
+
+        Receive a dot-stuffed multi-line response.
+
+        """
+        lines = []
+        line = await self._receive_line()
+        while line != b'.':
+            if line[0:1] == b'.':
+                line = line[1:]
+            lines.append(line)
+            line = await self._receive_line()
+        return lines
+
+    async def _wait(self, multiline=()):
+        """await n._wait([MULTILINE]) -> CODE, ARGUMENT, LINES
+
+        Wait for a response.  If the response code is in MULTILINE
+        then a multi-line response is also read; otherwise LINES is
+        None.
+
+        """
+        async def read():
+            self.response = await self._receive_line()
+            code, arg = self.parse(self.response)
+            lines = None
+            if code in multiline:
+                lines = await self._receive_lines()
+            return code, arg, lines
+        if self.response_timeout is None:
+            return await read()
+        try:
+            return await asyncio.wait_for(read(), self.response_timeout)
+        except asyncio.TimeoutError:
+            self._broken = True
+            await self.disconnect()
+            raise nntpbits.CommandTimeout("read deadline exceeded")
+
+    def _enqueue(self):
+        """n._enqueue() -> TURN
+
+        Reserve the next place in the response order.  The caller
+        must hold the send lock and send its command before releasing
+        it.
+
+        """
+        if self.writer is None or self._broken:
+            raise nntpbits.ConnectionLost("connection not available")
+        previous = self._last
+        mine = asyncio.get_running_loop().create_future()
+        self._last = mine
+        return (previous, mine)
+
+    def _finished(self, turn, failed=False):
+        """n._finished(TURN[, FAILED])
+
+        Release the next command in the response order.
+
+        """
+        if failed:
+            self._broken = True
+        if not turn[1].done():
+            turn[1].set_result(None)
+
+    async def _collect(self, turn, multiline=()):
+        """await n._collect(TURN[, MULTILINE]) -> CODE, ARGUMENT, LINES
+
+        Wait for earlier commands' responses to be read and then read
+        the response for TURN.  If an earlier command failed or was
+        cancelled, its response may still be unread, so
+        nntpbits.ConnectionLost is raised instead.
+
+        """
+        try:
+            if turn[0] is not None:
+                await turn[0]
+            if self._broken:
+                raise nntpbits.ConnectionLost("earlier command failed")
+            result = await self._wait(multiline)
+        except BaseException:
+            self._finished(turn, True)
+            raise
+        self._finished(turn)
+        return result
+
+    async def _command(self, cmd, multiline=(), lines=None):
+        """await n._command(CMD[, MULTILINE][, LINES]) -> CODE, ARGUMENT, LINES
+
+        Send CMD (followed by LINES, dot-stuffed, if not None) and
+        wait for its response.  Other commands may be sent while
+        waiting.
+
+        """
+        async with self._send_lock:
+            turn = self._enqueue()
+            try:
+                self._send(cmd)
+                if lines is not None:
+                    self._send_lines(lines)
+                await self.writer.drain()
+            except BaseException:
+                self._finished(turn, True)
+                raise
+        return await self._collect(turn, multiline)
+
+    async def transact(self, cmd):
+        """await n.transact(COMMAND) -> CODE, ARGUMENT
+
+        Send a command and get the response.
+
+        """
+        code, arg, _ = await self._command(cmd)
+        return code, arg
+
+    async def _exclusive(self, cmd, lines, initial_response):
+        """await n._exclusive(CMD, LINES, INITIAL_RESPONSE) -> CODE, ARGUMENT
+
+        Send CMD and, if the response is INITIAL_RESPONSE, send LINES
+        and wait for the final response.  Other commands are held up
+        until this is complete.
+
+        """
+        async with self._send_lock:
+            turn = self._enqueue()
+            try:
+                self._send(cmd)
+                await self.writer.drain()
+                if turn[0] is not None:
+                    await turn[0]
+                code, arg, _ = await self._wait()
+                if code == initial_response:
+                    self._send_lines(lines)
+                    await self.writer.drain()
+                    code, arg, _ = await self._wait()
+            except BaseException:
+                self._finished(turn, True)
+                raise
+            self._finished(turn)
+            return code, arg
+
+    def _failed(self, command):
+        if isinstance(command, bytes):
+            command = str(command, 'ascii')
+        raise Exception("%s command failed: %s"
+                        % (command, str(self.response, 'ascii')))
+
+    async def _authorize(self):
+        code, arg = await self.transact([b'AUTHINFO', b'USER', self.user])
+        if code == 281:
+            return True
+        if code == 381 and self.password is not None:
+            code, arg = await self.transact([b'AUTHINFO', b'PASS',
+                                             self.password])
+            if code == 281:
+                return True
+        self.log.error("authentication failed: %s" % self.response)
+        return False
+
+    # -------------------------------------------------------------------------
+    # CAPABILITIES & MODE READER (3977 5.2, 5.3)
+
+    async def capabilities(self):
+        """await n.capabilities() -> SET
+
+        Return the server's capabilities, as a set of bytes objects.
+
+        """
+        if self.capability_set is None:
+            code, arg, lines = await self._command(b'CAPABILITIES', (101,))
+            self.capability_set = set()
+            if code == 101:
+                for cap in lines[1:]:
+                    self.capability_set.add(cap.split()[0])
+        return self.capability_set
+
+    async def mode_reader(self):
+        """await n.mode_reader()
+
+        Switch to reader mode if the server needs it.
+
+        """
+        caps = await self.capabilities()
+        if b'READER' in caps:
+            return
+        code, arg = await self.transact(b'MODE READER')
+        if code == 200 or code == 201:
+            self.posting = (code == 200)
+        else:
+            self._failed('MODE READER')
+        self.capability_set = None
+        self.rfc4644 = None
+
+    # -------------------------------------------------------------------------
+    # GROUP (3977 6.1.1)
+
+    async def group(self, group):
+        """await n.group(NAME) -> (count, low, high)
+
+        Selects the group NAME.
+
+        """
+        group = nntpbits._normalize(group)
+        code, arg = await self.transact(b'GROUP ' + group)
+        if code == 211:
+            m = _group_re.match(arg)
+            if not m:
+                raise Exception("GROUP response malformed: %s"
+                                % self.response)
+            self.current_group = group
+            return (int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        elif code == 411:
+            raise Exception("Group %s does not exist" % str(group))
+        else:
+            self._failed('GROUP')
+
+    # -------------------------------------------------------------------------
+    # STAT, ARTICLE, HEAD, BODY (3977 6.2)
+
+    async def stat(self, ident=None):
+        """await n.stat([ID|NUMBER]) -> NUMBER,ID,None | None,None,None
+
+        See nntpbits.ClientConnection.stat().
+
+        """
+        return await self._article(ident, b'STAT', 223)
+
+    async def article(self, ident=None):
+        """await n.article([ID|NUMBER]) -> NUMBER,IDENT,LINES | None,None,None
+
+        See nntpbits.ClientConnection.article().
+
+        """
+        return await self._article(ident, b'ARTICLE', 220)
+
+    async def head(self, ident=None):
+        """await n.head([ID|NUMBER]) -> NUMBER,IDENT,LINES | None,None,None
+
+        See nntpbits.ClientConnection.head().
+
+        """
+        return await self._article(ident, b'HEAD', 221)
+
+    async def body(self, ident=None):
+        """await n.body([ID|NUMBER]) -> NUMBER,IDENT,LINES | None,None,None
+
+        See nntpbits.ClientConnection.body().
+
+        """
+        return await self._article(ident, b'BODY', 222)
+
+    async def _article(self, ident, command, response):
+        if isinstance(ident, int):
+            ident = "%d" % ident
+        if ident is None:
+            cmd = command
+        else:
+            cmd = command + b' ' + nntpbits._normalize(ident)
+        multiline = () if response == 223 else (response,)
+        code, arg, lines = await self._command(cmd, multiline)
+        if code == response:
+            m = nntpbits.ClientConnection._stat_re.match(arg)
+            if not m:
+                raise Exception("%s command malformed response: %s"
+                                % (str(command), arg))
+            return int(m.group(1)), m.group(2), lines
+        elif code in nntpbits.ClientConnection._select_noarticle \
+                or code == 430:
+            return None, None, None
+        else:
+            self._failed(command)
+
+    # -------------------------------------------------------------------------
+    # POST & IHAVE (3977 6.3.1-2)
+
+    async def post(self, article):
+        """await n.post(ARTICLE) -> CODE
+
+        See nntpbits.ClientConnection.post().
+
+        """
+        return await self._post(article, b'POST', None, 340, 240)
+
+    async def ihave(self, article, ident=None):
+        """await n.ihave(ARTICLE[, IDENT]) -> CODE
+
+        See nntpbits.ClientConnection.ihave().
+
+        """
+        ident = nntpbits.ClientConnection._ident(article, ident)
+        return await self._post(article, b'IHAVE', ident, 335, 235)
+
+    async def _post(self, article, command, ident, initial_response,
+                    ok_response):
+        cmd = command if ident is None else command + b' ' + ident
+        code, arg = await self._exclusive(cmd, article, initial_response)
+        if code == 435 or code == 436 or code == 437:
+            return code
+        if code != ok_response:
+            self._failed(command)
+        return code
+
+    # -------------------------------------------------------------------------
+    # OVER & HDR (3977 8.3-8.6)
+
+    async def over(self, low, high=None):
+        """await n.over(LOW, HIGH) -> LIST
+        await n.over(ID) -> LIST
+
+        See nntpbits.ClientConnection.over().
+
+        """
+        if high is not None:
+            cmd = bytes('OVER %d-%d' % (low, high), 'ascii')
+        else:
+            cmd = b'OVER ' + nntpbits._normalize(low)
+        code, arg, lines = await self._command(cmd, (224,))
+        if code == 224:
+            return lines
+        elif code == 423:
+            return []
+        elif code == 430 or code == 420:
+            return None
+        else:
+            self._failed('OVER')
+
+    async def hdr(self, header, low, high=None):
+        """await n.hdr(HEADER, LOW, HIGH) -> LIST
+        await n.hdr(HEADER, ID) -> LIST
+
+        See nntpbits.ClientConnection.hdr().
+
+        """
+        cmd = [b'HDR', nntpbits._normalize(header)]
+        if high is not None:
+            cmd.append(bytes("%d-%d" % (low, high), 'ascii'))
+        else:
+            cmd.append(nntpbits._normalize(low))
+        code, arg, lines = await self._command(cmd, (225,))
+        if code == 225:
+            result = []
+            for line in lines:
+                m = nntpbits.ClientConnection._hdr_re.match(line)
+                if not m:
+                    raise Exception("HDR response malformed: %s" % line)
+                result.append([int(m.group(1)), m.group(2)])
+            return result
+        elif code == 423:
+            return []
+        elif code == 430 or code == 420:
+            return None
+        else:
+            self._failed('HDR')
+
+    # -------------------------------------------------------------------------
+    # MODE STREAM, CHECK, TAKETHIS (4644)
+
+    async def streaming(self):
+        """await n.streaming() -> BOOL
+
+        Return True if the RFC4644 streaming commands are available.
+
+        """
+        if self.rfc4644 is None:
+            if b'STREAMING' in await self.capabilities():
+                self.rfc4644 = True
+            else:
+                code, arg = await self.transact(b'MODE STREAM')
+                self.rfc4644 = (code == 203)
+        return self.rfc4644
+
+    async def check(self, article=None, ident=None):
+        """await n.check(article=ARTICLE, ident=IDENT) -> BOOL|None
+
+        See nntpbits.ClientConnection.check().
+
+        """
+        ident = nntpbits.ClientConnection._ident(article, ident)
+        code, arg = await self.transact([b'CHECK', ident])
+        if code == 238:
+            return True
+        if code == 438:
+            return False
+        if code == 431:
+            return None
+        self._failed('CHECK')
+
+    async def takethis(self, article, ident=None):
+        """await n.takethis(ARTICLE[, ident=IDENT]) -> BOOL
+
+        See nntpbits.ClientConnection.takethis().
+
+        TAKETHIS does not wait for a reply before sending the
+        article, so it can be pipelined freely.
+
+        """
+        ident = nntpbits.ClientConnection._ident(article, ident)
+        code, arg, _ = await self._command([b'TAKETHIS', ident],
+                                           lines=article)
+        if code == 239:
+            return True
+        if code == 439:
+            return False
+        self._failed('TAKETHIS')
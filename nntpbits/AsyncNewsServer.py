@@ -0,0 +1,174 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import asyncio
+import threading
+import time
+import traceback
+
+
+class AsyncNewsServer(nntpbits.NewsServer):
+    """AsyncNewsServer() -> NNTP server object
+    AsyncNewsServer(CLASS) -> NNTP server object
+
+    Constructs a news server based on asyncio.
+
+    As with nntpbits.NewsServer, this is intended to act as a base
+    class.  The ihave_check() and ihave() methods may be overridden
+    with coroutines.
+
+    The CLASS argument should be a subclass of
+    nntpbits.AsyncServerConnection.
+
+    Use start() and shutdown() from within an event loop, or
+    listen_address() to run a loop in a separate thread.
+
+    """
+
+    # Maximum line length accepted from peers
+    _line_limit = 1 << 20
+
+    def __init__(self, conncls=nntpbits.AsyncServerConnection,
+                 max_connections=None, max_commands=None,
+                 spill_threshold=None, spill_directory=None,
+                 max_article_size=None):
+        nntpbits.NewsServer.__init__(self, conncls=conncls,
+                                     max_connections=max_connections,
+                                     max_commands=max_commands,
+                                     spill_threshold=spill_threshold,
+                                     spill_directory=spill_directory,
+                                     max_article_size=max_article_size)
+
+    async def start(self, address, port, features=[]):
+        """await ns.start(ADDRESS, PORT[, features=FEATURES])
+
+        Start listening on ADDRESS:PORT, interpreted as for
+        ns.listen_address().  Connections are served by tasks in the
+        running event loop.
+
+        """
+        self._servers = []
+        self._tasks = set()
+
+        async def connection(reader, writer):
+            peer = writer.get_extra_info('peername')
+            if not self.admit('connections'):
+                self.log.info("%x: refused %s"
+                              % (threading.get_ident(), peer))
+                writer.write(b"400 Too many connections\r\n")
+                writer.close()
+                return
+            task = asyncio.current_task()
+            self._tasks.add(task)
+            try:
+                self.log.info("%x: connected %s"
+                              % (threading.get_ident(), peer))
+                conn = self.conncls(self)
+                conn.enable(features)
+                await conn.run(reader, writer)
+                self.log.info("%x: disconnected %s"
+                              % (threading.get_ident(), peer))
+            except asyncio.CancelledError:
+                self.log.debug("%x: client cancelled %s"
+                               % (threading.get_ident(), peer))
+                writer.close()
+            except Exception as e:
+                self.log.error("%x: client error: %s %s"
+                               % (threading.get_ident(), e, peer))
+                self.log.error("%x: %s"
+                               % (threading.get_ident(),
+                                  traceback.format_exc()))
+                writer.close()
+            finally:
+                self._tasks.discard(task)
+                self.release('connections')
+        for s, sockaddr in self._bind(address, port):
+            self._servers.append(await asyncio.start_server(
+                connection, sock=s, limit=AsyncNewsServer._line_limit))
+
+    async def shutdown(self, timeout=5):
+        """await ns.shutdown([TIMEOUT])
+
+        Stop accepting connections and wait up to TIMEOUT seconds for
+        existing connections to finish.  Any that remain are
+        cancelled.
+
+        """
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        tasks = set(self._tasks)
+        if len(tasks) > 0:
+            (done, pending) = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def listen_address(self, address, port, wait=False, daemon=True,
+                       features=[]):
+        """ns.listen_address(ADDRESS, PORT[, wait=WAIT][, daemon=DAEMON], [features=FEATURES])
+
+        Start listening on ADDRESS:PORT, with an event loop running in
+        a subthread.  The arguments have the same meaning as for
+        nntpbits.NewsServer.listen_address().
+
+        The loop shuts down (see shutdown()) when nntpbits.stop() is
+        called, giving existing connections the default time to
+        finish.
+
+        """
+        started = threading.Event()
+        errors = []
+
+        async def run():
+            try:
+                await self.start(address, port, features=features)
+            finally:
+                started.set()
+            try:
+                while True:
+                    await asyncio.sleep(0.25)
+                    nntpbits._maybe_stop()
+            finally:
+                await self.shutdown()
+
+        def worker():
+            try:
+                self.log.info("%x: event loop started %s:%s"
+                              % (threading.get_ident(), address, port))
+                asyncio.run(run())
+            except nntpbits._Stop:
+                self.log.debug("%x: event loop stopped"
+                               % threading.get_ident())
+            except BaseException as e:
+                errors.append(e)
+                self.log.error("%x: event loop error %s"
+                               % (threading.get_ident(), e))
+                self.log.error("%x: %s"
+                               % (threading.get_ident(),
+                                  traceback.format_exc()))
+            finally:
+                started.set()
+                nntpbits.finished_thread()
+        t = threading.Thread(target=worker, daemon=daemon)
+        nntpbits.start_thread(t)
+        started.wait()
+        if len(errors) > 0:
+            raise errors[0]
+        while wait:
+            nntpbits._maybe_stop()
+            time.sleep(1)
@@ -0,0 +1,352 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import asyncio
+import inspect
+import time
+from nntpbits.ServerConnection import _command_re, _message_id_re
+
+
+class _StreamOutput(object):
+    """Output file object wrapping an asyncio.StreamWriter
+
+    Writes are queued in the transport; the connection drains it
+    after each command.
+
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, bs):
+        self.writer.write(bs)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncServerConnection(nntpbits.ServerConnection):
+    """asyncio NNTP server endpoint
+
+    Construction:
+    nntpbits.AsyncServerConnection(SERVER) -> NNTP server connection object
+
+    SERVER is the news server backend, usually a subclass of
+    nntpbits.AsyncNewsServer.  Its ihave_check(), ihave(),
+    post_check() and post() methods may be ordinary methods or
+    coroutines.
+
+    Await the run() method with an asyncio stream reader and writer to
+    serve a connection.
+
+    Command implementations may be ordinary methods, as for
+    nntpbits.ServerConnection, or coroutines.  Coroutines must use
+    await s.receive_lines_async() rather than s.receive_lines().
+
+    """
+
+    async def run(self, reader, writer):
+        """await s.run(READER, WRITER)
+
+        Main NNTP server loop.  Returns after the peer disconnects or
+        sends the QUIT command.
+
+        """
+        self.reader = reader
+        self.r = None
+        self.w = _StreamOutput(writer)
+        # Input is buffered by the StreamReader, not here
+        self.buffer = b''
+        self.buffer_index = 0
+        try:
+            self.respond(200)
+            await writer.drain()
+            line = await self.receive_line_async()
+            while line is not None:
+                await self.command(line)
+                await writer.drain()
+                if self.finished:
+                    break
+                line = await self.receive_line_async()
+        except BrokenPipeError:
+            pass
+        except ConnectionResetError:
+            pass
+        finally:
+            self.disconnect()
+
+    async def receive_line_async(self):
+        """await s.receive_line_async() -> LINE
+
+        Receive a line as a bytes object, without the EOL sequence.
+
+        Returns None if there is no more input.
+
+        """
+        try:
+            line = await self.reader.readuntil(self.eol)
+        except asyncio.IncompleteReadError:
+            return None
+        self.bytes_received += len(line)
+        line = line[:-len(self.eol)]
+        self.log.debug("%08x RECV %s" % (self.key, line))
+        return line
+
+    async def receive_lines_async(self):
+        """await s.receive_lines_async() -> LIST
+
+        Receive a dot-stuffed sequence of lines as a list of bytes
+        objects.
+
+        Returns None if there is no more input.
+
+        """
+        lines = []
+        line = await self.receive_line_async()
+        while line != b".":
+            if line is None:
+                return None
+            if line[0:1] == b'.':
+                line = line[1:]
+            lines.append(line)
+            line = await self.receive_line_async()
+        return lines
+
+    async def receive_article_async(self, spill=False):
+        """await s.receive_article_async([SPILL]) -> ARTICLE
+
+        Receive a dot-stuffed article.  As for
+        nntpbits.ServerConnection.receive_article(), ARTICLE is an
+        nntpbits.SpooledArticle if SPILL is True and the server's
+        spill_threshold is not None, and a list of bytes objects
+        otherwise; and the server's max_article_size is applied if
+        SPILL is True.  The caller must close a SpooledArticle.
+
+        Returns None if there is no more input.
+
+        """
+        if self._timings is None:
+            return await self._receive_article_async(spill)
+        start = time.monotonic()
+        try:
+            return await self._receive_article_async(spill)
+        finally:
+            self._timings[0] += time.monotonic() - start
+
+    async def _receive_article_async(self, spill):
+        """await s._receive_article_async(SPILL) -> ARTICLE
+
+        Implementation of s.receive_article_async().
+
+        """
+        if not spill or (self.server.spill_threshold is None
+                         and self.server.max_article_size is None):
+            return await self.receive_lines_async()
+        self._start_spool()
+        self._skip = 0
+        data = bytearray()
+        while True:
+            try:
+                line = await self.reader.readuntil(self.eol)
+            except asyncio.IncompleteReadError:
+                self._receiving.close()
+                self._receiving = None
+                return None
+            self.bytes_received += len(line)
+            if line == b'.\r\n':
+                self._spool_write(data)
+                return self._finish_spool()
+            if not self._oversized:
+                data += line
+                if len(data) >= 65536:
+                    self._spool_write(data)
+                    data.clear()
+
+    async def _hook(self, method, *args):
+        """await s._hook(METHOD, ARGS...) -> RESULT
+
+        Call a server hook, awaiting the result if it is a coroutine.
+
+        """
+        result = method(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _admitted(self, hook, *args, force=False):
+        """await s._admitted(HOOK, ARGS...[, force=FORCE]) -> RESULT | None
+
+        As nntpbits.ServerConnection._admitted(), but awaiting HOOK if
+        it is a coroutine.
+
+        """
+        if not self.server.admit('commands', force):
+            return None
+        try:
+            return await self._call_hook(hook, *args)
+        finally:
+            self.server.release('commands')
+
+    async def _call_hook(self, hook, *args):
+        """await s._call_hook(HOOK, ARGS...) -> RESULT
+
+        As nntpbits.ServerConnection._call_hook(), but awaiting HOOK
+        if it is a coroutine.
+
+        """
+        if self._timings is None:
+            return await self._hook(hook, *args)
+        start = time.monotonic()
+        try:
+            return await self._hook(hook, *args)
+        finally:
+            self._timings[1] += time.monotonic() - start
+
+    async def _drain(self):
+        """await s._drain()
+
+        Wait for queued output to be sent, adding the time taken to
+        the current command's respond time if it is being timed.
+
+        """
+        if self._timings is None:
+            return await self.w.writer.drain()
+        start = time.monotonic()
+        await self.w.writer.drain()
+        self._timings[2] += time.monotonic() - start
+
+    async def command(self, cmd):
+        """await s.command(CMD)
+
+        Process a command (as a bytes object).  See
+        nntpbits.ServerConnection.command().
+
+        """
+        m = _command_re.match(cmd)
+        if not m:
+            return self.respond(500, "Malformed command")
+        command = m.group(1).upper()
+        arguments = m.group(2)
+        if command not in self.commands:
+            return self.respond(500, detail=command)
+        if self.server.metrics is None and self.server.slowlog is None:
+            return await self._hook(self.commands[command], arguments)
+        self._begin_observation(command, cmd, arguments)
+        try:
+            await self._hook(self.commands[command], arguments)
+            # Include sending the response in the timing
+            await self._drain()
+        finally:
+            self._end_observation()
+
+    async def ihave(self, arguments):
+        """await s.ihave(ARGUMENTS)
+
+        Implementation of the NNTP IHAVE command.
+
+        """
+        if not _message_id_re.match(arguments):
+            return self.respond(501)
+        result = await self._admitted(self.server.ihave_check, arguments)
+        if result is None:
+            return self.respond(436, detail=arguments)
+        (rc, argument) = result
+        self.respond(rc, argument)
+        if rc == 335:
+            await self._drain()
+            article = await self.receive_article_async(spill=True)
+            try:
+                if self._oversized:
+                    (rc, argument) = (437, "Article too large")
+                else:
+                    (rc, argument) = await self._admitted(
+                        self.server.ihave, arguments, article, force=True)
+            finally:
+                if isinstance(article, nntpbits.SpooledArticle):
+                    article.close()
+            self.respond(rc, argument)
+
+    async def check(self, arguments):
+        """await s.check(ARGUMENTS)
+
+        Implementation of the NNTP CHECK command.
+
+        """
+        if not _message_id_re.match(arguments):
+            return self.respond(501)
+        result = await self._admitted(self.server.ihave_check, arguments)
+        if result is None:
+            return self.respond(431, arguments)
+        (rc, argument) = result
+        if rc == 335:
+            return self.respond(238, arguments)
+        elif rc == 435:
+            return self.respond(438, arguments)
+        elif rc == 436:
+            return self.respond(431, arguments)
+        return self.respond(rc, argument)
+
+    async def takethis(self, arguments):
+        """await s.takethis(ARGUMENTS)
+
+        Implementation of the NNTP TAKETHIS command.
+
+        """
+        if not _message_id_re.match(arguments):
+            return self.respond(501)
+        article = await self.receive_article_async(spill=True)
+        try:
+            if self._oversized:
+                return self.respond(439, arguments)
+            (rc, argument) = await self._admitted(self.server.ihave_check,
+                                                  arguments, force=True)
+            if rc == 335:
+                (rc, argument) = await self._admitted(self.server.ihave,
+                                                      arguments, article,
+                                                      force=True)
+                if rc == 235:
+                    return self.respond(239, arguments)
+                if rc == 437:
+                    return self.respond(439, arguments)
+            elif rc == 435:
+                return self.respond(439, arguments)
+        finally:
+            if isinstance(article, nntpbits.SpooledArticle):
+                article.close()
+        if rc == 436:
+            self.respond(400)
+            self.finished = True
+        return self.respond(rc, argument)
+
+    async def post(self, arguments):
+        """await s.post(ARGUMENTS)
+
+        Implementation of the NNTP POST command.
+
+        """
+        if arguments != b'':
+            return self.respond(501)
+        (rc, argument) = await self._call_hook(self.server.post_check)
+        self.respond(rc, argument)
+        if rc == 340:
+            await self._drain()
+            article = await self.receive_article_async()
+            (rc, argument) = await self._call_hook(self.server.post, article)
+            self.respond(rc, argument)
@@ -15,14 +15,39 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import nntpbits
+import contextlib
+import functools
 import logging
+import random
 import re
 import socket
+import time
 
 _group_re = re.compile(b"^([0-9]+) ([0-9]+) ([0-9]+) (.*)$")
 _message_id_re = re.compile(b"Message-ID:\\s*(<.*@.*>)\\s*$", re.IGNORECASE)
 
 
+def _retryable(*retry_results):
+    """@_retryable([RESULT, ...])
+
+    Mark a ClientConnection method as safe to repeat after a
+    reconnect.  If the method returns one of the RESULT values it is
+    retried (without reconnecting) as well.
+
+    Has no effect unless the connection was created with a nonzero
+    retries argument.
+
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.retries == 0 or self._retrying:
+                return method(self, *args, **kwargs)
+            return self._with_retries(method, retry_results, args, kwargs)
+        return wrapper
+    return decorate
+
+
 class ClientConnection(nntpbits.Connection):
     """NNTP client endpoint
 
@@ -35,6 +60,12 @@ class ClientConnection(nntpbits.Connection):
     source_address -- host,port tuple to bind local endpoint to
     nnrp_user -- NNRP username
     nnrp_password -- NNRP password
+    retries -- number of times to retry after a failure (default 0)
+    backoff -- initial retry delay in seconds
+    max_backoff -- upper limit on the retry delay in seconds
+    response_timeout -- default deadline for response lines in seconds
+    lines_timeout -- default deadline for multi-line responses in seconds
+    offer_cache -- nntpbits.OfferCache for the peer
 
     Alternatively call the connect() method to actually establish a
     connection.
@@ -43,16 +74,50 @@ class ClientConnection(nntpbits.Connection):
     connection is still live on exit from the suite, a QUIT command is
     automatically issued.
 
+    If retries is nonzero then a 400 response, a lost connection or
+    (for IHAVE) a 436 response cause idempotent commands to be
+    retried after a randomized exponential backoff, reconnecting and
+    restoring reader mode, the selected group and the current article
+    first if necessary.
+    The retry_count and reconnect_count attributes count how often
+    this happened.
+
+    If a response line or a complete multi-line response does not
+    arrive within its deadline then nntpbits.CommandTimeout is raised
+    and the connection is closed.  See also the timeouts() method.
+
+    Use add_observer() to collect timing information about each command.
+
+    If offer_cache is set then check(), ihave() and takethis() record
+    the peer's responses in it and skip offering message IDs that
+    the peer recently accepted or refused, or asked to defer.
+
     """
 
     def __init__(self, address=None, timeout=None, source_address=None,
                  stoppable=False, nnrp_user=None, nnrp_password=None,
-                 nntp_user=None, nntp_password=None):
+                 nntp_user=None, nntp_password=None,
+                 retries=0, backoff=0.5, max_backoff=30,
+                 response_timeout=None, lines_timeout=None,
+                 offer_cache=None):
         nntpbits.Connection.__init__(self, stoppable=stoppable)
         self.nnrp_user = nntpbits._normalize(nnrp_user)
         self.nnrp_password = nntpbits._normalize(nnrp_password)
         self.nntp_user = nntpbits._normalize(nntp_user)
         self.nntp_password = nntpbits._normalize(nntp_password)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.response_timeout = response_timeout
+        self.lines_timeout = lines_timeout
+        self.offer_cache = offer_cache
+        self.retry_count = 0
+        self.reconnect_count = 0
+        self._retrying = False
+        self.address = None
+        self.active_list = None
+        self.observers = []
+        self._observation = None
         self._reset()
         self.log = logging.getLogger(__name__)
         if address is not None:
@@ -82,6 +147,7 @@ class ClientConnection(nntpbits.Connection):
         self.capability_set = None
         self.overview_fmt = None
         self.current_group = None
+        self.current_article = None
 
     def connect(self, address, timeout=None, source_address=None):
         """n.connect(address[, timeout[, source_address]])
@@ -96,9 +162,84 @@ class ClientConnection(nntpbits.Connection):
         source_address -- host,port tuple to bind local endpoint to
 
         """
-        self.log.debug("Connecting to %s port %s" % address)
-        self.socket(socket.create_connection(address, timeout,
-                                             source_address))
+        self.address = address
+        self.timeout = timeout
+        self.source_address = source_address
+        if self.retries > 0:
+            self._with_retries(None, (), (), {})
+        else:
+            self._open()
+
+    def _open(self):
+        """n._open()
+
+        Connect to the server recorded by connect().
+
+        """
+        self.log.debug("Connecting to %s port %s" % self.address)
+        self.socket(socket.create_connection(self.address, self.timeout,
+                                             self.source_address))
+
+    def reconnect(self):
+        """n.reconnect()
+
+        Drop any existing connection and connect to the same server
+        again.  If reader mode was in effect, a group was selected or
+        an article number was current, these are restored.
+
+        """
+        group = self.current_group
+        article = self.current_article
+        reader = self.reader
+        self.disconnect()
+        self._reset()
+        self._open()
+        if not self.service:
+            raise nntpbits.ConnectionLost("service unavailable: %s"
+                                          % str(self.response, 'ascii'))
+        if reader:
+            self._require_reader()
+        if group is not None:
+            self.group(group)
+            if article is not None:
+                self._select(b'STAT', bytes("%d" % article, 'ascii'))
+
+    def _with_retries(self, method, retry_results, args, kwargs):
+        """n._with_retries(METHOD, RETRY_RESULTS, ARGS, KWARGS) -> RESULT
+
+        Call METHOD(*ARGS, **KWARGS), reconnecting and retrying
+        on failure up to n.retries times.  If METHOD is None then
+        just (re)connect.
+
+        """
+        attempt = 0
+        while True:
+            self._retrying = True
+            try:
+                if self.w is None and self.address is not None:
+                    if attempt > 0 or method is not None:
+                        self.reconnect_count += 1
+                    self.reconnect()
+                if method is None:
+                    return None
+                result = method(self, *args, **kwargs)
+                if attempt >= self.retries or result not in retry_results:
+                    return result
+                reason = "response %s" % result
+            except (OSError, nntpbits.ConnectionLost) as e:
+                self.disconnect()
+                if attempt >= self.retries:
+                    raise
+                reason = e
+            finally:
+                self._retrying = False
+            attempt += 1
+            self.retry_count += 1
+            delay = random.uniform(0, min(self.max_backoff,
+                                          self.backoff * 2 ** attempt))
+            self.log.info("retry %d/%d in %.2fs: %s"
+                          % (attempt, self.retries, delay, reason))
+            time.sleep(delay)
 
     def connected(self):
         """n.connected()
@@ -126,18 +267,194 @@ class ClientConnection(nntpbits.Connection):
         self.capability_list = None
         return self.service
 
-    def transact(self, *args):
-        """n.transact(COMMAND) -> CODE,ARG
+    # -------------------------------------------------------------------------
+    # Observers
+
+    def add_observer(self, observer):
+        """n.add_observer(OBSERVER)
+
+        Call OBSERVER(OBSERVATION) after each command, where
+        OBSERVATION is an nntpbits.Observation.
+
+        Observations are delivered as soon as the final response has
+        been received (including any multi-line part).  If a
+        multi-line response is not read, its observation is delivered
+        when the next command is sent or the connection is closed.
+
+        The first_byte time is when the first bytes of the response
+        were read from the connection; if they arrived along with the
+        end of an earlier response, it is when the status line was
+        parsed.
+
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        """n.remove_observer(OBSERVER)
+
+        Stop calling OBSERVER.
+
+        """
+        self.observers.remove(observer)
+
+    def _observe_begin(self, cmd):
+        """n._observe_begin(COMMAND)
+
+        Start timing COMMAND.
+
+        """
+        if not self.observers:
+            return
+        self._observe_end()
+        if isinstance(cmd, list):
+            cmd = cmd[0]
+        verb = nntpbits._normalize(cmd).split(b' ', 1)[0].upper()
+        o = nntpbits.Observation(self.key, verb, time.monotonic())
+        o.sent = self.bytes_sent
+        o.received = self.bytes_received
+        self._observation = o
+
+    # Responses followed by a multi-line part (3977 3.4.1)
+    _multiline = set([100, 101, 215, 220, 221, 222, 224, 225, 230, 231])
+    # Responses after which the client sends more (3977 6.3)
+    _continue = set([335, 340])
+
+    def _observe_response(self, code):
+        """n._observe_response(CODE)
+
+        Record the arrival of a response to the current command, and
+        finish timing it if nothing else is expected.
+
+        """
+        o = self._observation
+        if o is None:
+            return
+        now = time.monotonic()
+        if o.first_byte is None:
+            o.first_byte = now
+        o.last_byte = now
+        o.code = code
+        if (code in ClientConnection._multiline
+                or code in ClientConnection._continue
+                or (code == 211 and o.verb == b'LISTGROUP')):
+            return
+        self._observe_end()
+
+    def _observe_end(self, complete=False):
+        """n._observe_end([COMPLETE])
+
+        Finish timing the current command and pass the result to the
+        observers.  COMPLETE should be True if a multi-line response
+        has just been completely received.
+
+        """
+        o = self._observation
+        if o is None:
+            return
+        self._observation = None
+        if complete:
+            o.last_byte = time.monotonic()
+        o.sent = self.bytes_sent - o.sent
+        o.received = self.bytes_received - o.received
+        for observer in self.observers:
+            observer(o)
+
+    # -------------------------------------------------------------------------
+    # Low-level IO
+
+    def _fill(self):
+        readable = super()._fill()
+        o = self._observation
+        if (o is not None and o.first_byte is None and readable
+                and self.buffer_index == 0 and len(self.buffer) > 0):
+            o.first_byte = time.monotonic()
+        return readable
+
+    def disconnect(self):
+        """n.disconnect()
+
+        Disconnect from the peer.
+
+        """
+        self._observe_end()
+        super().disconnect()
+
+    def transact(self, cmd, timeout=None):
+        """n.transact(COMMAND[, timeout=TIMEOUT]) -> CODE,ARG
 
         Send a command get the response, but authenticating
         if necessary.
 
         """
-        code, arg = super().transact(*args)
+        self._observe_begin(cmd)
+        code, arg = super().transact(cmd, timeout)
         if code == 480 and self._authorize():
-            code, arg = super().transact(*args)
+            self._observe_begin(cmd)
+            code, arg = super().transact(cmd, timeout)
+        if code == 400 and self.retries > 0:
+            self.disconnect()
+            raise nntpbits.ConnectionLost("service unavailable: %s"
+                                          % str(self.response, 'ascii'))
+        return code, arg
+
+    def wait(self, timeout=None):
+        """n.wait([timeout=TIMEOUT]) -> CODE,ARG
+
+        Wait for a response.  If TIMEOUT is None then the connection's
+        response_timeout is used.
+
+        """
+        if timeout is None:
+            timeout = self.response_timeout
+        code, arg = super().wait(timeout)
+        self._observe_response(code)
         return code, arg
 
+    def receive_lines(self, timeout=None):
+        """n.receive_lines([timeout=TIMEOUT]) -> LIST
+
+        Receive a multi-line response.  Raises
+        nntpbits.ConnectionLost if the connection is closed part-way
+        through.  If TIMEOUT is None then the connection's
+        lines_timeout is used.
+
+        """
+        if timeout is None:
+            timeout = self.lines_timeout
+        lines = super().receive_lines(timeout)
+        if lines is None:
+            raise nntpbits.ConnectionLost("connection closed during response")
+        self._observe_end(True)
+        return lines
+
+    def iter_lines(self, timeout=None):
+        """n.iter_lines([timeout=TIMEOUT]) -> ITERATOR
+
+        Receive a multi-line response one line at a time.
+
+        """
+        yield from super().iter_lines(timeout)
+        self._observe_end(True)
+
+    @contextlib.contextmanager
+    def timeouts(self, response=None, lines=None):
+        """with n.timeouts([response=RESPONSE][, lines=LINES]): ...
+
+        Override the response and multi-line deadlines for the
+        duration of the suite.  Arguments left as None keep the
+        existing setting.
+
+        """
+        saved = (self.response_timeout, self.lines_timeout)
+        if response is not None:
+            self.response_timeout = response
+        if lines is not None:
+            self.lines_timeout = lines
+        try:
+            yield self
+        finally:
+            (self.response_timeout, self.lines_timeout) = saved
+
     def _authorize(self):
         if b'READER' in self.capabilities():
             user = self.nnrp_user
@@ -190,6 +507,7 @@ class ClientConnection(nntpbits.Connection):
             caps = cap.split()
             self.capability_set.add(caps[0])
 
+    @_retryable()
     def capabilities(self):
         """n.capabilities() -> SET
 
@@ -279,6 +597,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # GROUP (3977 6.1.1)
 
+    @_retryable()
     def group(self, group):
         """n.group(NAME) -> (count, low, high)
 
@@ -293,6 +612,7 @@ class ClientConnection(nntpbits.Connection):
             if not m:
                 raise Exception("GROUP response malformed: %s" % self.response)
             self.current_group = group
+            self.current_article = None
             return (int(m.group(1)), int(m.group(2)), int(m.group(3)))
         elif code == 411:
             raise Exception("Group %s does not exist" % str(group))
@@ -302,8 +622,10 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # LISTGROUP (3977 6.1.2)
 
-    def listgroup(self, low=None, high=None, group=None):
+    @_retryable()
+    def listgroup(self, low=None, high=None, group=None, compact=False):
         """n.listgroup([LOW, HIGH, [group=GROUP]]) -> COUNT, LOW, HIGH LIST
+        n.listgroup(..., compact=True) -> COUNT, LOW, HIGH, RANGESET
 
         Lists valid article numbers in the range LOW-HIGH.  If a group
         is specified then that group is listed; otherwise the current
@@ -312,6 +634,10 @@ class ClientConnection(nntpbits.Connection):
         Note that LOW and HIGH are _inclusive_ bounds, unlike the
         usual Python idiom.
 
+        If COMPACT is True then the article numbers are returned as
+        an nntpbits.RangeSet, built as the response arrives.  This
+        is much smaller for large groups.
+
         """
         self._require_reader()
         cmd = [b'LISTGROUP']
@@ -325,9 +651,17 @@ class ClientConnection(nntpbits.Connection):
             if not m:
                 raise Exception(
                     "LISTGROUP response malformed: %s" % self.response)
-            self.current_group = group
+            if group is not None:
+                self.current_group = nntpbits._normalize(group)
+            self.current_article = None
+            if compact:
+                numbers = nntpbits.RangeSet()
+                for line in self.iter_lines(self.lines_timeout):
+                    numbers.append(int(line))
+            else:
+                numbers = [int(line) for line in self.receive_lines()]
             return (int(m.group(1)), int(m.group(2)), int(m.group(3)),
-                    [int(line) for line in self.receive_lines()])
+                    numbers)
         else:
             self._failed('LISTGROUP')
 
@@ -363,6 +697,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # STAT (3977 6.2.4)
 
+    @_retryable()
     def stat(self, ident=None):
         """n.stat(ID|NUMBER) -> NUMBER,ID,None | None,None,None
         n.stat() -> NUMBER,ID,None | None,None,None
@@ -392,14 +727,26 @@ class ClientConnection(nntpbits.Connection):
             if not m:
                 raise Exception("%s command malformed response: %s"
                                 % (str(cmd[0]), arg))
+            self._selected(cmd, int(m.group(1)))
             return (int(m.group(1)), m.group(2), None)
         if code in ClientConnection._select_noarticle:
             return None, None, None
         self._failed(cmd[0])
 
+    def _selected(self, cmd, number):
+        """n._selected(CMD, NUMBER)
+
+        Record the current article number after a successful CMD.
+        Commands that name a message ID leave it unchanged.
+
+        """
+        if len(cmd) == 1 or not cmd[1].startswith(b'<'):
+            self.current_article = number
+
     # -------------------------------------------------------------------------
     # ARTICLE, HEAD, BODY (3977 6.2.1-3)
 
+    @_retryable()
     def article(self, ident=None):
         """n.article(ID|NUMBER) -> NUMBER,IDENT,LINES | None,None,None
         n.article() -> NUMBER,IDENT,LINES | None,None,None
@@ -415,6 +762,7 @@ class ClientConnection(nntpbits.Connection):
         """
         return self._article(ident, b'ARTICLE', 220)
 
+    @_retryable()
     def head(self, ident=None):
         """n.head(ID|NUMBER) -> NUMBER,IDENT,LINES | None,None,None
         n.head() -> NUMBER,IDENT,LINES | None,None,None
@@ -430,6 +778,7 @@ class ClientConnection(nntpbits.Connection):
         """
         return self._article(ident, b'HEAD', 221)
 
+    @_retryable()
     def body(self, ident=None):
         """n.body(ID|NUMBER) -> NUMBER,IDENT,LINES | None,None,None
 
@@ -465,6 +814,7 @@ class ClientConnection(nntpbits.Connection):
             if not m:
                 raise Exception("%s command malformed response: %s"
                                 % (str(command), arg))
+            self._selected(cmd.split(b' '), int(m.group(1)))
             return int(m.group(1)), m.group(2), self.receive_lines()
         elif code == 423 or code == 430:
             return None, None, None
@@ -519,6 +869,25 @@ class ClientConnection(nntpbits.Connection):
 
         """
         ident = ClientConnection._ident(article, ident)
+        if self.offer_cache is not None:
+            state = self.offer_cache.lookup(ident)
+            if state == nntpbits.OfferCache.DEFERRED:
+                return 436
+            if state is not None:
+                return 435
+        code = self._ihave(article, ident)
+        if self.offer_cache is not None:
+            self.offer_cache.record_response(ident, code)
+        return code
+
+    @_retryable(436)
+    def _ihave(self, article, ident):
+        """n._ihave(ARTICLE, IDENT) -> CODE
+
+        Transfer an article, without consulting the offer cache, so
+        that a retry after a 436 response really offers it again.
+
+        """
         return self._post(article, b'IHAVE', ident, 335, 235)
 
     @staticmethod
@@ -571,6 +940,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # DATE (3977 7.1)
 
+    @_retryable()
     def date(self):
         """n.date() -> DATE
 
@@ -588,6 +958,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # HELP (3977 7.2)
 
+    @_retryable()
     def help(self):
         """n.help() -> LIST
 
@@ -603,6 +974,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # NEWGROUPS (3977 7.3)
 
+    @_retryable()
     def newgroups(self, date, gmt=True):
         """n.newgroups(DATE) -> LIST
 
@@ -632,6 +1004,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # NEWNEWS (3977 7.4)
 
+    @_retryable()
     def newnews(self, wildmat, date, gmt=True):
         """n.newnews(WILDMAT, DATE) -> LIST
 
@@ -669,6 +1042,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # LIST (3977 7.6, 6048)
 
+    @_retryable()
     def list(self, what=b'ACTIVE', wildmat=None):
         """n.list(WHAT) -> LIST | None
         n.list(WHAT, WILDMAT) -> LIST | None
@@ -689,7 +1063,7 @@ class ClientConnection(nntpbits.Connection):
             cap = what.split(b' ')[0]
         # Become a reader if necessary
         if (cap not in self.capability_arguments(b'LIST')
-                and b'MODE-READER' in self.capabilites()):
+                and b'MODE-READER' in self.capabilities()):
             self._mode_reader()
         if what is None:
             cmd = [b'LIST']
@@ -709,9 +1083,30 @@ class ClientConnection(nntpbits.Connection):
         else:
             self._failed('LIST %s' % str(what, 'ascii'))
 
+    def active(self, wildmat=None, refresh=False):
+        """n.active([WILDMAT][, refresh=True]) -> ACTIVELIST
+
+        Returns an nntpbits.ActiveList describing the server's
+        groups.
+
+        The first call loads the whole active file.  Subsequent calls
+        only add groups created since the previous call, and
+        (if WILDMAT is specified) reload matching groups.  Set REFRESH
+        to force a complete reload.
+
+        """
+        self._require_reader()
+        if self.active_list is None or refresh:
+            self.active_list = nntpbits.ActiveList()
+            self.active_list.refresh(self)
+        else:
+            self.active_list.update(self, wildmat)
+        return self.active_list
+
     # -------------------------------------------------------------------------
     # OVER (3977 8.3, 8.4)
 
+    @_retryable()
     def over(self, low, high=None):
         """n.over(LOW, HIGH) -> LIST
         n.over(ID) -> LIST
@@ -790,7 +1185,7 @@ class ClientConnection(nntpbits.Connection):
                 for i in range(0, len(self.overview_fmt)):
                     l = self.overview_fmt[i]
                     if len(l) >= 5 and l[-5:] == b':full':
-                        self.overview_fmt[i] = self.overview_fmt[i][:-5]
+                        self.overview_fmt[i] = self.overview_fmt[i][:-4]
                     if l in fixups:
                         self.overview_fmt[i] = fixups[l]
             else:
@@ -799,6 +1194,7 @@ class ClientConnection(nntpbits.Connection):
             self.overview_fmt = []
         return self.overview_fmt
 
+    @_retryable()
     def list_overview_fmt(self):
         """n.list_overview_fmt() -> LIST
 
@@ -819,6 +1215,7 @@ class ClientConnection(nntpbits.Connection):
 
     _hdr_re = re.compile(b'^(\\d+) (.*)$')
 
+    @_retryable()
     def hdr(self, header, low, high=None):
         """n.over(HEADER, LOW, HIGH) -> LIST
         n.over(HEADER, ID) -> LIST
@@ -877,6 +1274,7 @@ class ClientConnection(nntpbits.Connection):
     # -------------------------------------------------------------------------
     # CHECK (4644 2.4)
 
+    @_retryable()
     def check(self, article=None, ident=None):
         """n.check(article=ARTICLE, ident=IDENT) -> BOOL|None
 
@@ -891,7 +1289,15 @@ class ClientConnection(nntpbits.Connection):
 
         """
         ident = ClientConnection._ident(article, ident)
+        if self.offer_cache is not None:
+            state = self.offer_cache.lookup(ident)
+            if state == nntpbits.OfferCache.DEFERRED:
+                return None
+            if state is not None:
+                return False
         code, argument = self.transact([b'CHECK', ident])
+        if self.offer_cache is not None:
+            self.offer_cache.record_response(ident, code)
         if code == 238:
             return True
         if code == 438:
@@ -918,9 +1324,16 @@ class ClientConnection(nntpbits.Connection):
 
         """
         ident = ClientConnection._ident(article, ident)
+        if self.offer_cache is not None:
+            state = self.offer_cache.lookup(ident)
+            if state is not None and state != nntpbits.OfferCache.DEFERRED:
+                return False
+        self._observe_begin(b'TAKETHIS')
         self.send_line([b'TAKETHIS', ident])
         self.send_lines(article)
         code, argument = self.wait()
+        if self.offer_cache is not None:
+            self.offer_cache.record_response(ident, code)
         if code == 239:
             return True
         if code == 439:
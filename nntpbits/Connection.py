@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 """Client/server connection base class"""
-import logging,re,select,socket,threading
+import logging,re,select,socket,threading,time
 import nntpbits
 
 # Regexp parsing a response
@@ -24,6 +24,32 @@ _parse_re=re.compile(b"^([0-9]{3}) (.*)$")
 _lock=threading.Lock()
 _next_key=0
 
+def _allocate_key():
+    """_allocate_key() -> KEY
+
+    Returns a new connection key, used to identify connections in
+    log messages.
+
+    """
+    global _next_key
+    with _lock:
+        key=_next_key
+        _next_key+=1
+    return key
+
+class ConnectionLost(Exception):
+    """Exception raised when the peer goes away unexpectedly."""
+    pass
+
+class CommandTimeout(ConnectionLost):
+    """Exception raised when a read deadline passes.
+
+    The connection is closed, since the peer's response may still
+    arrive later.
+
+    """
+    pass
+
 class Connection(object):
     """Base class for text-based network protocols
 
@@ -38,12 +64,14 @@ class Connection(object):
     def __init__(self, eol=b"\r\n", stoppable=True):
         self.eol=eol
         self.sock=None
+        self.r=None
+        self.w=None
+        self.deadline=None
+        self.bytes_sent=0
+        self.bytes_received=0
         self.stoppable=stoppable
         self.log=logging.getLogger(__name__)
-        with _lock:
-            global _next_key
-            self.key=_next_key
-            _next_key+=1
+        self.key=_allocate_key()
 
     def files(self, r, w):
         """p.files(r=READER, w=WRITER)
@@ -95,8 +123,10 @@ class Connection(object):
         if isinstance(line, list):
             line=b' '.join(nntpbits._normalize(line))
         self.log.debug("%08x SEND %s" % (self.key, line))
-        self.w.write(nntpbits._normalize(line))
+        line=nntpbits._normalize(line)
+        self.w.write(line)
         self.w.write(b'\r\n')
+        self.bytes_sent+=len(line)+2
         if flush:
             self.w.flush()
 
@@ -113,12 +143,24 @@ class Connection(object):
         """
         for line in lines:
             line=nntpbits._normalize(line)
-            if len(line) > 0 and line[0] == b'.':
+            if line[0:1] == b'.':
                 self.send_line(b'.'+line, flush=False)
             else:
                 self.send_line(line, flush=False)
         self.send_line(b'.')
 
+    def send_data(self, data, flush=True):
+        """p.send_data(DATA[, FLUSH])
+
+        Send DATA, a bytes-like object which is already in wire format
+        (dot-stuffed, with CRLF line endings), followed by the
+        terminating '.' line.  No per-line processing is done.
+
+        """
+        self.w.write(data)
+        self.bytes_sent+=len(data)
+        self.send_line(b'.', flush=flush)
+
     def _fill(self):
         """p._fill() -> READABLE
 
@@ -163,37 +205,82 @@ class Connection(object):
         Returns the next input byte, or None at EOF.
 
         This method blocks until it can meet its contract.  It may
-        throw an exception if the thread is told to stop or an error
-        occurs.
+        throw an exception if the thread is told to stop, an error
+        occurs or p.deadline (a time.monotonic() value) passes.
+
+        """
+        if not self._wait_input():
+            return None
+        ch=self.buffer[self.buffer_index:self.buffer_index+1]
+        self.buffer_index+=1
+        return ch
+
+    def _wait_input(self):
+        """p._wait_input() -> BOOL
+
+        Wait until the input buffer is not empty.  Returns False at
+        EOF.  Blocks and raises exceptions as p._read_byte().
 
         """
         while self.buffer_index >= len(self.buffer):
             while not self._fill():
-                select.select([self.sock],[],[],1.0)
+                if self.deadline is None:
+                    select.select([self.sock],[],[],1.0)
+                else:
+                    remaining=self.deadline-time.monotonic()
+                    if remaining <= 0:
+                        self.disconnect()
+                        raise CommandTimeout("read deadline exceeded")
+                    select.select([self.sock],[],[],min(remaining, 1.0))
                 self._maybe_stop()
             if self.eof:
-                return None
-        ch=self.buffer[self.buffer_index:self.buffer_index+1]
-        self.buffer_index+=1
-        return ch
+                return False
+        return True
+
+    def _set_deadline(self, timeout):
+        """p._set_deadline(TIMEOUT) -> PREVIOUS
 
-    def receive_line(self, stop_check=True):
-        """p.receive_line() -> LINE
+        If TIMEOUT is not None, set the read deadline TIMEOUT seconds
+        from now.  Returns the previous deadline, for restoration
+        afterwards.
+
+        """
+        previous=self.deadline
+        if timeout is not None:
+            self.deadline=time.monotonic()+timeout
+        return previous
+
+    def receive_line(self, stop_check=True, timeout=None):
+        """p.receive_line([timeout=TIMEOUT]) -> LINE
 
         Receive a line as a bytes object.  The protocol EOL sequence
         is removed.
 
-        Returns None if there is no more input.
+        Returns None if there is no more input.  If TIMEOUT is not
+        None and no complete line arrives within TIMEOUT seconds,
+        raises nntpbits.CommandTimeout.
 
         """
         if stop_check:
             self._maybe_stop()
-        line=b"";
-        while not self._complete(line):
-            ch=self._read_byte()
-            if ch is None:
-                return None
-            line += ch
+        end=self.buffer.find(self.eol, self.buffer_index)
+        if end >= 0:
+            # Fast path: the whole line is already buffered
+            end+=len(self.eol)
+            line=bytes(self.buffer[self.buffer_index:end])
+            self.buffer_index=end
+        else:
+            previous=self._set_deadline(timeout)
+            try:
+                line=b"";
+                while not self._complete(line):
+                    ch=self._read_byte()
+                    if ch is None:
+                        return None
+                    line += ch
+            finally:
+                self.deadline=previous
+        self.bytes_received+=len(line)
         line=line[0:-len(self.eol)]
         self.log.debug("%08x RECV %s" % (self.key, line))
         return line
@@ -207,26 +294,56 @@ class Connection(object):
         """
         return len(line) >= len(self.eol) and line[-len(self.eol):] == self.eol
 
-    def receive_lines(self):
-        """p.receive_lines() -> LIST
+    def receive_lines(self, timeout=None):
+        """p.receive_lines([timeout=TIMEOUT]) -> LIST
 
         Receive a sequence of lines as a list of bytes objects.  The
         SMTP/NNTP dot-stuffing protocol is used.  The protocol EOL
         sequence is removed from each line.
 
-        Returns None if there is no more input.
+        Returns None if there is no more input.  If TIMEOUT is not
+        None and the whole sequence does not arrive within TIMEOUT
+        seconds, raises nntpbits.CommandTimeout.
 
         """
-        lines=[]
-        line=self.receive_line(stop_check=False)
-        while line != b".":
-            if line is None:
-                return None
-            if len(line) > 0 and line[0] == b'.':
-                line=line[1:]
-            lines.append(line)
+        previous=self._set_deadline(timeout)
+        try:
+            lines=[]
             line=self.receive_line(stop_check=False)
-        return lines
+            while line != b".":
+                if line is None:
+                    return None
+                if line[0:1] == b'.':
+                    line=line[1:]
+                lines.append(line)
+                line=self.receive_line(stop_check=False)
+            return lines
+        finally:
+            self.deadline=previous
+
+    def iter_lines(self, timeout=None):
+        """p.iter_lines([timeout=TIMEOUT]) -> ITERATOR
+
+        Receive a sequence of lines in the same way as
+        p.receive_lines(), but yield them one at a time rather than
+        accumulating a list.
+
+        Raises nntpbits.ConnectionLost if there is no more input
+        before the terminating line.
+
+        """
+        previous=self._set_deadline(timeout)
+        try:
+            line=self.receive_line(stop_check=False)
+            while line != b".":
+                if line is None:
+                    raise ConnectionLost("connection closed during response")
+                if line[0:1] == b'.':
+                    line=line[1:]
+                yield line
+                line=self.receive_line(stop_check=False)
+        finally:
+            self.deadline=previous
 
     def disconnect(self):
         """p.disconnect()
@@ -242,6 +359,7 @@ class Connection(object):
                     pass
         self.r=None
         self.w=None
+        self.deadline=None
         self.sock=None
 
     def parse(self, line):
@@ -256,18 +374,23 @@ class Connection(object):
             raise ValueError("malformed response '%s'" % line)
         return (int(m.group(1)), m.group(2))
 
-    def wait(self):
-        """p.wait() -> CODE, ARGUMENT
+    def wait(self, timeout=None):
+        """p.wait([timeout=TIMEOUT]) -> CODE, ARGUMENT
 
         Wait for a response and break it into a response code and
         argument using the same rules as self.nntpbits.Connection.parse.
 
+        If TIMEOUT is not None and no response arrives within TIMEOUT
+        seconds, raises nntpbits.CommandTimeout.
+
         """
-        self.response=self.receive_line()
+        self.response=self.receive_line(timeout=timeout)
+        if self.response is None:
+            raise ConnectionLost("connection closed by peer")
         return self.parse(self.response)
 
-    def transact(self, cmd):
-        """p.transact(LINE) -> CODE, ARGUMENT
+    def transact(self, cmd, timeout=None):
+        """p.transact(LINE[, timeout=TIMEOUT]) -> CODE, ARGUMENT
 
         Send a bytes object, appending the protocol EOL sequence.
         Then wait for a response and break it into a response code and
@@ -275,4 +398,4 @@ class Connection(object):
 
         """
         self.send_line(cmd)
-        return self.wait()
+        return self.wait(timeout=timeout)
@@ -0,0 +1,367 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+
+# File header: magic, size, write position, tail, wrap, cycle
+_header = struct.Struct('<8sQQQQQ')
+_magic = b'NNTPCYCB'
+
+# Offset of the first record
+_data_start = 512
+
+# Record header: magic, article length, message ID hash
+_record = struct.Struct('<4sIQ')
+_record_magic = b'NART'
+
+# Tokens pack an offset and a length into 64 bits
+_length_bits = 28
+_length_mask = (1 << _length_bits) - 1
+
+
+class CycBuffStore(nntpbits.ArticleStore):
+    """Memory-mapped cyclic article buffer
+
+    Construction:
+    nntpbits.CycBuffStore(PATH[, size=SIZE][, cyclic=CYCLIC]
+                          [, sync_bytes=BYTES]) -> store
+
+    Articles are appended to a pre-sized file of SIZE bytes (default
+    1GB), in the style of INN's CNFS.  If CYCLIC is True (the
+    default) then when the file is full, writing wraps round to the
+    start, overwriting the oldest articles.  Otherwise store() fails
+    when the file is full.
+
+    The index maps the 64-bit hash of each message ID to the
+    article's offset and length, in a pair of arrays.  Articles are
+    retrieved as memoryviews of the mapped file, so no copying is
+    required; a view is invalidated when the article is overwritten,
+    and all views must be released before close() is called.
+    locate() returns the file and offset of an article, so that it
+    can be sent with socket.sendfile().
+
+    The file header (which records the write position) is only
+    updated, and the mapping only flushed, after SYNC_BYTES bytes
+    (default 1MB) have been written, or when sync() or close() is
+    called.  If an existing file is opened then its index is rebuilt
+    from the records between the tail and the write position as of
+    the last sync().
+
+    """
+
+    def __init__(self, path, size=1 << 30, cyclic=True, sync_bytes=1 << 20):
+        nntpbits.ArticleStore.__init__(self)
+        self.path = path
+        self.cyclic = cyclic
+        self.sync_bytes = sync_bytes
+        self.pending = 0
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        existing = os.fstat(self.fd).st_size
+        if existing >= _data_start:
+            header = os.pread(self.fd, _header.size, 0)
+            (magic, size, self.write, self.tail, self.wrap,
+             self.cycle) = _header.unpack(header)
+            if magic != _magic or size != existing:
+                os.close(self.fd)
+                raise Exception("%s: not a cyclic buffer" % path)
+        else:
+            size -= size % 8
+            os.ftruncate(self.fd, size)
+            (self.write, self.tail, self.wrap, self.cycle) = (
+                _data_start, _data_start, _data_start, 0)
+        self.size = size
+        self.map = mmap.mmap(self.fd, size)
+        self.file = open(self.fd, 'rb', buffering=0, closefd=False)
+        self.view = memoryview(self.map)
+        self._new_index(1024)
+        for start, end in self._regions():
+            offset = start
+            while offset < end:
+                (magic, length, key) = _record.unpack_from(self.map, offset)
+                if magic != _record_magic:
+                    break
+                self._insert(key, offset, length)
+                offset += self._record_size(length)
+        if existing < _data_start:
+            self.sync()
+
+    # -------------------------------------------------------------------------
+    # Index
+
+    def _new_index(self, slots):
+        """s._new_index(SLOTS)
+
+        Replace the index with an empty table of SLOTS entries, which
+        must be a power of 2.
+
+        """
+        self.slots = slots
+        self.keys = array('Q', bytes(8 * slots))
+        self.tokens = array('Q', bytes(8 * slots))
+        self.used = 0
+        self.count = 0
+
+    def _key(self, ident):
+        """s._key(IDENT) -> KEY
+
+        Returns the nonzero 64-bit hash of IDENT.
+
+        """
+        digest = hashlib.blake2b(nntpbits._normalize(ident),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def _slot(self, key):
+        """s._slot(KEY) -> INDEX
+
+        Returns the index of KEY in the table, or of the empty slot
+        where it would go.
+
+        """
+        mask = self.slots - 1
+        i = key & mask
+        while True:
+            k = self.keys[i]
+            if k == key or k == 0:
+                return i
+            i = (i + 1) & mask
+
+    def _insert(self, key, offset, length):
+        """s._insert(KEY, OFFSET, LENGTH)
+
+        Add KEY to the index, replacing any existing entry.  Grows
+        the table when it is half full, discarding entries for
+        overwritten articles.
+
+        """
+        i = self._slot(key)
+        if self.keys[i] == 0:
+            if (self.used + 1) * 2 > self.slots:
+                self._rehash()
+                i = self._slot(key)
+            self.used += 1
+        if self.keys[i] == 0 or not self._live(key, self.tokens[i]):
+            self.count += 1
+        self.keys[i] = key
+        self.tokens[i] = (offset << _length_bits) | length
+
+    def _rehash(self):
+        """s._rehash()
+
+        Rebuild the index, keeping only live entries.
+
+        """
+        entries = [(key, token)
+                   for key, token in zip(self.keys, self.tokens)
+                   if key != 0 and self._live(key, token)]
+        slots = self.slots
+        while len(entries) * 4 > slots:
+            slots *= 2
+        self._new_index(slots)
+        for key, token in entries:
+            i = self._slot(key)
+            self.keys[i] = key
+            self.tokens[i] = token
+        self.used = self.count = len(entries)
+
+    def _live(self, key, token):
+        """s._live(KEY, TOKEN) -> BOOL
+
+        Returns True if TOKEN refers to a record for KEY that has not
+        been overwritten.
+
+        """
+        offset = token >> _length_bits
+        for start, end in self._regions():
+            if start <= offset < end:
+                return _record.unpack_from(self.map, offset) == (
+                    _record_magic, token & _length_mask, key)
+        return False
+
+    # -------------------------------------------------------------------------
+    # Buffer management
+
+    def _regions(self):
+        """s._regions() -> LIST
+
+        Returns the (START, END) ranges of the buffer that contain
+        live records, oldest first.
+
+        """
+        regions = []
+        if self.cycle > 0 and self.tail < self.wrap:
+            regions.append((self.tail, self.wrap))
+        regions.append((_data_start, self.write))
+        return regions
+
+    @staticmethod
+    def _record_size(length):
+        """CycBuffStore._record_size(LENGTH) -> SIZE
+
+        Returns the size of the record for an article of LENGTH bytes.
+
+        """
+        return (_record.size + length + 7) & ~7
+
+    def _reserve(self, size):
+        """s._reserve(SIZE) -> OFFSET | None
+
+        Find space for a record of SIZE bytes, wrapping and advancing
+        the tail as necessary.  Returns None if there is no room.
+
+        """
+        if self.write + size > self.size:
+            if not self.cyclic or _data_start + size > self.size:
+                return None
+            if self.cycle > 0:
+                # The rest of the previous cycle is about to be dropped
+                self._expire(self.wrap)
+            (self.wrap, self.write) = (self.write, _data_start)
+            self.tail = _data_start
+            self.cycle += 1
+        if self.cycle > 0:
+            self._expire(self.write + size)
+        return self.write
+
+    def _expire(self, limit):
+        """s._expire(LIMIT)
+
+        Advance the tail past the records before LIMIT (but not beyond
+        the wrap point), removing them from the article count.
+
+        """
+        while self.tail < limit and self.tail < self.wrap:
+            (magic, length, key) = _record.unpack_from(self.map, self.tail)
+            i = self._slot(key)
+            if (self.keys[i] == key
+                    and self.tokens[i] >> _length_bits == self.tail):
+                self.count -= 1
+            self.tail += self._record_size(length)
+        if self.tail > self.wrap:
+            self.tail = self.wrap
+
+    # -------------------------------------------------------------------------
+    # ArticleStore interface
+
+    def __contains__(self, ident):
+        return self.retrieve(ident) is not None
+
+    def __len__(self):
+        return self.count
+
+    def store(self, ident, lines):
+        data = nntpbits.ArticleStore.encode(lines)
+
+        def fill(view):
+            view[:] = data
+        return self._append(ident, len(data), fill)
+
+    def store_article(self, ident, header, article):
+        data = nntpbits.ArticleStore.encode(header + [b''])
+        offset = article.body_offset()
+
+        def fill(view):
+            view[:len(data)] = data
+            article.readinto(view[len(data):], offset)
+        return self._append(ident, len(data) + len(article) - offset, fill)
+
+    def _append(self, ident, length, fill):
+        """s._append(IDENT, LENGTH, FILL) -> BOOL
+
+        Add a record for article IDENT, of LENGTH bytes, calling
+        FILL(VIEW) to write the article into the memoryview VIEW.
+        Returns False if there is no room.
+
+        """
+        if length > _length_mask:
+            return False
+        key = self._key(ident)
+        size = self._record_size(length)
+        with self.lock:
+            offset = self._reserve(size)
+            if offset is None:
+                return False
+            _record.pack_into(self.map, offset, _record_magic, length, key)
+            start = offset + _record.size
+            fill(self.view[start:start + length])
+            self.write += size
+            self._insert(key, offset, length)
+            self.pending += size
+            if self.pending >= self.sync_bytes:
+                self._sync()
+        return True
+
+    def _token(self, ident):
+        """s._token(IDENT) -> TOKEN | None
+
+        Returns the token for article IDENT, or None if it is not
+        stored (or has been overwritten).
+
+        """
+        key = self._key(ident)
+        with self.lock:
+            i = self._slot(key)
+            if self.keys[i] == 0:
+                return None
+            token = self.tokens[i]
+            if not self._live(key, token):
+                return None
+        return token
+
+    def retrieve(self, ident):
+        token = self._token(ident)
+        if token is None:
+            return None
+        start = (token >> _length_bits) + _record.size
+        return self.view[start:start + (token & _length_mask)]
+
+    def locate(self, ident):
+        token = self._token(ident)
+        if token is None:
+            return None
+        return (self.file, (token >> _length_bits) + _record.size,
+                token & _length_mask)
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def _sync(self):
+        """s._sync()
+
+        Write the header and flush the mapping.  Call with s.lock
+        held.
+
+        """
+        _header.pack_into(self.map, 0, _magic, self.size, self.write,
+                          self.tail, self.wrap, self.cycle)
+        self.map.flush()
+        self.pending = 0
+
+    def close(self):
+        if self.map is None:
+            return
+        self.sync()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+        os.close(self.fd)
+        self.map = None
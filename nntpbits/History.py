@@ -0,0 +1,298 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+from array import array
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+# File header: magic, number of slots
+_header = struct.Struct('<8sQ')
+_magic = b'NNTPHIST'
+_data_start = 64
+
+# Table entry: message ID hash, arrival time (native byte order, so
+# that the table can be read as an array)
+_entry = struct.Struct('=QQ')
+
+
+class History(object):
+    """Message ID history database
+
+    Construction:
+    nntpbits.History([path=PATH][, size=SIZE][, expire=SECONDS]
+                     [, hashes=HASHES]) -> history
+
+    Records the message IDs a server has seen, in the style of INN's
+    history file, so that ihave_check() can answer CHECK and IHAVE
+    without consulting article storage.
+
+    Message IDs are stored as 64-bit hashes, with their arrival time,
+    in an open-addressed table with room for at least SIZE entries.
+    The table lives in the file PATH, accessed through mmap, or in
+    anonymous memory if PATH is None.  It grows as necessary.
+
+    A Bloom filter with HASHES hash functions and 16 bits per table
+    slot sits in front of the table, so most message IDs that have
+    not been seen are rejected without touching the table.  It is
+    rebuilt from the table when the history is opened, expired or
+    grown.
+
+    Entries older than SECONDS (default 10 days) are treated as
+    absent and their slots are reused.  len(h) includes expired
+    entries until h.expire() is called (which happens automatically
+    when the table fills up).
+
+    """
+
+    def __init__(self, path=None, size=1 << 20, expire=86400 * 10,
+                 hashes=8):
+        self.path = path
+        self.expire_after = expire
+        self.hashes = hashes
+        self.lock = threading.Lock()
+        self.fd = None
+        self.map = None
+        slots = 1
+        while slots < size * 2:
+            slots *= 2
+        if path is not None:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+            if os.fstat(self.fd).st_size >= _data_start:
+                (magic, slots) = _header.unpack(os.pread(self.fd,
+                                                         _header.size, 0))
+                if magic != _magic:
+                    os.close(self.fd)
+                    raise Exception("%s: not a history file" % path)
+        self._map(slots)
+        self._rebuild()
+
+    def _map(self, slots):
+        """h._map(SLOTS)
+
+        (Re-)map the table with SLOTS slots.  Existing entries are
+        preserved if the table is not resized.
+
+        """
+        if self.map is not None:
+            self.map.close()
+        length = _data_start + slots * _entry.size
+        if self.fd is None:
+            self.map = mmap.mmap(-1, length)
+        else:
+            if os.fstat(self.fd).st_size != length:
+                os.ftruncate(self.fd, length)
+            self.map = mmap.mmap(self.fd, length)
+        _header.pack_into(self.map, 0, _magic, slots)
+        self.slots = slots
+
+    def _rebuild(self):
+        """h._rebuild()
+
+        Recount the table and rebuild the Bloom filter.
+
+        """
+        self.bits = self.slots * 16
+        self.bloom = bytearray(self.bits // 8)
+        self.used = 0
+        cutoff = time.time() - self.expire_after
+        for key, when in self._entries():
+            self.used += 1
+            if when >= cutoff:
+                self._bloom_add(key)
+
+    def _entries(self):
+        """h._entries() -> LIST
+
+        Returns the (KEY, TIME) tuples for all occupied slots.
+
+        """
+        table = array('Q')
+        table.frombytes(self.map[_data_start:])
+        return [(key, when) for key, when in zip(table[0::2], table[1::2])
+                if key != 0]
+
+    # -------------------------------------------------------------------------
+    # Hashing
+
+    def _key(self, ident):
+        """h._key(IDENT) -> KEY
+
+        Returns the nonzero 64-bit hash of IDENT.
+
+        """
+        digest = hashlib.blake2b(nntpbits._normalize(ident),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def _bloom_bits(self, key):
+        """h._bloom_bits(KEY) -> ITERABLE
+
+        Returns the Bloom filter bits for KEY, by double hashing.
+
+        """
+        h1 = key & 0xFFFFFFFF
+        h2 = (key >> 32) | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def _bloom_add(self, key):
+        for bit in self._bloom_bits(key):
+            self.bloom[bit >> 3] |= 1 << (bit & 7)
+
+    def _bloom_test(self, key):
+        for bit in self._bloom_bits(key):
+            if not self.bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    # -------------------------------------------------------------------------
+    # Table
+
+    def _find(self, key, cutoff):
+        """h._find(KEY, CUTOFF) -> (OFFSET, FREE)
+
+        Returns the offset of the unexpired entry for KEY, or None,
+        and the offset of the first slot that could hold it.
+
+        """
+        mask = self.slots - 1
+        i = key & mask
+        free = None
+        while True:
+            offset = _data_start + i * _entry.size
+            (k, when) = _entry.unpack_from(self.map, offset)
+            if k == 0:
+                return (None, offset if free is None else free)
+            if when < cutoff:
+                if free is None:
+                    free = offset
+            elif k == key:
+                return (offset, free)
+            i = (i + 1) & mask
+
+    def __contains__(self, ident):
+        return self.lookup(ident) is not None
+
+    def __len__(self):
+        return self.used
+
+    def lookup(self, ident):
+        """h.lookup(IDENT) -> TIME | None
+
+        Returns the arrival time of IDENT, or None if it is not in
+        the history (or has expired).
+
+        """
+        key = self._key(ident)
+        with self.lock:
+            if not self._bloom_test(key):
+                return None
+            (offset, free) = self._find(key,
+                                        time.time() - self.expire_after)
+            if offset is None:
+                return None
+            return _entry.unpack_from(self.map, offset)[1]
+
+    def add(self, ident, when=None):
+        """h.add(IDENT[, WHEN]) -> BOOL
+
+        Record IDENT as having arrived at WHEN (default now).
+        Returns True if it was added and False if it was already
+        present.
+
+        """
+        key = self._key(ident)
+        now = time.time()
+        if when is None:
+            when = now
+        with self.lock:
+            cutoff = now - self.expire_after
+            # The table must be probed anyway, to find a free slot
+            (offset, free) = self._find(key, cutoff)
+            if offset is not None:
+                return False
+            if _entry.unpack_from(self.map, free)[0] == 0:
+                if (self.used + 1) * 4 > self.slots * 3:
+                    self._expire(cutoff)
+                    (offset, free) = self._find(key, cutoff)
+                self.used += 1
+            _entry.pack_into(self.map, free, key, int(when))
+            self._bloom_add(key)
+            return True
+
+    def expire(self):
+        """h.expire()
+
+        Discard expired entries, rebuilding the table and the Bloom
+        filter.
+
+        """
+        with self.lock:
+            self._expire(time.time() - self.expire_after)
+
+    def _expire(self, cutoff):
+        """h._expire(CUTOFF)
+
+        Rebuild the table keeping entries that arrived at or after
+        CUTOFF, doubling its size if it would otherwise be over half
+        full.  Call with h.lock held.
+
+        """
+        entries = [(key, when) for key, when in self._entries()
+                   if when >= cutoff]
+        slots = self.slots
+        while len(entries) * 2 > slots:
+            slots *= 2
+        if slots != self.slots:
+            self._map(slots)
+        self.map[_data_start:] = bytes(len(self.map) - _data_start)
+        mask = self.slots - 1
+        for key, when in entries:
+            i = key & mask
+            while _entry.unpack_from(self.map,
+                                     _data_start + i * _entry.size)[0]:
+                i = (i + 1) & mask
+            _entry.pack_into(self.map, _data_start + i * _entry.size,
+                             key, when)
+        self._rebuild()
+
+    def sync(self):
+        """h.sync()
+
+        Flush the table to disk.
+
+        """
+        with self.lock:
+            self.map.flush()
+
+    def close(self):
+        """h.close()
+
+        Flush and close the history.
+
+        """
+        if self.map is None:
+            return
+        self.map.flush()
+        self.map.close()
+        self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,115 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+import threading
+
+
+class LatencyAggregator(object):
+    """Per-verb latency histograms
+
+    Construction:
+    nntpbits.LatencyAggregator() -> aggregator
+
+    An aggregator is a callable suitable for
+    ClientConnection.add_observer().  It may be shared between
+    connections (including connections in different threads).
+
+    Latencies are counted in logarithmic buckets, four per power of
+    two, from 1 microsecond upwards.  Percentiles are therefore
+    accurate to about 20%.
+
+    """
+
+    _steps = 4
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.verbs = {}
+
+    def __call__(self, observation):
+        latency = observation.latency()
+        if latency is None:
+            return
+        bucket = self._bucket(latency)
+        with self.lock:
+            stats = self.verbs.get(observation.verb)
+            if stats is None:
+                stats = self.verbs[observation.verb] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'bytes': 0,
+                    'buckets': {}, 'codes': {}}
+            stats['count'] += 1
+            stats['total'] += latency
+            stats['max'] = max(stats['max'], latency)
+            stats['bytes'] += observation.sent + observation.received
+            stats['buckets'][bucket] = stats['buckets'].get(bucket, 0) + 1
+            stats['codes'][observation.code] = \
+                stats['codes'].get(observation.code, 0) + 1
+
+    def _bucket(self, latency):
+        """a._bucket(SECONDS) -> BUCKET"""
+        if latency <= 1e-6:
+            return 0
+        return int(math.log2(latency * 1e6) * self._steps) + 1
+
+    def _bucket_limit(self, bucket):
+        """a._bucket_limit(BUCKET) -> SECONDS
+
+        Returns the upper bound of BUCKET.
+
+        """
+        return 2 ** (bucket / self._steps) / 1e6
+
+    def percentile(self, verb, p):
+        """a.percentile(VERB, P) -> SECONDS | None
+
+        Returns (an upper bound on) the Pth percentile latency for
+        VERB, or None if there are no observations.
+
+        """
+        with self.lock:
+            stats = self.verbs.get(verb)
+            if stats is None or stats['count'] == 0:
+                return None
+            threshold = stats['count'] * p / 100.0
+            seen = 0
+            for bucket in sorted(stats['buckets']):
+                seen += stats['buckets'][bucket]
+                if seen >= threshold:
+                    return min(self._bucket_limit(bucket), stats['max'])
+            return stats['max']
+
+    def report(self):
+        """a.report() -> LIST
+
+        Returns a summary, one line (as a string) per verb.
+
+        """
+        lines = []
+        for verb in sorted(self.verbs):
+            stats = self.verbs[verb]
+            codes = " ".join("%s:%d" % (code, n)
+                             for code, n in sorted(stats['codes'].items(),
+                                                   key=lambda i: str(i[0])))
+            lines.append("%-12s n=%d mean=%.2fms p50=%.2fms p90=%.2fms "
+                         "p99=%.2fms max=%.2fms bytes=%d codes=[%s]"
+                         % (str(verb, 'ascii'), stats['count'],
+                            1000 * stats['total'] / stats['count'],
+                            1000 * self.percentile(verb, 50),
+                            1000 * self.percentile(verb, 90),
+                            1000 * self.percentile(verb, 99),
+                            1000 * stats['max'], stats['bytes'], codes))
+        return lines
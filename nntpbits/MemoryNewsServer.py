@@ -0,0 +1,524 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+from nntpbits.NewsServer import _body_lines, _header_fields, _header_length
+from array import array
+import bisect
+import email.utils
+import re
+import time
+import uuid
+
+# Regexp matching a message ID
+_message_id_re = re.compile(b'^<[^<> \\t]+@[^<> \\t]+>$')
+
+# Regexp matching a group name
+_group_re = re.compile(b'^[^\\s,:*?\\[\\\\!]+$')
+
+# Header fields that must be present in a peered article
+_required = [b'from', b'subject', b'newsgroups', b'message-id', b'date',
+             b'path']
+
+# Header fields that may only appear once
+_unique = _required + [b'followup-to', b'references', b'injection-date',
+                       b'expires', b'reply-to', b'sender']
+
+# Header fields containing dates
+_dates = [b'date', b'injection-date', b'expires']
+
+# Acceptable article age, and clock skew, in seconds
+_max_age = 86400 * 10
+_max_skew = 86400
+
+
+class _Group(object):
+    """Articles and metadata for one newsgroup
+
+    numbers -- ascending article numbers
+    idents -- message IDs, parallel to numbers
+    arrivals -- arrival times, parallel to numbers (ascending)
+    high -- high water mark
+    description -- description for LIST NEWSGROUPS
+    created -- creation time
+    creator -- creator for LIST ACTIVE.TIMES
+
+    """
+    __slots__ = ['numbers', 'idents', 'arrivals', 'high', 'description',
+                 'created', 'creator']
+
+    def __init__(self, description, created, creator):
+        self.numbers = array('q')
+        self.idents = []
+        self.arrivals = array('d')
+        self.high = 0
+        self.description = description
+        self.created = created
+        self.creator = creator
+
+
+class _Article(object):
+    """Index entry for an article
+
+    groups -- the names of the groups it was filed in
+    numbers -- its article numbers, parallel to groups
+
+    """
+    __slots__ = ['groups', 'numbers']
+
+    def __init__(self, groups, numbers):
+        self.groups = groups
+        self.numbers = numbers
+
+
+class MemoryNewsServer(nntpbits.NewsServer):
+    """nntpbits.MemoryNewsServer() -> SERVER
+
+    News server supporting both peering and reading, with in-memory
+    indexes.  Article text is kept in STORE.  Every message ID
+    accepted or rejected is recorded in HISTORY, which is used to
+    answer CHECK and IHAVE.
+
+    Optional arguments:
+    conncls -- connection class (default nntpbits.ServerConnection)
+    pathhost -- name used in Path and Xref headers
+    store -- an nntpbits.ArticleStore (default in-memory)
+    history -- an nntpbits.History (default in-memory)
+    overviews -- an nntpbits.OverviewStore (default with Xref only)
+    max_connections, max_commands, spill_threshold, spill_directory,
+        max_article_size -- as for nntpbits.NewsServer
+
+    Groups must be created with s.newgroup() before articles can be
+    posted or fed to them.  Articles are numbered and indexed when
+    they are accepted, so reader commands do not need to parse them
+    again.  Use the 'reader' feature with s.listen_address() etc. to
+    enable reader commands.
+
+    """
+
+    def __init__(self, conncls=nntpbits.ServerConnection,
+                 pathhost=b'nntpbits.invalid', store=None, history=None,
+                 overviews=None, **kwargs):
+        nntpbits.NewsServer.__init__(self, conncls=conncls, **kwargs)
+        self.pathhost = nntpbits._normalize(pathhost)
+        self.store = nntpbits.ArticleStore() if store is None else store
+        if history is None:
+            history = nntpbits.History(size=1 << 16)
+        self.history = history
+        if overviews is None:
+            overviews = nntpbits.OverviewStore()
+        self.overviews = overviews
+        self.active = nntpbits.ActiveList()
+        self.groups = {}
+        self.articles = {}
+        self.last_arrival = 0
+        self.creations = array('q')
+        self.creation_names = []
+
+    def close(self):
+        """s.close()
+
+        Close the article store and history.
+
+        """
+        self.store.close()
+        self.history.close()
+
+    # -------------------------------------------------------------------------
+    # Group management
+
+    def newgroup(self, name, status=b'y', description=b'', creator=None):
+        """s.newgroup(NAME[, STATUS][, DESCRIPTION][, CREATOR])
+
+        Create group NAME (or update its status and description, if
+        it already exists).
+
+        """
+        name = nntpbits._normalize(name)
+        if not _group_re.match(name):
+            raise Exception("invalid group name: %s" % name)
+        if creator is None:
+            creator = self.pathhost
+        with self.lock:
+            if name in self.groups:
+                group = self.groups[name]
+                group.description = nntpbits._normalize(description)
+            else:
+                created = int(time.time())
+                if len(self.creations) > 0:
+                    created = max(created, self.creations[-1])
+                group = _Group(nntpbits._normalize(description), created,
+                               nntpbits._normalize(creator))
+                self.groups[name] = group
+                self.creations.append(created)
+                self.creation_names.append(name)
+            self._update_active(name, group, nntpbits._normalize(status))
+
+    def rmgroup(self, name):
+        """s.rmgroup(NAME)
+
+        Remove group NAME.  Articles in it are not removed.
+
+        """
+        name = nntpbits._normalize(name)
+        with self.lock:
+            if name in self.groups:
+                del self.groups[name]
+                del self.active.groups[name]
+                self.active._sorted = None
+            self.overviews.remove_group(name)
+
+    def _update_active(self, name, group, status=None):
+        """s._update_active(NAME, GROUP[, STATUS])
+
+        Update the active list entry for NAME.  Call with s.lock
+        held.
+
+        """
+        if status is None:
+            status = self.active.groups[name][2]
+        if len(group.numbers) > 0:
+            low = group.numbers[0]
+        else:
+            low = group.high + 1
+        self.active.parse([b'%s %d %d %s' % (name, group.high, low, status)])
+
+    # -------------------------------------------------------------------------
+    # Ingest
+
+    def ihave_check(self, ident):
+        if ident in self.history:
+            return (435, b'Duplicate')
+        return (335, None)
+
+    def ihave(self, ident, article):
+        with self.lock:
+            if not self.history.add(ident):
+                return (437, b'Duplicate')
+            error = self._ingest(ident, article, False)
+        if error is not None:
+            return (437, error)
+        return (235, None)
+
+    def post_check(self):
+        return (340, None)
+
+    def post(self, article):
+        with self.lock:
+            error = self._ingest(None, article, True)
+        if error is not None:
+            return (441, error)
+        return (240, None)
+
+    def _ingest(self, ident, article, posting):
+        """s._ingest(IDENT, ARTICLE, POSTING) -> ERROR | None
+
+        Validate ARTICLE and, if it is acceptable, store and index it.
+        ARTICLE is a list of bytes objects or an
+        nntpbits.SpooledArticle, whose body is copied to the store
+        without being split into lines.  IDENT is the message ID
+        offered by the peer, or None for POST.  Returns an error
+        string if the article is rejected.  Call with s.lock held.
+
+        """
+        spooled = isinstance(article, nntpbits.SpooledArticle)
+        if spooled:
+            header = article.header()
+            if article.body_offset() >= len(article):
+                return "Article has no body"
+        else:
+            split = _header_length(article)
+            if split + 1 >= len(article):
+                return "Article has no body"
+            header = article[:split]
+        fields = _header_fields(header)
+        error = self._validate(fields, posting)
+        if error is not None:
+            return error
+        fields = dict(fields)
+        headers = [line for line in header
+                   if not line.lower().startswith(b'xref:')]
+        if posting:
+            for name, value in [
+                    (b'Message-ID', b'<%s@%s>' % (uuid.uuid4().hex.encode(),
+                                                  self.pathhost)),
+                    (b'Date', time.strftime('%a, %d %b %Y %H:%M:%S +0000',
+                                            time.gmtime()).encode()),
+                    (b'Path', b'not-for-mail')]:
+                if name.lower() not in fields:
+                    fields[name.lower()] = value
+                    headers.append(b'%s: %s' % (name, value))
+        for name in _required:
+            if name not in fields:
+                return "Missing %s header" % str(name, 'ascii')
+        if posting and b'followup-to' in fields:
+            for name in fields[b'followup-to'].split(b','):
+                name = name.strip(b' \t')
+                if name != b'poster' and name not in self.groups:
+                    return "Unknown Followup-To group"
+        if not _message_id_re.match(fields[b'message-id']):
+            return "Malformed Message-ID header"
+        if ident is None:
+            ident = fields[b'message-id']
+            if ident in self.history:
+                # As INN, so that clients can recognize it
+                return "435 Duplicate"
+        elif ident != fields[b'message-id']:
+            return "Message-ID header does not match"
+        names = []
+        for name in fields[b'newsgroups'].split(b','):
+            name = name.strip(b' \t')
+            if name in self.groups and name not in names:
+                names.append(name)
+        if len(names) == 0:
+            return "No known newsgroups"
+        for index, line in enumerate(headers):
+            if line.lower().startswith(b'path:'):
+                headers[index] = b'Path: %s!%s' % (self.pathhost,
+                                                   fields[b'path'])
+        numbers = [self.groups[name].high + 1 for name in names]
+        headers.append(b'Xref: %s %s' % (self.pathhost,
+                                         b' '.join(b'%s:%d' % pair for pair
+                                                   in zip(names, numbers))))
+        if spooled:
+            if not self.store.store_article(ident, headers, article):
+                return "Article store full"
+            size = (len(nntpbits.ArticleStore.encode(headers)) + 2
+                    + len(article) - article.body_offset())
+            overview = self.overviews.build_header(
+                headers, size, _body_lines(article.count, len(header)))
+        else:
+            lines = headers + article[split:]
+            if not self.store.store(ident, lines):
+                return "Article store full"
+            overview = self.overviews.build(lines)
+        self.articles[ident] = _Article(names, numbers)
+        # Peered articles are already in the history
+        self.history.add(ident)
+        # Keep the arrival indexes sorted if the clock goes backwards
+        now = self.last_arrival = max(time.time(), self.last_arrival)
+        for name, number in zip(names, numbers):
+            group = self.groups[name]
+            group.high = number
+            group.numbers.append(number)
+            group.idents.append(ident)
+            group.arrivals.append(now)
+            self.overviews.add(name, number, overview)
+            self._update_active(name, group)
+        return None
+
+    def _validate(self, fields, posting):
+        """s._validate(FIELDS, POSTING) -> ERROR | None
+
+        Check the syntax of the header fields FIELDS, as returned by
+        _header_fields().  Returns an error string if the article
+        should be rejected.
+
+        """
+        seen = set()
+        for name, value in fields:
+            field = str(name, 'ascii', 'replace')
+            if value.strip(b' \t') == b'':
+                return "Empty %s header" % field
+            if name in seen and name in _unique:
+                return "Duplicate %s header" % field
+            seen.add(name)
+            if name in _dates:
+                when = email.utils.parsedate_tz(str(value, 'ascii',
+                                                     'replace'))
+                if when is None:
+                    return "Malformed %s header" % field
+                when = email.utils.mktime_tz(when)
+                if name != b'expires' and (when < time.time() - _max_age or
+                                           when > time.time() + _max_skew):
+                    return "%s header out of range" % field
+            if name == b'from' and posting:
+                (realname, address) = email.utils.parseaddr(
+                    str(value, 'ascii', 'replace'))
+                (local, at, domain) = address.rpartition('@')
+                if local == '' or '.' not in domain:
+                    return "Malformed From header"
+        return None
+
+    # -------------------------------------------------------------------------
+    # Reader support
+
+    def capabilities(self, caps):
+        return [b'OVER MSGID' if cap == b'OVER' else cap for cap in caps]
+
+    def list_active(self, wildmat=None):
+        with self.lock:
+            return [(name,) + self.active.groups[name]
+                    for name in self._match(wildmat)]
+
+    def list_active_times(self, wildmat=None):
+        with self.lock:
+            return [(name, self.groups[name].created,
+                     self.groups[name].creator)
+                    for name in self._match(wildmat)]
+
+    def list_newsgroups(self, wildmat=None):
+        with self.lock:
+            return [(name, self.groups[name].description)
+                    for name in self._match(wildmat)]
+
+    def overview_fmt(self):
+        return self.overviews.format()
+
+    def list_headers(self):
+        return [b':']
+
+    def _match(self, wildmat):
+        """s._match(WILDMAT) -> LIST
+
+        Returns the sorted names of groups matching WILDMAT (or all
+        groups, if it is None).  Call with s.lock held.
+
+        """
+        if wildmat is None:
+            return list(self.active)
+        return self.active.match(wildmat)
+
+    def group(self, name):
+        with self.lock:
+            group = self.groups.get(name)
+            if group is None:
+                return None
+            (high, low, status) = self.active.groups[name]
+            return (len(group.numbers), low, high)
+
+    def _slice(self, group, low, high):
+        """s._slice(GROUP, LOW, HIGH) -> (START, END)
+
+        Returns the index range in GROUP's arrays of articles from LOW
+        to HIGH (inclusive).
+
+        """
+        return (bisect.bisect_left(group.numbers, low),
+                bisect.bisect_right(group.numbers, high))
+
+    def article_numbers(self, name, low, high):
+        with self.lock:
+            group = self.groups.get(name)
+            if group is None:
+                return []
+            (start, end) = self._slice(group, low, high)
+            return group.numbers[start:end].tolist()
+
+    def next_article(self, name, number):
+        with self.lock:
+            group = self.groups.get(name)
+            if group is None:
+                return None
+            index = bisect.bisect_right(group.numbers, number)
+            if index >= len(group.numbers):
+                return None
+            return group.numbers[index]
+
+    def previous_article(self, name, number):
+        with self.lock:
+            group = self.groups.get(name)
+            if group is None:
+                return None
+            index = bisect.bisect_left(group.numbers, number)
+            if index == 0:
+                return None
+            return group.numbers[index - 1]
+
+    def article_ident(self, name, number):
+        with self.lock:
+            group = self.groups.get(name)
+            if group is None:
+                return None
+            index = bisect.bisect_left(group.numbers, number)
+            if index >= len(group.numbers) or group.numbers[index] != number:
+                return None
+            return group.idents[index]
+
+    def article(self, ident):
+        data = self.store.retrieve(ident)
+        if data is None:
+            return None
+        return nntpbits.ArticleStore.decode(data)
+
+    def article_data(self, ident):
+        return self.store.retrieve(ident)
+
+    def article_file(self, ident):
+        return self.store.locate(ident)
+
+    def overview(self, name, low, high):
+        return self.overviews.get(name, low, high)
+
+    def overview_ident(self, ident):
+        with self.lock:
+            article = self.articles.get(ident)
+            if article is None:
+                return None
+            locations = list(zip(article.groups, article.numbers))
+        for name, number in locations:
+            line = self.overviews.line(name, number)
+            if line is not None:
+                return line
+        return None
+
+    def hdr(self, name, field, low, high):
+        result = self.overviews.hdr(name, field, low, high)
+        if result is None:
+            result = nntpbits.NewsServer.hdr(self, name, field, low, high)
+        return result
+
+    def hdr_ident(self, ident, field):
+        line = self.overview_ident(ident)
+        if line is not None:
+            value = self.overviews.field(line, field)
+            if value is not None:
+                return value
+        return nntpbits.NewsServer.hdr_ident(self, ident, field)
+
+    def newgroups(self, since):
+        with self.lock:
+            start = bisect.bisect_left(self.creations, since)
+            result = []
+            for created, name in zip(self.creations[start:],
+                                     self.creation_names[start:]):
+                # Skip groups that have since been removed (or recreated)
+                group = self.groups.get(name)
+                if group is not None and group.created == created:
+                    result.append((name,) + self.active.groups[name])
+            return result
+
+    def newnews(self, wildmat, since):
+        # Only groups matching WILDMAT are visited, and within each
+        # group only articles that arrived since SINCE
+        with self.lock:
+            arrivals = []
+            for name in self.active.match(wildmat):
+                group = self.groups[name]
+                start = bisect.bisect_left(group.arrivals, since)
+                arrivals.extend(zip(group.arrivals[start:],
+                                    group.idents[start:]))
+        if len(arrivals) == 0:
+            return []
+        # Crossposted articles appear once per group
+        arrivals.sort()
+        seen = set()
+        result = []
+        for when, ident in arrivals:
+            if ident not in seen:
+                seen.add(ident)
+                result.append(ident)
+        return result
@@ -16,7 +16,11 @@
 #
 import nntpbits
 import logging
+import multiprocessing
+import os
 import select
+import selectors
+import signal
 import socket
 import threading
 import time
@@ -39,12 +43,110 @@ class NewsServer(object):
     Override methods are responsible for locking (if required).  Use
     self.lock, which is created by the constructor.
 
+    Optional arguments:
+    max_connections -- limit on concurrent connections
+    max_commands -- limit on concurrent IHAVE/CHECK commands
+    spill_threshold -- see below
+    spill_directory -- directory for spilled articles
+    max_article_size -- limit on articles received by IHAVE/TAKETHIS
+
+    Over the connection limit, new connections are greeted with 400
+    and closed.  Over the command limit, IHAVE is answered with 436
+    and CHECK with 431.  Counts of admitted and refused connections
+    and commands are kept in self.admission.
+
+    If spill_threshold is not None then articles received by IHAVE
+    and TAKETHIS are passed to self.ihave() as nntpbits.SpooledArticle
+    objects rather than lists, and any article larger than
+    spill_threshold bytes is written to a temporary file in
+    spill_directory as it arrives.  This bounds the memory used per
+    connection.
+
+    Articles larger than max_article_size bytes (in wire format) are
+    not stored at all: the rest of the article is discarded as it
+    arrives and the peer is sent 437 (or 439 for TAKETHIS), without
+    calling self.ihave().
+
+    Set self.metrics to an nntpbits.ServerMetrics object to collect
+    per-verb command metrics.  They can be read with LIST STATS.
+
+    Set self.slowlog to an nntpbits.SlowLog object to record commands
+    that take longer than its threshold.  It can be read with LIST
+    SLOWLOG.
+
     """
 
-    def __init__(self, conncls=nntpbits.ServerConnection):
+    def __init__(self, conncls=nntpbits.ServerConnection,
+                 max_connections=None, max_commands=None,
+                 spill_threshold=None, spill_directory=None,
+                 max_article_size=None):
         self.conncls = conncls
+        self.spill_threshold = spill_threshold
+        self.spill_directory = spill_directory
+        self.max_article_size = max_article_size
         self.lock = threading.Lock()
         self.log = logging.getLogger(__name__)
+        self.stats = None
+        self.metrics = None
+        self.slowlog = None
+        self.limits = {'connections': max_connections,
+                       'commands': max_commands}
+        self.admission = {}
+        for kind in self.limits:
+            self.admission[kind] = 0
+            self.admission['peak_' + kind] = 0
+            self.admission['admitted_' + kind] = 0
+            self.admission['refused_' + kind] = 0
+
+    # -------------------------------------------------------------------------
+    # Admission control
+
+    def admit(self, kind, force=False):
+        """ns.admit(KIND[, FORCE]) -> BOOL
+
+        Admit a connection (KIND='connections') or command
+        (KIND='commands').  Returns True if it is within the limit and
+        False if not.  If FORCE is True then it is admitted
+        regardless.
+
+        Each successful admission must be matched by a call to
+        ns.release().
+
+        """
+        with self.lock:
+            limit = self.limits[kind]
+            if (not force and limit is not None
+                    and self.admission[kind] >= limit):
+                self.admission['refused_' + kind] += 1
+                return False
+            self.admission[kind] += 1
+            self.admission['admitted_' + kind] += 1
+            if self.admission[kind] > self.admission['peak_' + kind]:
+                self.admission['peak_' + kind] = self.admission[kind]
+            return True
+
+    def release(self, kind):
+        """ns.release(KIND)
+
+        Release a connection or command admitted by ns.admit().
+
+        """
+        with self.lock:
+            self.admission[kind] -= 1
+
+    def _refuse(self, s, a):
+        """ns._refuse(SOCKET, ADDRESS)
+
+        Greet a connection refused by admission control with 400 and
+        close it.
+
+        """
+        self.log.info("%x: refused %s" % (threading.get_ident(), a))
+        try:
+            s.send(b"400 Too many connections\r\n")
+        except OSError:
+            pass
+        s.close()
 
     # -------------------------------------------------------------------------
     # Listening
@@ -67,6 +169,9 @@ class NewsServer(object):
                 (ns, a) = s.accept()
             except BlockingIOError:
                 continue
+            if not self.admit('connections'):
+                self._refuse(ns, a)
+                continue
 
             def worker(ns, a):
                 try:
@@ -86,9 +191,14 @@ class NewsServer(object):
                     self.log.error("%x: %s"
                                    % (threading.get_ident(), traceback.format_exc()))
                 finally:
+                    self.release('connections')
                     nntpbits.finished_thread()
             t = threading.Thread(target=worker, args=[ns, a], daemon=daemon)
-            nntpbits.start_thread(t)
+            try:
+                nntpbits.start_thread(t)
+            except BaseException:
+                self.release('connections')
+                raise
 
     def listen_address(self, address, port, wait=False, daemon=True,
                        features=[]):
@@ -107,24 +217,7 @@ class NewsServer(object):
         return but instead blocks.
 
         """
-        if address == '*':
-            addresses = ['::']  # assume IPV6_V6ONLY=0
-        elif address == '*localhost':
-            addresses = ['127.0.0.1', '::1']
-        else:
-            addresses = [address]
-        addrs = []
-        for address in addresses:
-            addrs.extend(socket.getaddrinfo(address, port,
-                                            0, socket.SOCK_STREAM, 0,
-                                            socket.AI_PASSIVE
-                                            | socket.AI_ADDRCONFIG))
-        for addr in addrs:
-            (family, type_, proto, canonname, sockaddr) = addr
-            s = socket.socket(family, type_, proto)
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(sockaddr)
-            s.listen(socket.SOMAXCONN)
+        for s, sockaddr in self._bind(address, port):
 
             def worker(s, sockaddr):
                 try:
@@ -151,6 +244,290 @@ class NewsServer(object):
             nntpbits._maybe_stop()
             time.sleep(1)
 
+    def _bind(self, address, port, reuseport=False):
+        """ns._bind(ADDRESS, PORT[, REUSEPORT]) -> LIST
+
+        Resolves ADDRESS:PORT as for ns.listen_address() and returns
+        a list of (SOCKET, SOCKADDR) tuples for listening sockets
+        bound to the results.
+
+        If REUSEPORT is True then SO_REUSEPORT is set, so that several
+        sockets may be bound to the same address.
+
+        """
+        if address == '*':
+            addresses = ['::']  # assume IPV6_V6ONLY=0
+        elif address == '*localhost':
+            addresses = ['127.0.0.1', '::1']
+        else:
+            addresses = [address]
+        addrs = []
+        for address in addresses:
+            addrs.extend(socket.getaddrinfo(address, port,
+                                            0, socket.SOCK_STREAM, 0,
+                                            socket.AI_PASSIVE
+                                            | socket.AI_ADDRCONFIG))
+        sockets = []
+        for addr in addrs:
+            (family, type_, proto, canonname, sockaddr) = addr
+            s = socket.socket(family, type_, proto)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuseport:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            s.bind(sockaddr)
+            s.listen(socket.SOMAXCONN)
+            sockets.append((s, sockaddr))
+        return sockets
+
+    def listen_selector(self, address, port, wait=False, daemon=True,
+                        features=[]):
+        """ns.listen_selector(ADDRESS, PORT[, wait=WAIT][, daemon=DAEMON], [features=FEATURES])
+
+        Like ns.listen_address(), but serves all connections (on all
+        the resolved addresses) from a single thread using the
+        selectors module, rather than a thread per connection.
+
+        The connection class must support the event-driven interface
+        of nntpbits.ServerConnection.
+
+        """
+        sockets = self._bind(address, port)
+
+        def worker():
+            try:
+                self.log.info("%x: selector loop started %s"
+                              % (threading.get_ident(),
+                                 [sockaddr for s, sockaddr in sockets]))
+                self._selector_loop([s for s, sockaddr in sockets],
+                                    features)
+            except nntpbits._Stop:
+                self.log.debug("%x: selector loop stopped"
+                               % threading.get_ident())
+            except BaseException as e:
+                self.log.error("%x: selector loop error %s"
+                               % (threading.get_ident(), e))
+                self.log.error("%x: %s"
+                               % (threading.get_ident(),
+                                  traceback.format_exc()))
+            finally:
+                for s, sockaddr in sockets:
+                    s.close()
+                nntpbits.finished_thread()
+        t = threading.Thread(target=worker, daemon=daemon)
+        nntpbits.start_thread(t)
+        while wait:
+            nntpbits._maybe_stop()
+            time.sleep(1)
+
+    def _selector_loop(self, listeners, features):
+        """ns._selector_loop(LISTENERS, FEATURES)
+
+        Accept connections on the listening sockets LISTENERS and
+        service them, all from the calling thread.  Only returns by
+        raising an exception.
+
+        """
+        sel = selectors.DefaultSelector()
+        conns = {}
+        for s in listeners:
+            s.setblocking(False)
+            sel.register(s, selectors.EVENT_READ, None)
+        try:
+            while True:
+                nntpbits._maybe_stop()
+                for key, mask in sel.select(1.0):
+                    if key.data is None:
+                        self._selector_accept(sel, conns, key.fileobj,
+                                              features)
+                        continue
+                    conn = key.data
+                    try:
+                        if mask & selectors.EVENT_READ:
+                            conn.event_read()
+                        if mask & selectors.EVENT_WRITE:
+                            conn.event_write()
+                            if not conn.wants_write():
+                                conn.process_input()
+                    except nntpbits._Stop:
+                        raise
+                    except Exception as e:
+                        self.log.error("%x: client error: %s"
+                                       % (threading.get_ident(), e))
+                        self.log.error("%x: %s"
+                                       % (threading.get_ident(),
+                                          traceback.format_exc()))
+                        conn.finished = True
+                        conn.w.data.clear()
+                    self._selector_update(sel, conns, conn)
+        finally:
+            for conn in list(conns.values()):
+                sel.unregister(conn.sock)
+                conn.disconnect()
+                self.release('connections')
+            sel.close()
+
+    def _selector_accept(self, sel, conns, listener, features):
+        """ns._selector_accept(SELECTOR, CONNS, LISTENER, FEATURES)
+
+        Accept pending connections on LISTENER.
+
+        """
+        while True:
+            try:
+                (ns, a) = listener.accept()
+            except BlockingIOError:
+                return
+            if not self.admit('connections'):
+                self._refuse(ns, a)
+                continue
+            self.log.info("%x: connected %s" % (threading.get_ident(), a))
+            if self.stats is not None:
+                self.stats.connection()
+            conn = self.conncls(self)
+            conn.enable(features)
+            conn.start_events(ns)
+            conns[conn.key] = conn
+            sel.register(ns, selectors.EVENT_READ, conn)
+            self._selector_update(sel, conns, conn)
+
+    def _selector_update(self, sel, conns, conn):
+        """ns._selector_update(SELECTOR, CONNS, CONN)
+
+        Update the events CONN is waiting for, or close it if it has
+        finished.
+
+        """
+        if conn.done():
+            sel.unregister(conn.sock)
+            del conns[conn.key]
+            conn.disconnect()
+            self.release('connections')
+            self.log.info("%x: disconnected" % threading.get_ident())
+            return
+        events = 0
+        if conn.wants_read():
+            events |= selectors.EVENT_READ
+        if conn.wants_write():
+            events |= selectors.EVENT_WRITE
+        if events == 0:
+            # Waiting for nothing would be a deadlock
+            events = selectors.EVENT_READ
+        sel.modify(conn.sock, events, conn)
+
+    def listen_workers(self, address, port, workers=None, wait=False,
+                       daemon=True, features=[]):
+        """ns.listen_workers(ADDRESS, PORT[, workers=WORKERS][, wait=WAIT][, daemon=DAEMON], [features=FEATURES])
+
+        Like ns.listen_selector(), but forks WORKERS processes
+        (default one per CPU), each with its own SO_REUSEPORT
+        listeners on ADDRESS:PORT, so that the kernel spreads
+        connections between them.
+
+        Hooks run in the worker processes.  Any state they share must
+        be created before calling this method and must live in shared
+        memory (for instance nntpbits.SharedIdSet); ordinary attributes
+        are copied into each worker.  Connection and response counts
+        are collected in ns.stats, an nntpbits.WorkerStats object.
+
+        nntpbits.stop() stops all the workers.
+
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.stats = nntpbits.WorkerStats(workers)
+        sockets = [self._bind(address, port, reuseport=True)
+                   for worker in range(workers)]
+        stop_event = multiprocessing.Event()
+        context = multiprocessing.get_context('fork')
+        processes = []
+        for worker in range(workers):
+            p = context.Process(target=self._worker_main,
+                                args=[worker, sockets, stop_event,
+                                      features],
+                                daemon=daemon)
+            p.start()
+            processes.append(p)
+        for listeners in sockets:
+            for s, sockaddr in listeners:
+                s.close()
+
+        def monitor():
+            try:
+                self.log.info("%x: started %d workers %s:%s"
+                              % (threading.get_ident(), workers,
+                                 address, port))
+                exited = set()
+                while True:
+                    nntpbits._maybe_stop()
+                    for worker, p in enumerate(processes):
+                        if p.exitcode is not None and worker not in exited:
+                            self.log.error("%x: worker %d exited %d"
+                                           % (threading.get_ident(),
+                                              worker, p.exitcode))
+                            exited.add(worker)
+                    time.sleep(0.25)
+            except nntpbits._Stop:
+                self.log.debug("%x: stopping workers"
+                               % threading.get_ident())
+            except BaseException as e:
+                self.log.error("%x: worker monitor error %s"
+                               % (threading.get_ident(), e))
+                self.log.error("%x: %s"
+                               % (threading.get_ident(),
+                                  traceback.format_exc()))
+            finally:
+                stop_event.set()
+                for p in processes:
+                    p.join(5)
+                    if p.exitcode is None:
+                        p.terminate()
+                        p.join()
+                nntpbits.finished_thread()
+        t = threading.Thread(target=monitor, daemon=daemon)
+        nntpbits.start_thread(t)
+        while wait:
+            nntpbits._maybe_stop()
+            time.sleep(1)
+
+    def _worker_main(self, worker, sockets, stop_event, features):
+        """ns._worker_main(WORKER, SOCKETS, STOP_EVENT, FEATURES)
+
+        Body of worker process WORKER for ns.listen_workers().  Runs
+        a selector loop on the worker's listeners until STOP_EVENT is
+        set.
+
+        """
+        # Shutdown is coordinated by the parent
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.stats.select(worker)
+        for index, listeners in enumerate(sockets):
+            if index != worker:
+                for s, sockaddr in listeners:
+                    s.close()
+        listeners = sockets[worker]
+
+        def loop():
+            try:
+                self._selector_loop([s for s, sockaddr in listeners],
+                                    features)
+            except nntpbits._Stop:
+                pass
+            except BaseException as e:
+                self.log.error("%x: worker %d error %s"
+                               % (threading.get_ident(), worker, e))
+                self.log.error("%x: %s"
+                               % (threading.get_ident(),
+                                  traceback.format_exc()))
+            finally:
+                nntpbits.finished_thread()
+        t = threading.Thread(target=loop, daemon=True)
+        nntpbits.start_thread(t)
+        while not stop_event.wait(0.25) and t.is_alive():
+            pass
+        nntpbits.stop()
+        for s, sockaddr in listeners:
+            s.close()
+
     # -------------------------------------------------------------------------
     # CAPABILITIES
 
@@ -165,7 +542,7 @@ class NewsServer(object):
     # -------------------------------------------------------------------------
     # POST
 
-    def post_check(self, article):
+    def post_check(self):
         """ns.post_check() -> (RESPONSE, ARGUMENT)
 
         Implementation of the first half of the POST command.
@@ -216,12 +593,279 @@ class NewsServer(object):
         TAKETHIS command.
 
         IDENT is a bytes object containing the message ID submitted by
-        the peer and ARTICLE is a list of bytes objects.  The return
-        value is an NNTP response and argument.  The response should
-        be:
+        the peer and ARTICLE is a list of bytes objects, or an
+        nntpbits.SpooledArticle if ns.spill_threshold is set.  A
+        SpooledArticle is discarded when this method returns.  The
+        return value is an NNTP response and argument.  The response
+        should be:
         235 -- success
         436 -- retry later
         437 -- article not wanted
 
         """
         return (480, "Peering not available")
+
+    # -------------------------------------------------------------------------
+    # Reader support
+    #
+    # These methods are used by the reader commands (see
+    # ServerConnection.enable_reader()).  The defaults describe a
+    # server with no groups or articles.  Group names, message IDs and
+    # header names are bytes objects.  Article ranges (LOW, HIGH) are
+    # _inclusive_.
+
+    def list_active(self, wildmat=None):
+        """ns.list_active([WILDMAT]) -> LIST
+
+        Returns a list of (NAME, HIGH, LOW, STATUS) tuples for the
+        groups matching WILDMAT (an nntpbits.Wildmat), or all groups.
+
+        """
+        return []
+
+    def list_active_times(self, wildmat=None):
+        """ns.list_active_times([WILDMAT]) -> LIST
+
+        Returns a list of (NAME, TIME, CREATOR) tuples for the groups
+        matching WILDMAT, or all groups.  TIME is an integer.
+
+        """
+        return []
+
+    def list_newsgroups(self, wildmat=None):
+        """ns.list_newsgroups([WILDMAT]) -> LIST
+
+        Returns a list of (NAME, DESCRIPTION) tuples for the groups
+        matching WILDMAT, or all groups.
+
+        """
+        return []
+
+    def overview_fmt(self):
+        """ns.overview_fmt() -> LIST
+
+        Returns the overview format, as for LIST OVERVIEW.FMT.
+
+        """
+        return [b'Subject:', b'From:', b'Date:', b'Message-ID:',
+                b'References:', b':bytes', b':lines']
+
+    def list_headers(self):
+        """ns.list_headers() -> LIST
+
+        Returns the list of fields that HDR supports, as for LIST
+        HEADERS.
+
+        """
+        return [b':', b':bytes', b':lines']
+
+    def group(self, name):
+        """ns.group(NAME) -> (COUNT, LOW, HIGH) | None
+
+        Returns the estimated article count and low and high water
+        marks for group NAME, or None if it does not exist.
+
+        """
+        return None
+
+    def article_numbers(self, name, low, high):
+        """ns.article_numbers(NAME, LOW, HIGH) -> ITERABLE
+
+        Returns the article numbers in group NAME between LOW and
+        HIGH, in ascending order.
+
+        """
+        return []
+
+    def next_article(self, name, number):
+        """ns.next_article(NAME, NUMBER) -> NUMBER | None
+
+        Returns the first article number in group NAME after NUMBER,
+        or None.
+
+        """
+        return None
+
+    def previous_article(self, name, number):
+        """ns.previous_article(NAME, NUMBER) -> NUMBER | None
+
+        Returns the last article number in group NAME before NUMBER,
+        or None.
+
+        """
+        return None
+
+    def article_ident(self, name, number):
+        """ns.article_ident(NAME, NUMBER) -> IDENT | None
+
+        Returns the message ID of article NUMBER in group NAME, or
+        None if there is no such article.
+
+        """
+        return None
+
+    def article(self, ident):
+        """ns.article(IDENT) -> LIST | None
+
+        Returns the article IDENT as a list of bytes objects, or None
+        if there is no such article.
+
+        """
+        return None
+
+    def article_data(self, ident):
+        """ns.article_data(IDENT) -> DATA | None
+
+        Returns the article IDENT in wire format (dot-stuffed, each
+        line followed by CRLF, without the terminating '.' line) as a
+        bytes-like object, or None if it is not available in that
+        form.  If this returns None then ns.article() is used.
+
+        """
+        return None
+
+    def article_file(self, ident):
+        """ns.article_file(IDENT) -> (FILE, OFFSET, LENGTH) | None
+
+        Returns the location of the wire format of article IDENT in a
+        file, or None.  If this is available then ARTICLE, HEAD and
+        BODY are served with socket.sendfile() where possible.  The
+        data must match ns.article_data(IDENT).
+
+        """
+        return None
+
+    def overview(self, name, low, high):
+        """ns.overview(NAME, LOW, HIGH) -> ITERABLE
+
+        Returns (NUMBER, LINE) tuples for the articles in group NAME
+        between LOW and HIGH.  LINE is the overview data after the
+        article number, as a bytes object.
+
+        """
+        return []
+
+    def overview_ident(self, ident):
+        """ns.overview_ident(IDENT) -> LINE | None
+
+        Returns the overview data for article IDENT, after the
+        article number, or None if it is not available.
+
+        """
+        return None
+
+    def hdr(self, name, field, low, high):
+        """ns.hdr(NAME, FIELD, LOW, HIGH) -> ITERABLE
+
+        Returns (NUMBER, VALUE) tuples giving the header field FIELD
+        of the articles in group NAME between LOW and HIGH.
+
+        The default implementation retrieves each article.
+
+        """
+        result = []
+        for number in self.article_numbers(name, low, high):
+            ident = self.article_ident(name, number)
+            value = None if ident is None else self.hdr_ident(ident, field)
+            if value is not None:
+                result.append((number, value))
+        return result
+
+    def hdr_ident(self, ident, field):
+        """ns.hdr_ident(IDENT, FIELD) -> VALUE | None
+
+        Returns the header field FIELD of article IDENT (empty if it
+        has no such header), or None if there is no such article.
+
+        The default implementation retrieves the article.
+
+        """
+        article = self.article(ident)
+        if article is None:
+            return None
+        if field == b':bytes':
+            return b'%d' % sum(len(line) + 2 for line in article)
+        if field == b':lines':
+            return b'%d' % _body_lines(len(article),
+                                       _header_length(article))
+        value = _header_value(article, field) or b''
+        return value.replace(b'\t', b' ')
+
+    def newgroups(self, since):
+        """ns.newgroups(SINCE) -> ITERABLE
+
+        Returns (NAME, HIGH, LOW, STATUS) tuples for groups created
+        since SINCE (a time.time() value).
+
+        """
+        return []
+
+    def newnews(self, wildmat, since):
+        """ns.newnews(WILDMAT, SINCE) -> ITERABLE
+
+        Returns the message IDs of articles in groups matching
+        WILDMAT (an nntpbits.Wildmat) that arrived since SINCE (a
+        time.time() value).
+
+        """
+        return []
+
+
+def _header_length(article):
+    """_header_length(ARTICLE) -> COUNT
+
+    Returns the number of header lines in ARTICLE.
+
+    """
+    try:
+        return article.index(b'')
+    except ValueError:
+        return len(article)
+
+
+def _body_lines(count, header_length):
+    """_body_lines(COUNT, HEADER_LENGTH) -> COUNT
+
+    Returns the number of body lines in an article of COUNT lines
+    with HEADER_LENGTH header lines.  Header-only articles (with no
+    blank line) have no body lines.
+
+    """
+    return max(count - header_length - 1, 0)
+
+
+def _header_fields(article):
+    """_header_fields(ARTICLE) -> LIST
+
+    Returns the header fields of ARTICLE as a list of (NAME, VALUE)
+    tuples.  NAME is lower case, without the colon.  VALUE is
+    unfolded, with leading whitespace removed.
+
+    """
+    fields = []
+    for line in article:
+        if line == b'':
+            break
+        if line[0:1] in (b' ', b'\t') and len(fields) > 0:
+            (name, value) = fields[-1]
+            fields[-1] = (name, value + line)
+            continue
+        (name, colon, value) = line.partition(b':')
+        if colon == b'':
+            continue
+        fields.append((name.lower(), value.lstrip(b' \t')))
+    return fields
+
+
+def _header_value(article, field):
+    """_header_value(ARTICLE, FIELD) -> VALUE | None
+
+    Returns the (first) value of header field FIELD in ARTICLE, as
+    for _header_fields(), or None if it is absent.
+
+    """
+    field = nntpbits._normalize(field).lower()
+    for name, value in _header_fields(article):
+        if name == field:
+            return value
+    return None
@@ -0,0 +1,62 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+class Observation(object):
+    """Timing record for a single client command
+
+    Attributes:
+    key -- connection key
+    verb -- command verb as an upper-case bytes object
+    code -- final response code, or None if no response arrived
+    sent -- bytes sent, including any article
+    received -- bytes received, including any multi-line response
+    start -- time.monotonic() when the command was sent
+    first_byte -- time.monotonic() when the (first) response started
+                  to arrive
+    last_byte -- time.monotonic() when the response was complete
+
+    """
+
+    __slots__ = ['key', 'verb', 'code', 'sent', 'received',
+                 'start', 'first_byte', 'last_byte']
+
+    def __init__(self, key, verb, start):
+        self.key = key
+        self.verb = verb
+        self.code = None
+        self.sent = 0
+        self.received = 0
+        self.start = start
+        self.first_byte = None
+        self.last_byte = None
+
+    def latency(self):
+        """o.latency() -> SECONDS | None
+
+        Returns the time from sending the command to receiving the
+        last byte of the response.
+
+        """
+        if self.last_byte is None:
+            return None
+        return self.last_byte - self.start
+
+    def __repr__(self):
+        return ("Observation(%s %s %s sent=%d received=%d latency=%s)"
+                % (self.key, self.verb, self.code, self.sent,
+                   self.received, self.latency()))
@@ -0,0 +1,146 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import array
+import threading
+import time
+
+
+class OfferCache(object):
+    """Recently-offered message ID cache
+
+    Construction:
+    nntpbits.OfferCache([size=SIZE][, ...]) -> cache
+
+    Optional arguments:
+    size -- maximum number of message IDs remembered
+    accepted_ttl -- seconds to remember accepted message IDs
+    refused_ttl -- seconds to remember refused message IDs
+    deferred_ttl -- seconds to remember deferred message IDs
+
+    Remembers how a peer responded to recent offers, so that feeders
+    need not offer it the same message ID again.  Use one cache per
+    peer; it may be shared between connections to that peer, and
+    passed to ClientConnection as the offer_cache argument.
+
+    Message IDs are stored as 64-bit hashes in a fixed-size
+    set-associative table, costing 12 bytes per entry.  When a set is
+    full the entry closest to expiry is replaced.  A hash collision
+    can cause an offer to be skipped wrongly; with 64-bit hashes this
+    is very unlikely.
+
+    """
+
+    ACCEPTED = 1
+    REFUSED = 2
+    DEFERRED = 3
+
+    # Map peering responses to cache states
+    _states = {
+        235: ACCEPTED,
+        239: ACCEPTED,
+        435: REFUSED,
+        437: REFUSED,
+        438: REFUSED,
+        439: REFUSED,
+        436: DEFERRED,
+        431: DEFERRED,
+    }
+
+    _ways = 8
+
+    def __init__(self, size=1 << 20, accepted_ttl=3600, refused_ttl=3600,
+                 deferred_ttl=60):
+        self.sets = max(1, (size + self._ways - 1) // self._ways)
+        self.keys = array.array('Q', bytes(8 * self.sets * self._ways))
+        self.stamps = array.array('I', bytes(4 * self.sets * self._ways))
+        self.ttls = {OfferCache.ACCEPTED: accepted_ttl,
+                     OfferCache.REFUSED: refused_ttl,
+                     OfferCache.DEFERRED: deferred_ttl}
+        self.epoch = time.monotonic()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _now(self):
+        return int(time.monotonic() - self.epoch)
+
+    def _key(self, ident):
+        """c._key(IDENT) -> KEY
+
+        Returns the nonzero 64-bit hash of IDENT.
+
+        """
+        return (hash(nntpbits._normalize(ident)) & 0xFFFFFFFFFFFFFFFF) or 1
+
+    def lookup(self, ident):
+        """c.lookup(IDENT) -> STATE | None
+
+        Returns nntpbits.OfferCache.ACCEPTED, REFUSED or DEFERRED if
+        IDENT was recently offered, or None if not.
+
+        """
+        key = self._key(ident)
+        base = (key % self.sets) * self._ways
+        now = self._now()
+        with self.lock:
+            for slot in range(base, base + self._ways):
+                if self.keys[slot] == key:
+                    stamp = self.stamps[slot]
+                    if stamp >> 2 > now:
+                        self.hits += 1
+                        return stamp & 3
+                    break
+            self.misses += 1
+            return None
+
+    def record(self, ident, state):
+        """c.record(IDENT, STATE)
+
+        Remember that IDENT was ACCEPTED, REFUSED or DEFERRED.
+
+        """
+        key = self._key(ident)
+        base = (key % self.sets) * self._ways
+        stamp = ((self._now() + self.ttls[state]) << 2) | state
+        with self.lock:
+            victim = base
+            for slot in range(base, base + self._ways):
+                if self.keys[slot] == key or self.keys[slot] == 0:
+                    victim = slot
+                    break
+                if self.stamps[slot] >> 2 < self.stamps[victim] >> 2:
+                    victim = slot
+            else:
+                if self.stamps[victim] >> 2 > self._now():
+                    self.evictions += 1
+            self.keys[victim] = key
+            self.stamps[victim] = stamp
+
+    def record_response(self, ident, code):
+        """c.record_response(IDENT, CODE)
+
+        Remember the peer's response CODE to an offer of IDENT.
+        Responses that do not say anything about the article are
+        ignored.
+
+        """
+        state = OfferCache._states.get(code)
+        if state is not None:
+            self.record(ident, state)
+
@@ -0,0 +1,196 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+from nntpbits.NewsServer import _body_lines, _header_fields, _header_length
+from array import array
+import bisect
+import threading
+
+# Header fields at the start of every overview line
+_standard = [b'Subject', b'From', b'Date', b'Message-ID', b'References']
+
+# Characters replaced by spaces in overview data
+_overview_table = bytes.maketrans(b'\t\r\n', b'   ')
+
+
+class _GroupOverview(object):
+    """Overview data for one group
+
+    numbers -- ascending article numbers
+    offsets -- start of each article's line in data, parallel to
+               numbers, plus the end of the last line
+    data -- overview lines (without article numbers), concatenated
+
+    """
+    __slots__ = ['numbers', 'offsets', 'data']
+
+    def __init__(self):
+        self.numbers = array('q')
+        self.offsets = array('Q', [0])
+        self.data = bytearray()
+
+
+class OverviewStore(object):
+    """Per-group overview database
+
+    Construction:
+    nntpbits.OverviewStore([extra=FIELDS]) -> store
+
+    Overview lines are built once, by s.build(), when an article is
+    accepted, and added to each group it is filed in with s.add().
+    FIELDS is a list of extra header names, which appear as "full"
+    fields after the standard ones (default [b'Xref']).
+
+    Each group's lines are concatenated in a single buffer, indexed
+    by arrays of article numbers and offsets, so retrieving a range
+    of articles for OVER or HDR is a bisection followed by a slice.
+
+    """
+
+    def __init__(self, extra=[b'Xref']):
+        self.extra = [nntpbits._normalize(field) for field in extra]
+        self.groups = {}
+        self.lock = threading.Lock()
+        names = ([name.lower() for name in _standard]
+                 + [b':bytes', b':lines']
+                 + [name.lower() for name in self.extra])
+        self.fields = dict((name, index) for index, name in enumerate(names))
+
+    def format(self):
+        """s.format() -> LIST
+
+        Returns the overview format, as for LIST OVERVIEW.FMT.
+
+        """
+        return ([name + b':' for name in _standard]
+                + [b':bytes', b':lines']
+                + [name + b':full' for name in self.extra])
+
+    def build(self, lines):
+        """s.build(LINES) -> LINE
+
+        Construct the overview line for an article, which is a list
+        of bytes objects.  The result does not include the article
+        number.
+
+        """
+        split = _header_length(lines)
+        size = sum(len(line) + 2 + (line[0:1] == b'.') for line in lines)
+        return self.build_header(lines[:split], size,
+                                 _body_lines(len(lines), split))
+
+    def build_header(self, header, size, count):
+        """s.build_header(HEADER, SIZE, COUNT) -> LINE
+
+        Construct the overview line for an article with header HEADER
+        (a list of bytes objects), SIZE bytes in wire format and COUNT
+        body lines, without needing the body itself.
+
+        """
+        fields = dict(reversed(_header_fields(header)))
+        values = [fields.get(name.lower(), b'') for name in _standard]
+        values.append(b'%d' % size)
+        values.append(b'%d' % count)
+        for name in self.extra:
+            value = fields.get(name.lower())
+            values.append(b'' if value is None
+                          else b'%s: %s' % (name, value))
+        return b'\t'.join(value.translate(_overview_table)
+                          for value in values)
+
+    def add(self, group, number, line):
+        """s.add(GROUP, NUMBER, LINE)
+
+        Add overview LINE for article NUMBER in GROUP.  Article
+        numbers must be added in ascending order.
+
+        """
+        with self.lock:
+            overview = self.groups.get(group)
+            if overview is None:
+                overview = self.groups[group] = _GroupOverview()
+            overview.numbers.append(number)
+            overview.data += line
+            overview.offsets.append(len(overview.data))
+
+    def remove_group(self, group):
+        """s.remove_group(GROUP)
+
+        Discard the overview data for GROUP.
+
+        """
+        with self.lock:
+            self.groups.pop(group, None)
+
+    def get(self, group, low, high):
+        """s.get(GROUP, LOW, HIGH) -> LIST
+
+        Returns (NUMBER, LINE) tuples for articles in GROUP from LOW
+        to HIGH (inclusive).
+
+        """
+        with self.lock:
+            overview = self.groups.get(group)
+            if overview is None:
+                return []
+            start = bisect.bisect_left(overview.numbers, low)
+            end = bisect.bisect_right(overview.numbers, high)
+            base = overview.offsets[start]
+            data = bytes(overview.data[base:overview.offsets[end]])
+            offsets = overview.offsets[start:end + 1]
+            numbers = overview.numbers[start:end]
+        return [(numbers[i], data[offsets[i] - base:offsets[i + 1] - base])
+                for i in range(len(numbers))]
+
+    def line(self, group, number):
+        """s.line(GROUP, NUMBER) -> LINE | None
+
+        Returns the overview line for article NUMBER in GROUP, or
+        None.
+
+        """
+        result = self.get(group, number, number)
+        return result[0][1] if len(result) > 0 else None
+
+    def field(self, line, name):
+        """s.field(LINE, NAME) -> VALUE | None
+
+        Returns the value of field NAME (e.g. b'Subject' or
+        b':bytes') from an overview LINE, or None if NAME is not in
+        the overview.
+
+        """
+        index = self.fields.get(nntpbits._normalize(name).lower())
+        if index is None:
+            return None
+        value = line.split(b'\t')[index]
+        if index >= len(_standard) + 2:
+            value = value.partition(b':')[2].lstrip(b' ')
+        return value
+
+    def hdr(self, group, name, low, high):
+        """s.hdr(GROUP, NAME, LOW, HIGH) -> LIST | None
+
+        Returns (NUMBER, VALUE) tuples giving field NAME for articles
+        in GROUP from LOW to HIGH, or None if NAME is not in the
+        overview.
+
+        """
+        if nntpbits._normalize(name).lower() not in self.fields:
+            return None
+        return [(number, self.field(line, name))
+                for number, line in self.get(group, low, high)]
@@ -0,0 +1,181 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import array
+import bisect
+
+
+class RangeSet(object):
+    """Compact set of article numbers
+
+    Construction:
+    nntpbits.RangeSet() -> empty set
+    nntpbits.RangeSet(NUMBERS) -> set containing NUMBERS
+
+    The set is stored as sorted runs of consecutive numbers, so a
+    group with few holes takes a few bytes regardless of its size.
+
+    Numbers are normally added in ascending order with append(),
+    which is what LISTGROUP produces.  NUMBERS need not be sorted
+    but building from unsorted input is slower.
+
+    """
+
+    def __init__(self, numbers=()):
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self.count = 0
+        if isinstance(numbers, RangeSet):
+            self.starts.extend(numbers.starts)
+            self.ends.extend(numbers.ends)
+            self.count = numbers.count
+            return
+        for n in numbers:
+            if len(self.ends) == 0 or n > self.ends[-1]:
+                self.append(n)
+            else:
+                self.add(n)
+
+    def append(self, n):
+        """r.append(NUMBER)
+
+        Add NUMBER, which must be greater than any number already
+        present.
+
+        """
+        if len(self.ends) > 0:
+            if n <= self.ends[-1]:
+                raise ValueError("RangeSet.append: %d out of order" % n)
+            if n == self.ends[-1] + 1:
+                self.ends[-1] = n
+                self.count += 1
+                return
+        self.starts.append(n)
+        self.ends.append(n)
+        self.count += 1
+
+    def add(self, n):
+        """r.add(NUMBER)
+
+        Add NUMBER, in any order.
+
+        """
+        i = bisect.bisect_right(self.starts, n) - 1
+        if i >= 0 and n <= self.ends[i]:
+            return
+        self.count += 1
+        joins_left = i >= 0 and self.ends[i] + 1 == n
+        joins_right = (i + 1 < len(self.starts)
+                       and self.starts[i + 1] - 1 == n)
+        if joins_left and joins_right:
+            self.ends[i] = self.ends[i + 1]
+            del self.starts[i + 1]
+            del self.ends[i + 1]
+        elif joins_left:
+            self.ends[i] = n
+        elif joins_right:
+            self.starts[i + 1] = n
+        else:
+            self.starts.insert(i + 1, n)
+            self.ends.insert(i + 1, n)
+
+    def __contains__(self, n):
+        i = bisect.bisect_right(self.starts, n) - 1
+        return i >= 0 and n <= self.ends[i]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for low, high in zip(self.starts, self.ends):
+            yield from range(low, high + 1)
+
+    def __eq__(self, other):
+        if not isinstance(other, RangeSet):
+            return NotImplemented
+        return self.starts == other.starts and self.ends == other.ends
+
+    def __repr__(self):
+        return "RangeSet(%s)" % ",".join(
+            "%d" % low if low == high else "%d-%d" % (low, high)
+            for low, high in self.ranges())
+
+    def ranges(self):
+        """r.ranges() -> ITERATOR
+
+        Yields (LOW, HIGH) for each run of consecutive numbers.  Note
+        that HIGH is an _inclusive_ bound.
+
+        """
+        return zip(self.starts, self.ends)
+
+    def numbers(self):
+        """r.numbers() -> ARRAY
+
+        Returns the members as an array.array('q').
+
+        """
+        return array.array('q', iter(self))
+
+    def subset(self, low, high):
+        """r.subset(LOW, HIGH) -> RANGESET
+
+        Returns the members between LOW and HIGH.
+
+        Note that LOW and HIGH are _inclusive_ bounds, unlike the
+        usual Python idiom.
+
+        """
+        result = RangeSet()
+        i = max(bisect.bisect_right(self.starts, low) - 1, 0)
+        while i < len(self.starts) and self.starts[i] <= high:
+            start = max(self.starts[i], low)
+            end = min(self.ends[i], high)
+            if start <= end:
+                result.starts.append(start)
+                result.ends.append(end)
+                result.count += end - start + 1
+            i += 1
+        return result
+
+    def difference(self, other):
+        """r.difference(OTHER) -> RANGESET
+
+        Returns the members of r that are not in OTHER, which must
+        also be a RangeSet.
+
+        """
+        result = RangeSet()
+        j = 0
+        for start, end in self.ranges():
+            while j < len(other.ends) and other.ends[j] < start:
+                j += 1
+            k = j
+            while start <= end:
+                if k >= len(other.starts) or other.starts[k] > end:
+                    result.starts.append(start)
+                    result.ends.append(end)
+                    result.count += end - start + 1
+                    break
+                if other.starts[k] > start:
+                    result.starts.append(start)
+                    result.ends.append(other.starts[k] - 1)
+                    result.count += other.starts[k] - start
+                start = other.ends[k] + 1
+                k += 1
+        return result
+
+    __sub__ = difference
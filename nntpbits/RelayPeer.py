@@ -0,0 +1,302 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import collections
+import logging
+import random
+import socket
+import threading
+import time
+
+
+class RelayPeer(object):
+    """Outgoing feed from a relay to one downstream peer
+
+    Construction:
+    nntpbits.RelayPeer(ADDRESS[, name=NAME][, queue_size=COUNT]
+                       [, queue_bytes=BYTES][, window=COUNT]
+                       [, backoff=SECONDS][, max_backoff=SECONDS]
+                       [, ...]) -> peer
+
+    Articles passed to p.offer() are queued in memory and sent to the
+    peer at ADDRESS by a thread of its own, started with p.start(),
+    over its own nntpbits.ClientConnection.  Any further keyword
+    arguments are passed to the ClientConnection.
+
+    The queue holds at most COUNT articles (default 1024) and, if
+    BYTES is not None, at most BYTES bytes of them.  When it is full
+    p.offer() discards the article rather than waiting, so a slow
+    peer never holds up the relay or the other peers.  The peer's
+    backpressure is the queue itself: up to WINDOW TAKETHIS commands
+    (default 16) are sent before waiting for their responses, so at
+    most that many articles are in flight.  Peers that do not
+    support streaming are fed with IHAVE, one article at a time.
+
+    If the connection fails, or the peer answers 400 or (to IHAVE)
+    436, the unacknowledged articles are put back at the front of the
+    queue and the thread reconnects after a randomized exponential
+    backoff between BACKOFF (default 0.5) and MAX_BACKOFF (default
+    30) seconds.
+
+    Counters are kept in the offered, dropped, accepted, rejected,
+    requeued, failures, connects and bytes attributes.  p.lag is an
+    nntpbits.LatencyAggregator recording, for each article, the time
+    from being queued to the peer's response; p.report() summarizes
+    everything.
+
+    """
+
+    def __init__(self, address, name=None, queue_size=1024,
+                 queue_bytes=None, window=16, backoff=0.5, max_backoff=30,
+                 **kwargs):
+        self.address = address
+        self.name = name if name is not None else "%s:%s" % address[:2]
+        self.queue_size = queue_size
+        self.queue_bytes = queue_bytes
+        self.window = window
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.peak = 0
+        self.offered = 0
+        self.dropped = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.requeued = 0
+        self.failures = 0
+        self.connects = 0
+        self.bytes = 0
+        self.lag = nntpbits.LatencyAggregator()
+        self.started = None
+        self.conn = None
+        self.streaming = None
+        self.log = logging.getLogger(__name__)
+
+    def offer(self, ident, data):
+        """p.offer(IDENT, DATA) -> BOOL
+
+        Queue article IDENT, whose wire format (see
+        nntpbits.ArticleStore) is the bytes object DATA.  Returns
+        False if the queue is full, in which case the article is not
+        sent to this peer.  Never blocks.
+
+        """
+        with self.lock:
+            self.offered += 1
+            if (len(self.queue) >= self.queue_size
+                or (self.queue_bytes is not None
+                    and self.queued_bytes + len(data) > self.queue_bytes)):
+                self.dropped += 1
+                return False
+            self.queue.append((ident, data, time.monotonic()))
+            self.queued_bytes += len(data)
+            self.peak = max(self.peak, len(self.queue))
+            self.ready.notify()
+        return True
+
+    def start(self, daemon=True):
+        """p.start([daemon=DAEMON])
+
+        Start the thread that feeds the peer.  It stops when
+        nntpbits.stop() is called.
+
+        """
+        self.started = time.monotonic()
+        t = threading.Thread(target=self._run, daemon=daemon)
+        nntpbits.start_thread(t)
+
+    def _run(self):
+        """p._run()
+
+        Feed the peer until told to stop.
+
+        """
+        delay = self.backoff
+        try:
+            while True:
+                nntpbits._maybe_stop()
+                batch = self._take()
+                if len(batch) == 0:
+                    continue
+                try:
+                    if self.conn is None:
+                        self._connect()
+                    self._send(batch)
+                    delay = self.backoff
+                except nntpbits._Stop:
+                    raise
+                except Exception as e:
+                    self.log.info("%s: feed failed: %s" % (self.name, e))
+                    self.failures += 1
+                    self._requeue(batch)
+                    self._disconnect()
+                    self._pause(random.uniform(0, delay))
+                    delay = min(delay * 2, self.max_backoff)
+        except nntpbits._Stop:
+            self.log.debug("%s: feed stopped" % self.name)
+        finally:
+            self._disconnect()
+            nntpbits.finished_thread()
+
+    def _take(self):
+        """p._take() -> DEQUE
+
+        Wait (for up to a second) for queued articles, and remove and
+        return up to p.window of them.
+
+        """
+        with self.lock:
+            if len(self.queue) == 0:
+                self.ready.wait(1.0)
+            batch = collections.deque()
+            while len(self.queue) > 0 and len(batch) < self.window:
+                item = self.queue.popleft()
+                self.queued_bytes -= len(item[1])
+                batch.append(item)
+            return batch
+
+    def _requeue(self, batch):
+        """p._requeue(BATCH)
+
+        Put unacknowledged articles back at the front of the queue,
+        in their original order.  The queue limits are not applied.
+
+        """
+        with self.lock:
+            self.requeued += len(batch)
+            while len(batch) > 0:
+                item = batch.pop()
+                self.queue.appendleft(item)
+                self.queued_bytes += len(item[1])
+
+    def _pause(self, seconds):
+        """p._pause(SECONDS)
+
+        Sleep, but stop promptly if told to.
+
+        """
+        limit = time.monotonic() + seconds
+        while True:
+            nntpbits._maybe_stop()
+            remaining = limit - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 1.0))
+
+    def _connect(self):
+        """p._connect()
+
+        Connect to the peer and find out whether it supports
+        streaming.
+
+        """
+        self.conn = nntpbits.ClientConnection(self.address, **self.kwargs)
+        # Batches end in a partial segment, which Nagle would delay
+        self.conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connects += 1
+        self.streaming = self.conn.streaming()
+        self.log.info("%s: connected (%s)"
+                      % (self.name,
+                         "streaming" if self.streaming else "IHAVE"))
+
+    def _disconnect(self):
+        """p._disconnect()
+
+        Close the connection to the peer, if there is one.
+
+        """
+        if self.conn is not None:
+            self.conn.disconnect()
+            self.conn = None
+
+    def _send(self, batch):
+        """p._send(BATCH)
+
+        Send the articles in BATCH to the peer, removing each one as
+        the peer responds to it.  Raises an exception if the
+        connection fails or the peer asks to try again later.
+
+        """
+        conn = self.conn
+        if not self.streaming:
+            while len(batch) > 0:
+                (ident, data, queued) = batch[0]
+                code = conn.ihave(nntpbits.ArticleStore.decode(data), ident)
+                if code == 436:
+                    raise Exception("IHAVE %s: deferred" % str(ident, 'ascii'))
+                self._sent(b'IHAVE', batch.popleft(), code, 235)
+            return
+        last = len(batch) - 1
+        for (index, (ident, data, queued)) in enumerate(batch):
+            conn.send_line(b'TAKETHIS ' + ident, flush=False)
+            conn.send_data(data, flush=(index == last))
+        while len(batch) > 0:
+            (code, argument) = conn.wait()
+            if code == 400:
+                raise Exception("TAKETHIS: %d %s"
+                                % (code, str(argument, 'ascii', 'replace')))
+            self._sent(b'TAKETHIS', batch.popleft(), code, 239)
+
+    def _sent(self, verb, item, code, success):
+        """p._sent(VERB, ITEM, CODE, SUCCESS)
+
+        Record the peer's response CODE to the article in ITEM.
+
+        """
+        (ident, data, queued) = item
+        observation = nntpbits.Observation(self.conn.key, verb, queued)
+        observation.code = code
+        observation.sent = len(data)
+        observation.first_byte = observation.last_byte = time.monotonic()
+        self.lag(observation)
+        with self.lock:
+            if code == success:
+                self.accepted += 1
+            else:
+                self.rejected += 1
+            self.bytes += len(data)
+
+    def report(self):
+        """p.report() -> LIST
+
+        Returns a summary, as a list of strings: one line of counters
+        and throughput, followed by the lag of acknowledged articles
+        as for nntpbits.LatencyAggregator.report().  'age' is the time
+        the oldest queued article has been waiting.
+
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.started, 1e-6) if self.started else None
+        with self.lock:
+            age = now - self.queue[0][2] if len(self.queue) > 0 else 0
+            line = ("%s queued=%d peak=%d age=%.2fs offered=%d dropped=%d"
+                    " accepted=%d rejected=%d requeued=%d failures=%d"
+                    " connects=%d bytes=%d"
+                    % (self.name, len(self.queue), self.peak, age,
+                       self.offered, self.dropped, self.accepted,
+                       self.rejected, self.requeued, self.failures,
+                       self.connects, self.bytes))
+            if elapsed is not None:
+                line += (" rate=%.1f/s %.1fKB/s"
+                         % ((self.accepted + self.rejected) / elapsed,
+                            self.bytes / elapsed / 1024))
+        return [line] + ["%s %s" % (self.name, lag)
+                         for lag in self.lag.report()]
@@ -0,0 +1,104 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+from nntpbits.NewsServer import _header_length
+
+
+class RelayServer(nntpbits.NewsServer):
+    """nntpbits.RelayServer(PEERS) -> SERVER
+
+    News server that accepts articles by IHAVE and TAKETHIS and
+    forwards each one to every downstream peer in PEERS, a list of
+    nntpbits.RelayPeer objects.
+
+    Optional arguments:
+    conncls -- connection class (default nntpbits.ServerConnection)
+    pathhost -- if not None, prepended to the Path header of
+        forwarded articles
+    history -- an nntpbits.History (default in-memory)
+    max_connections, max_commands, spill_threshold, spill_directory,
+        max_article_size -- as for nntpbits.NewsServer
+
+    Message IDs are recorded in HISTORY, so each article is accepted
+    and forwarded only once.  Articles are converted to wire format
+    once and the same bytes object is queued for every peer.  Queuing
+    never blocks: if a peer's queue is full then that peer misses the
+    article (see nntpbits.RelayPeer).  Nothing is stored locally.
+
+    Call s.start_peers() to start feeding the peers, and s.report()
+    for per-peer queue, throughput and lag statistics.  The peers'
+    threads run in the calling process, so use s.listen_address() or
+    s.listen_selector() rather than s.listen_workers().
+
+    """
+
+    def __init__(self, peers, conncls=nntpbits.ServerConnection,
+                 pathhost=None, history=None, **kwargs):
+        nntpbits.NewsServer.__init__(self, conncls=conncls, **kwargs)
+        self.peers = list(peers)
+        self.pathhost = nntpbits._normalize(pathhost)
+        if history is None:
+            history = nntpbits.History(size=1 << 16)
+        self.history = history
+
+    def start_peers(self, daemon=True):
+        """s.start_peers([daemon=DAEMON])
+
+        Start feeding the downstream peers.
+
+        """
+        for peer in self.peers:
+            peer.start(daemon=daemon)
+
+    def report(self):
+        """s.report() -> LIST
+
+        Returns the reports from all the peers, as a list of strings.
+
+        """
+        lines = []
+        for peer in self.peers:
+            lines.extend(peer.report())
+        return lines
+
+    def ihave_check(self, ident):
+        if ident in self.history:
+            return (435, "Duplicate")
+        return (335, "OK")
+
+    def ihave(self, ident, article):
+        if isinstance(article, nntpbits.SpooledArticle):
+            header = article.header()
+            body = article.read(article.body_offset())
+        else:
+            length = _header_length(article)
+            header = article[:length]
+            body = nntpbits.ArticleStore.encode(article[length + 1:])
+        if not self.history.add(ident):
+            return (437, "Duplicate")
+        if self.pathhost is not None:
+            header = list(header)
+            for index, line in enumerate(header):
+                if line.lower().startswith(b'path:'):
+                    header[index] = (b'Path: %s!%s'
+                                     % (self.pathhost,
+                                        line[5:].lstrip(b' \t')))
+                    break
+        data = nntpbits.ArticleStore.encode(header + [b'']) + body
+        for peer in self.peers:
+            peer.offer(ident, data)
+        return (235, "OK")
@@ -15,20 +15,32 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import nntpbits
+import calendar
 import logging
+import os
 import re
 import socket
 import threading
+import time
 
 # Regexp matching a command
 _command_re = re.compile(b"^(\S+)\s*(.*)$")
 # Regexp matching a message ID
 _message_id_re = re.compile(b'^<[^@]+@[^@]+>$')
+# Regexp matching an article number (3977 9.8)
+_number_re = re.compile(b'^\\d{1,16}$')
+# Regexp matching an article range (3977 8.3.1)
+_range_re = re.compile(b'^(\\d{1,16})(-(\\d{1,16})?)?$')
+# Regexp matching a NEWNEWS/NEWGROUPS date and time (3977 7.3.1)
+_newstuff_re = re.compile(b'^(\\d{6}|\\d{8}) (\\d{6})( GMT)?$')
+# Upper bound for open-ended article ranges
+_max_number = 1 << 63
 
 # Text for standard response codes
 _responses = {
     100: 'Help text follows',
     101: 'Capabilities follow',
+    111: 'Server date and time',
     200: 'Posting allowed',
     201: 'Posting prohibited',
     203: 'Streaming allowed',
@@ -71,6 +83,43 @@ _responses = {
 }
 
 
+def _nodelay(s):
+    """_nodelay(SOCKET)
+
+    Disable Nagle's algorithm on SOCKET, if it is a TCP socket.
+    Otherwise the last of a batch of pipelined responses can wait for
+    a delayed acknowledgement from the peer.
+
+    """
+    try:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+
+class _OutputQueue(object):
+    """Output file object for event-driven server connections
+
+    Writes accumulate in a buffer.  Flushing sends as much as the
+    socket will take without blocking; the event loop sends the rest
+    as the socket becomes writable.
+
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.data = bytearray()
+
+    def write(self, bs):
+        self.data += bs
+
+    def flush(self):
+        self.conn.event_write()
+
+    def close(self):
+        pass
+
+
 class ServerConnection(nntpbits.Connection):
     """NNTP server endpoint
 
@@ -89,10 +138,17 @@ class ServerConnection(nntpbits.Connection):
     independent thread for each connection it receives, perhaps using
     the ServerConnection.listen() method.
 
+    Alternatively, call start_events() with a socket and have an event
+    loop call event_read() and event_write() when it is ready.  This
+    is how NewsServer.listen_selector() serves many connections from
+    one thread.  Command implementations that need to read an article
+    from the peer must use receive_article() to work in this mode.
+
     By default no useful commands are enabled.  Use a selection of the
     following methods to enable them:
     enable_ihave() -- enable basic peering commands
     enable_streaming() -- enable RFC4644 fast peering commands
+    enable_reader() -- enable reader commands
 
     """
 
@@ -105,6 +161,8 @@ class ServerConnection(nntpbits.Connection):
             b'MODE': self.mode,
             b'QUIT': self.quit,
         }
+        if server.metrics is not None or server.slowlog is not None:
+            self.commands[b'LIST'] = self.list
         self.capabilities = [b"VERSION 2",
                              b"IMPLEMENTATION inntest"]
         self.log = logging.getLogger(__name__)
@@ -134,6 +192,43 @@ class ServerConnection(nntpbits.Connection):
             self.commands.pop(b'CHECK')
             self.commands.pop(b'TAKETHIS')
 
+    # Reader commands and their implementations
+    _reader_commands = {
+        b'ARTICLE': 'article',
+        b'BODY': 'body',
+        b'DATE': 'date',
+        b'GROUP': 'group',
+        b'HDR': 'hdr',
+        b'HEAD': 'head',
+        b'HELP': 'help',
+        b'LAST': 'last',
+        b'LIST': 'list',
+        b'LISTGROUP': 'listgroup',
+        b'NEWGROUPS': 'newgroups',
+        b'NEWNEWS': 'newnews',
+        b'NEXT': 'next',
+        b'OVER': 'over',
+        b'POST': 'post',
+        b'STAT': 'stat',
+        b'XOVER': 'over',
+    }
+
+    def enable_reader(self, state=True):
+        """s.enable_reader([STATE])
+
+        Enables (or disables if STATE=False) the reader commands:
+        GROUP, LISTGROUP, ARTICLE, HEAD, BODY, STAT, NEXT, LAST,
+        OVER, HDR, LIST, NEWGROUPS, NEWNEWS, DATE, HELP and POST.
+        These are implemented using the reader methods of the news
+        server.
+
+        """
+        for command, method in ServerConnection._reader_commands.items():
+            if state == True:
+                self.commands[command] = getattr(self, method)
+            else:
+                self.commands.pop(command)
+
     def enable(self, feature, state=True):
         """s.enable(FEATURE[, STATE])
 
@@ -142,6 +237,7 @@ class ServerConnection(nntpbits.Connection):
         ihave -- just the IHAVE command
         streaming -- RFC4644 streaming commands
         peering -- all peering commands
+        reader -- reader commands
         """
         if isinstance(feature, list):
             for item in feature:
@@ -154,6 +250,8 @@ class ServerConnection(nntpbits.Connection):
             elif feature.lower() == 'peering':
                 self.enable_ihave(state)
                 self.enable_streaming(state)
+            elif feature.lower() == 'reader':
+                self.enable_reader(state)
             else:
                 raise Exception("unrecognized feature '%s'" % feature)
 
@@ -164,6 +262,32 @@ class ServerConnection(nntpbits.Connection):
 
         """
         self.finished = False
+        self.events = False
+        self._continuation = None
+        self._receiving = None
+        self._pending = b''
+        self._skip = 0
+        self._oversized = False
+        self._observation = None
+        self._observed = (0, 0)
+        self._arguments = None
+        self._timings = None
+        self._receive_start = 0
+        self._scanned = 0
+        self._deferred = False
+        self._flushed = 0
+        self.current_group = None
+        self.current_number = None
+
+    def socket(self, s):
+        """s.socket(SOCKET)
+
+        As nntpbits.Connection.socket().  Nagle's algorithm is
+        disabled, since responses are coalesced explicitly.
+
+        """
+        _nodelay(s)
+        nntpbits.Connection.socket(self, s)
 
     def connected(self):
         """s.connected()
@@ -188,6 +312,388 @@ class ServerConnection(nntpbits.Connection):
         finally:
             self.disconnect()
 
+    # -------------------------------------------------------------------------
+    # Response coalescing
+
+    # Flush deferred responses once this much output is pending
+    _coalesce_limit = 65536
+
+    def send_line(self, line, flush=True):
+        """s.send_line(LINE[, FLUSH])
+
+        As nntpbits.Connection.send_line(), except that if further
+        input is already buffered then flushing is deferred until it
+        has been consumed, or until s._coalesce_limit bytes are
+        pending.  So responses to pipelined commands are sent
+        together rather than one write each.
+
+        """
+        nntpbits.Connection.send_line(self, line, flush=False)
+        if flush:
+            if (self.buffer_index < len(self.buffer)
+                    and self.bytes_sent - self._flushed
+                    < ServerConnection._coalesce_limit):
+                self._deferred = True
+            else:
+                self.flush()
+
+    def flush(self):
+        """s.flush()
+
+        Flush any pending output.
+
+        """
+        self._deferred = False
+        self._flushed = self.bytes_sent
+        if self._timings is None:
+            return self.w.flush()
+        start = time.monotonic()
+        self.w.flush()
+        self._timings[2] += time.monotonic() - start
+
+    def _fill(self):
+        # Never wait for input with responses still deferred
+        if self._deferred and self.buffer_index >= len(self.buffer):
+            self.flush()
+        return nntpbits.Connection._fill(self)
+
+    # -------------------------------------------------------------------------
+    # Wire-format output
+
+    def send_file(self, file, offset, count):
+        """s.send_file(FILE, OFFSET, COUNT)
+
+        As s.send_data(), but sends COUNT bytes of FILE starting at
+        OFFSET.  If the connection is using a blocking socket then
+        socket.sendfile() is used, so the data is not copied through
+        Python; otherwise it is read and sent with s.send_data().
+
+        """
+        if self.sock is None or self.events:
+            return self.send_data(os.pread(file.fileno(), count, offset))
+        self.flush()
+        start = time.monotonic()
+        self.sock.sendfile(file, offset, count)
+        if self._timings is not None:
+            self._timings[2] += time.monotonic() - start
+        self.bytes_sent += count
+        self._flushed = self.bytes_sent
+        self.send_line(b'.')
+
+    # -------------------------------------------------------------------------
+    # Event-driven IO
+
+    # Stop reading input while this much output is queued
+    _output_limit = 1 << 20
+
+    def start_events(self, s):
+        """s.start_events(SOCKET)
+
+        Use the connected socket SOCKET for non-blocking IO driven by
+        an event loop.  The greeting is queued immediately; after
+        that the loop must call s.event_read() when SOCKET is readable
+        and s.event_write() when it is writable.
+
+        Ownership of the socket passes to the connection.
+
+        """
+        s.setblocking(False)
+        _nodelay(s)
+        self.events = True
+        self.sock = s
+        self.r = None
+        self.w = _OutputQueue(self)
+        self.buffer = bytearray()
+        self.buffer_index = 0
+        self.eof = False
+        self.respond(200)
+
+    def wants_read(self):
+        """s.wants_read() -> BOOL
+
+        Returns True if the event loop should wait for input.
+
+        """
+        return (not self.finished and not self.eof
+                and len(self.w.data) < ServerConnection._output_limit)
+
+    def wants_write(self):
+        """s.wants_write() -> BOOL
+
+        Returns True if the event loop should wait for the socket to
+        become writable.
+
+        """
+        return self.w is not None and len(self.w.data) > 0
+
+    def done(self):
+        """s.done() -> BOOL
+
+        Returns True when an event-driven connection has finished and
+        all output has been sent.  The event loop should then call
+        s.disconnect().
+
+        """
+        return (self.finished or self.eof) and not self.wants_write()
+
+    def event_read(self):
+        """s.event_read()
+
+        Read whatever input is available and process any complete
+        commands.
+
+        """
+        try:
+            while True:
+                bs = self.sock.recv(65536)
+                if len(bs) == 0:
+                    self.eof = True
+                    break
+                self.buffer += bs
+                if len(bs) < 65536:
+                    break
+        except BlockingIOError:
+            pass
+        except ConnectionResetError:
+            self.eof = True
+        self.process_input()
+
+    def event_write(self):
+        """s.event_write()
+
+        Send as much queued output as possible without blocking.
+
+        """
+        data = self.w.data
+        try:
+            while len(data) > 0:
+                n = self.sock.send(data)
+                del data[:n]
+        except BlockingIOError:
+            pass
+        except (BrokenPipeError, ConnectionResetError):
+            data.clear()
+            self.finished = True
+
+    def process_input(self):
+        """s.process_input()
+
+        Process complete commands (and articles) in the input buffer.
+        The event loop should call this after event_write() has
+        drained the output queue, in case input processing was
+        suspended because too much output was queued.
+
+        """
+        while not self.finished and len(self.w.data) < self._output_limit:
+            if self._continuation is not None:
+                if self._receiving is not None:
+                    if not self._spool_input():
+                        break
+                    article = self._finish_spool()
+                elif self._article_buffered():
+                    article = self.receive_lines()
+                else:
+                    break
+                self._received()
+                continuation = self._continuation
+                self._continuation = None
+                self._deliver(continuation, article)
+                if self._continuation is None:
+                    self._end_observation()
+            else:
+                if self.buffer.find(self.eol, self.buffer_index) < 0:
+                    break
+                self.command(self.receive_line())
+        if self._deferred:
+            self.flush()
+        # Discard consumed input
+        if self.buffer_index >= 65536 or self.buffer_index == len(self.buffer):
+            del self.buffer[:self.buffer_index]
+            self._scanned = max(self._scanned - self.buffer_index, 0)
+            self.buffer_index = 0
+
+    def _article_buffered(self):
+        """s._article_buffered() -> BOOL
+
+        Returns True if a complete dot-terminated article is in the
+        input buffer.
+
+        """
+        i = self.buffer_index
+        if self.buffer[i:i+3] == b'.\r\n':
+            return True
+        start = max(i, self._scanned - 4)
+        if self.buffer.find(b'\r\n.\r\n', start) >= 0:
+            return True
+        self._scanned = len(self.buffer)
+        return False
+
+    def receive_article(self, callback, spill=False):
+        """s.receive_article(CALLBACK[, SPILL])
+
+        Receive a dot-stuffed article from the peer and then call
+        CALLBACK(ARTICLE) with it as a list of bytes objects (or None
+        at EOF).
+
+        If SPILL is True and the server's spill_threshold is not None
+        then ARTICLE is an nntpbits.SpooledArticle instead, which is
+        written to a temporary file if it is large.  The input is
+        copied to it a buffer at a time, without splitting it into
+        lines.  It is discarded when CALLBACK returns.
+
+        If SPILL is True and the server's max_article_size is not
+        None then the input is read in the same way, but once the
+        article exceeds the limit the remainder is discarded, and
+        s._oversized is set when CALLBACK is called.
+
+        For threaded connections this happens immediately.  For
+        event-driven connections CALLBACK is called once the whole
+        article has arrived; no further commands are processed until
+        then.
+
+        """
+        if self._timings is not None:
+            self._receive_start = time.monotonic()
+        if spill and (self.server.spill_threshold is not None
+                      or self.server.max_article_size is not None):
+            self._start_spool()
+        if self.events:
+            self._continuation = callback
+            self._scanned = self.buffer_index
+        elif self._receiving is not None:
+            complete = self._spool_input()
+            while not complete and self._wait_input():
+                complete = self._spool_input()
+            if not complete:
+                self._receiving.close()
+                self._receiving = None
+                return callback(None)
+            article = self._finish_spool()
+            self._received()
+            self._deliver(callback, article)
+        else:
+            article = self.receive_lines()
+            self._received()
+            callback(article)
+
+    def _received(self):
+        """s._received()
+
+        Add the time since s.receive_article() was called to the
+        current command's receive time, if it is being timed.
+
+        """
+        if self._timings is not None:
+            self._timings[0] += time.monotonic() - self._receive_start
+
+    def _deliver(self, callback, article):
+        """s._deliver(CALLBACK, ARTICLE)
+
+        Call CALLBACK(ARTICLE), discarding ARTICLE afterwards if it is
+        an nntpbits.SpooledArticle.
+
+        """
+        try:
+            callback(article)
+        finally:
+            if isinstance(article, nntpbits.SpooledArticle):
+                article.close()
+
+    def _start_spool(self):
+        """s._start_spool()
+
+        Start receiving an article into a new nntpbits.SpooledArticle,
+        s._receiving.
+
+        """
+        self._receiving = nntpbits.SpooledArticle(
+            threshold=self.server.spill_threshold,
+            directory=self.server.spill_directory)
+        # Treat the start of the article as the end of a line, so
+        # that an empty article is recognized; the CRLF is not stored
+        self._pending = b'\r\n'
+        self._skip = 2
+        self._oversized = False
+
+    def _finish_spool(self):
+        """s._finish_spool() -> ARTICLE
+
+        Returns the article that has been received, converted to a
+        list of bytes objects if the server does not want an
+        nntpbits.SpooledArticle.
+
+        """
+        article = self._receiving
+        self._receiving = None
+        if self.server.spill_threshold is None:
+            lines = article.lines()
+            article.close()
+            return lines
+        return article
+
+    def _spool_write(self, data, start=0, end=None):
+        """s._spool_write(DATA[, START][, END])
+
+        Append DATA[START:END] to the article being received, skipping
+        any bytes that were not part of the input.  Once the article
+        exceeds the server's max_article_size, it is emptied and
+        nothing more is stored.
+
+        """
+        if end is None:
+            end = len(data)
+        if self._skip > 0:
+            skip = min(self._skip, end - start)
+            start += skip
+            self._skip -= skip
+        if start >= end or self._oversized:
+            return
+        limit = self.server.max_article_size
+        if limit is not None and len(self._receiving) + end - start > limit:
+            self._oversized = True
+            self._receiving.close()
+            return
+        self._receiving.write(data[start:end])
+
+    def _spool_input(self):
+        """s._spool_input() -> BOOL
+
+        Move buffered input to the article being received, stopping
+        after the terminating '.' line.  Returns True if the whole
+        article has been received.
+
+        The last few bytes are held back in s._pending, so that a
+        terminator split between two reads is recognized.
+
+        """
+        data = self.buffer
+        start = self.buffer_index
+        pending = self._pending
+        # A terminator starting in the pending bytes
+        joined = pending + bytes(data[start:start + 4])
+        index = joined.find(b'\r\n.\r\n')
+        if index >= 0:
+            self._spool_write(joined[:index + 2])
+            end = start + index + 5 - len(pending)
+        else:
+            index = data.find(b'\r\n.\r\n', start)
+            if index >= 0:
+                self._spool_write(pending)
+                self._spool_write(data, start, index + 2)
+                end = index + 5
+            else:
+                end = len(data)
+                if end - start >= 4:
+                    self._spool_write(pending)
+                    self._spool_write(data, start, end - 4)
+                    self._pending = bytes(data[end - 4:end])
+                else:
+                    self._spool_write(joined[:-4])
+                    self._pending = joined[-4:]
+        self.bytes_received += end - start
+        self.buffer_index = end
+        return index >= 0
+
     def register(self, command, callback):
         """s.register(COMMAND, CALLBACK)
 
@@ -222,6 +728,12 @@ class ServerConnection(nntpbits.Connection):
             method = getattr(self.log, log_type)
             method("%x: %s %s"
                    % (threading.get_ident(), description, detail))
+        if self.server.stats is not None:
+            self.server.stats.response(response)
+        if self._observation is not None:
+            self._observation.code = response
+            if self._observation.first_byte is None:
+                self._observation.first_byte = time.monotonic()
         self.send_line("%d %s" % (response, description), flush=flush)
 
     def command(self, cmd):
@@ -242,7 +754,64 @@ class ServerConnection(nntpbits.Connection):
         arguments = m.group(2)
         if command not in self.commands:
             return self.respond(500, detail=command)
-        self.commands[command](arguments)
+        if self.server.metrics is None and self.server.slowlog is None:
+            return self.commands[command](arguments)
+        self._begin_observation(command, cmd, arguments)
+        try:
+            self.commands[command](arguments)
+        finally:
+            if self._continuation is None:
+                self._end_observation()
+
+    def _begin_observation(self, verb, cmd, arguments):
+        """s._begin_observation(VERB, CMD, ARGUMENTS)
+
+        Start recording an nntpbits.Observation for command CMD in
+        the server's metrics, and timing it for the server's slow
+        log.
+
+        """
+        self._observation = nntpbits.Observation(self.key, verb,
+                                                 time.monotonic())
+        # The command line has already been counted
+        self._observed = (self.bytes_sent,
+                          self.bytes_received - len(cmd) - len(self.eol))
+        if self.server.metrics is not None:
+            self.server.metrics.begin(self._observation)
+        if self.server.slowlog is not None:
+            self._arguments = arguments
+            # Receive, hook and respond times
+            self._timings = [0.0, 0.0, 0.0]
+
+    def _end_observation(self):
+        """s._end_observation()
+
+        Complete the current observation, if any, and pass it to the
+        server's metrics.  If the command took longer than the slow
+        log threshold, it is added to the slow log too.
+
+        """
+        observation = self._observation
+        if observation is None:
+            return
+        self._observation = None
+        observation.last_byte = time.monotonic()
+        observation.sent = self.bytes_sent - self._observed[0]
+        observation.received = self.bytes_received - self._observed[1]
+        if self.server.metrics is not None:
+            self.server.metrics(observation)
+        timings = self._timings
+        if timings is None:
+            return
+        self._timings = None
+        duration = observation.latency()
+        slowlog = self.server.slowlog
+        if duration >= slowlog.threshold:
+            ident = self._arguments
+            if not _message_id_re.match(ident):
+                ident = None
+            slowlog.add(self.key, observation.verb, ident, observation.code,
+                        duration, timings[0], timings[1], timings[2])
 
     def ihave(self, arguments):
         """s.ihave(ARGUMENTS)
@@ -252,12 +821,58 @@ class ServerConnection(nntpbits.Connection):
         """
         if not _message_id_re.match(arguments):
             return self.respond(501)
-        (rc, argument) = self.server.ihave_check(arguments)
+        result = self._admitted(self.server.ihave_check, arguments)
+        if result is None:
+            return self.respond(436, detail=arguments)
+        (rc, argument) = result
         self.respond(rc, argument)
         if rc == 335:
-            article = self.receive_lines()
-            (rc, argument) = self.server.ihave(arguments, article)
-            self.respond(rc, argument)
+            self.receive_article(
+                lambda article: self._ihave_article(arguments, article),
+                spill=True)
+
+    def _ihave_article(self, arguments, article):
+        """s._ihave_article(ARGUMENTS, ARTICLE)
+
+        Second half of the NNTP IHAVE command.
+
+        """
+        if self._oversized:
+            return self.respond(437, "Article too large")
+        (rc, argument) = self._admitted(self.server.ihave, arguments,
+                                        article, force=True)
+        self.respond(rc, argument)
+
+    def _admitted(self, hook, *args, force=False):
+        """s._admitted(HOOK, ARGS...[, force=FORCE]) -> RESULT | None
+
+        Call HOOK(ARGS...) as a command counted against the server's
+        command limit.  Returns None if the command is not admitted.
+        If FORCE is True then the command is always admitted; this is
+        used once the peer has already sent an article.
+
+        """
+        if not self.server.admit('commands', force):
+            return None
+        try:
+            return self._call_hook(hook, *args)
+        finally:
+            self.server.release('commands')
+
+    def _call_hook(self, hook, *args):
+        """s._call_hook(HOOK, ARGS...) -> RESULT
+
+        Call the server hook HOOK(ARGS...), adding the time it takes
+        to the current command's hook time if it is being timed.
+
+        """
+        if self._timings is None:
+            return hook(*args)
+        start = time.monotonic()
+        try:
+            return hook(*args)
+        finally:
+            self._timings[1] += time.monotonic() - start
 
     def check(self, arguments):
         """s.check(ARGUMENTS)
@@ -267,13 +882,16 @@ class ServerConnection(nntpbits.Connection):
         """
         if not _message_id_re.match(arguments):
             return self.respond(501)
-        (rc, argument) = self.server.ihave_check(arguments)
+        result = self._admitted(self.server.ihave_check, arguments)
+        if result is None:
+            return self.respond(431, arguments)
+        (rc, argument) = result
         if rc == 335:
             return self.respond(238, arguments)
         elif rc == 435:
-            return self.respond(431, arguments)
-        elif rc == 436:
             return self.respond(438, arguments)
+        elif rc == 436:
+            return self.respond(431, arguments)
         return self.respond(rc, argument)
 
     def takethis(self, arguments):
@@ -284,10 +902,24 @@ class ServerConnection(nntpbits.Connection):
         """
         if not _message_id_re.match(arguments):
             return self.respond(501)
-        article = self.receive_lines()
-        (rc, argument) = self.server.ihave_check(arguments)
+        self.receive_article(
+            lambda article: self._takethis_article(arguments, article),
+            spill=True)
+
+    def _takethis_article(self, arguments, article):
+        """s._takethis_article(ARGUMENTS, ARTICLE)
+
+        Completion of the NNTP TAKETHIS command once the article has
+        been received.
+
+        """
+        if self._oversized:
+            return self.respond(439, arguments)
+        (rc, argument) = self._admitted(self.server.ihave_check, arguments,
+                                        force=True)
         if rc == 335:
-            (rc, argument) = self.server.ihave(arguments, article)
+            (rc, argument) = self._admitted(self.server.ihave, arguments,
+                                            article, force=True)
             if rc == 235:
                 return self.respond(239, arguments)
             if rc == 437:
@@ -311,6 +943,8 @@ class ServerConnection(nntpbits.Connection):
         mode = m.group(1).upper()
         if mode == b'STREAM' and b'TAKETHIS' in self.commands:
             return self.respond(203)
+        if mode == b'READER' and b'GROUP' in self.commands:
+            return self.respond(200)
         return self.respond(501, 'Unrecognized/unsupported mode')
 
     def capabilities(self, arguments):
@@ -320,12 +954,24 @@ class ServerConnection(nntpbits.Connection):
 
         """
         capabilities = list(self.capabilities)
-        for cmd in [b'IHAVE', b'POST', b'NEWNEWS', b'OVER', b'HDR', b'LIST']:
+        if b'GROUP' in self.commands:
+            capabilities.append(b'READER')
+        for cmd in [b'IHAVE', b'POST', b'NEWNEWS', b'OVER', b'HDR']:
             if cmd in self.commands:
                 capabilities.append(cmd)
-        if [b'TAKETHIS'] in self.commands:
+        keywords = []
+        if b'GROUP' in self.commands:
+            keywords.append(b'ACTIVE ACTIVE.TIMES NEWSGROUPS'
+                            b' OVERVIEW.FMT HEADERS')
+        if self.server.metrics is not None:
+            keywords.append(b'STATS')
+        if self.server.slowlog is not None:
+            keywords.append(b'SLOWLOG')
+        if b'LIST' in self.commands and len(keywords) > 0:
+            capabilities.append(b' '.join([b'LIST'] + keywords))
+        if b'TAKETHIS' in self.commands:
             capabilities.append(b'STREAMING')
-        self.respond(110, flush=False)
+        self.respond(101, flush=False)
         self.send_lines(self.server.capabilities(capabilities))
 
     def quit(self, arguments):
@@ -334,5 +980,488 @@ class ServerConnection(nntpbits.Connection):
         Implementation of the NNTP QUIT command.
 
         """
+        if arguments != b'':
+            return self.respond(501)
         self.respond(205)
         self.finished = True
+
+    # -------------------------------------------------------------------------
+    # Reader commands
+
+    def _range(self, arguments):
+        """s._range(ARGUMENTS) -> (LOW, HIGH) | None
+
+        Parse an article range.  Note that HIGH is an _inclusive_
+        bound.  Returns None if ARGUMENTS is malformed.
+
+        """
+        m = _range_re.match(arguments)
+        if not m:
+            return None
+        low = int(m.group(1))
+        if m.group(2) is None:
+            return (low, low)
+        if m.group(3) is None:
+            return (low, _max_number)
+        return (low, int(m.group(3)))
+
+    def _current(self):
+        """s._current() -> NUMBER | None
+
+        Returns the current article number, responding with an error
+        and returning None if there is none.
+
+        """
+        if self.current_group is None:
+            self.respond(412)
+            return None
+        if self.current_number is None:
+            self.respond(420)
+            return None
+        return self.current_number
+
+    def _select(self, arguments):
+        """s._select(ARGUMENTS) -> (NUMBER, IDENT) | None
+
+        Identify the article for ARTICLE, HEAD, BODY or STAT, updating
+        the current article number if necessary.  If there is no
+        such article then responds with an error and returns None.
+
+        """
+        if _message_id_re.match(arguments):
+            return (0, arguments)
+        if arguments == b'':
+            number = self._current()
+            if number is None:
+                return None
+        elif _number_re.match(arguments):
+            if self.current_group is None:
+                self.respond(412)
+                return None
+            number = int(arguments)
+        else:
+            self.respond(501)
+            return None
+        ident = self.server.article_ident(self.current_group, number)
+        if ident is None:
+            self.respond(423 if arguments != b'' else 420)
+            return None
+        self.current_number = number
+        return (number, ident)
+
+    def _retrieve(self, arguments, response, part):
+        """s._retrieve(ARGUMENTS, RESPONSE, PART)
+
+        Implementation of ARTICLE, HEAD, BODY and STAT.  PART is
+        'article', 'head', 'body' or None.
+
+        """
+        selected = self._select(arguments)
+        if selected is None:
+            return
+        (number, ident) = selected
+        data = self.server.article_data(ident)
+        if data is None:
+            article = self.server.article(ident)
+            if article is None:
+                return self.respond(430 if number == 0 else 423)
+        self.respond(response, b'%d %s' % (number, ident),
+                     flush=part is None)
+        if part is None:
+            return
+        if data is not None:
+            return self._retrieve_data(ident, data, part)
+        if part != 'article':
+            split = article.index(b'') if b'' in article else len(article)
+            if part == 'head':
+                article = article[:split]
+            else:
+                article = article[split + 1:]
+        self.send_lines(article)
+
+    def _retrieve_data(self, ident, data, part):
+        """s._retrieve_data(IDENT, DATA, PART)
+
+        Send PART of article IDENT, whose wire format is DATA.  The
+        file returned by the server's article_file() method is used
+        if possible.
+
+        """
+        (start, end) = (0, len(data))
+        if part != 'article':
+            (head_end, body_start) = ServerConnection._wire_split(data)
+            if part == 'head':
+                end = head_end
+            else:
+                start = body_start
+        if self.sock is not None and not self.events:
+            location = self.server.article_file(ident)
+            if location is not None and location[2] == len(data):
+                (file, offset, length) = location
+                return self.send_file(file, offset + start, end - start)
+        self.send_data(data[start:end])
+
+    @staticmethod
+    def _wire_split(data):
+        """ServerConnection._wire_split(DATA) -> (HEAD_END, BODY_START)
+
+        Locate the blank line separating the header and body of an
+        article in wire format.  Returns the offset of the end of the
+        header (including its final CRLF) and of the start of the
+        body.  Only as much of DATA as necessary is copied.
+
+        """
+        if data[:2] == b'\r\n':
+            return (0, 2)
+        limit = 4096
+        while True:
+            index = bytes(data[:limit]).find(b'\r\n\r\n')
+            if index >= 0:
+                return (index + 2, index + 4)
+            if limit >= len(data):
+                return (len(data), len(data))
+            limit *= 4
+
+    def article(self, arguments):
+        """s.article(ARGUMENTS)
+
+        Implementation of the NNTP ARTICLE command.
+
+        """
+        self._retrieve(arguments, 220, 'article')
+
+    def head(self, arguments):
+        """s.head(ARGUMENTS)
+
+        Implementation of the NNTP HEAD command.
+
+        """
+        self._retrieve(arguments, 221, 'head')
+
+    def body(self, arguments):
+        """s.body(ARGUMENTS)
+
+        Implementation of the NNTP BODY command.
+
+        """
+        self._retrieve(arguments, 222, 'body')
+
+    def stat(self, arguments):
+        """s.stat(ARGUMENTS)
+
+        Implementation of the NNTP STAT command.
+
+        """
+        self._retrieve(arguments, 223, None)
+
+    def group(self, arguments):
+        """s.group(ARGUMENTS)
+
+        Implementation of the NNTP GROUP command.
+
+        """
+        if arguments == b'' or b' ' in arguments:
+            return self.respond(501)
+        details = self.server.group(arguments)
+        if details is None:
+            return self.respond(411)
+        (count, low, high) = details
+        self.current_group = arguments
+        self.current_number = low if count > 0 else None
+        self.respond(211, b'%d %d %d %s' % (count, low, high, arguments))
+
+    def listgroup(self, arguments):
+        """s.listgroup(ARGUMENTS)
+
+        Implementation of the NNTP LISTGROUP command.
+
+        """
+        arguments = arguments.split()
+        if len(arguments) > 2:
+            return self.respond(501)
+        (low, high) = (0, _max_number)
+        if len(arguments) == 2:
+            r = self._range(arguments[1])
+            if r is None:
+                return self.respond(501)
+            (low, high) = r
+        if len(arguments) > 0:
+            group = arguments[0]
+        else:
+            group = self.current_group
+            if group is None:
+                return self.respond(412)
+        details = self.server.group(group)
+        if details is None:
+            return self.respond(411)
+        (count, first, last) = details
+        self.current_group = group
+        self.current_number = first if count > 0 else None
+        self.respond(211, b'%d %d %d %s' % (count, first, last, group),
+                     flush=False)
+        self.send_lines(b'%d' % number for number
+                        in self.server.article_numbers(group, low, high))
+
+    def next(self, arguments):
+        """s.next(ARGUMENTS)
+
+        Implementation of the NNTP NEXT command.
+
+        """
+        self._step(arguments, self.server.next_article, 421)
+
+    def last(self, arguments):
+        """s.last(ARGUMENTS)
+
+        Implementation of the NNTP LAST command.
+
+        """
+        self._step(arguments, self.server.previous_article, 422)
+
+    def _step(self, arguments, method, error):
+        """s._step(ARGUMENTS, METHOD, ERROR)
+
+        Implementation of NEXT and LAST.
+
+        """
+        if arguments != b'':
+            return self.respond(501)
+        number = self._current()
+        if number is None:
+            return
+        number = method(self.current_group, number)
+        if number is None:
+            return self.respond(error)
+        ident = self.server.article_ident(self.current_group, number)
+        self.current_number = number
+        self.respond(223, b'%d %s' % (number, ident))
+
+    def _range_or_ident(self, arguments):
+        """s._range_or_ident(ARGUMENTS) -> (LOW, HIGH, IDENT) | None
+
+        Parse the argument to OVER or HDR.  Exactly one of the range
+        (LOW, HIGH) or IDENT will be set.  Responds with an error and
+        returns None if there is no suitable argument.
+
+        """
+        if _message_id_re.match(arguments):
+            return (None, None, arguments)
+        if arguments == b'':
+            number = self._current()
+            if number is None:
+                return None
+            return (number, number, None)
+        r = self._range(arguments)
+        if r is None:
+            self.respond(501)
+            return None
+        if self.current_group is None:
+            self.respond(412)
+            return None
+        return (r[0], r[1], None)
+
+    def over(self, arguments):
+        """s.over(ARGUMENTS)
+
+        Implementation of the NNTP OVER command.
+
+        """
+        selected = self._range_or_ident(arguments)
+        if selected is None:
+            return
+        (low, high, ident) = selected
+        if ident is not None:
+            line = self.server.overview_ident(ident)
+            if line is None:
+                return self.respond(430)
+            lines = [b'0\t' + line]
+        else:
+            lines = [b'%d\t%s' % (number, line) for number, line
+                     in self.server.overview(self.current_group, low, high)]
+            if len(lines) == 0:
+                return self.respond(423 if arguments != b'' else 420)
+        self.respond(224, flush=False)
+        self.send_lines(lines)
+
+    def hdr(self, arguments):
+        """s.hdr(ARGUMENTS)
+
+        Implementation of the NNTP HDR command.
+
+        """
+        arguments = arguments.split(b' ')
+        if arguments[0] == b'' or len(arguments) > 2:
+            return self.respond(501)
+        field = arguments[0]
+        selected = self._range_or_ident(arguments[1] if len(arguments) > 1
+                                        else b'')
+        if selected is None:
+            return
+        (low, high, ident) = selected
+        if ident is not None:
+            value = self.server.hdr_ident(ident, field)
+            if value is None:
+                return self.respond(430)
+            lines = [b'0 ' + value]
+        else:
+            lines = [b'%d %s' % (number, value) for number, value
+                     in self.server.hdr(self.current_group, field,
+                                        low, high)]
+            if len(lines) == 0:
+                return self.respond(423 if len(arguments) > 1 else 420)
+        self.respond(225, flush=False)
+        self.send_lines(lines)
+
+    def list(self, arguments):
+        """s.list(ARGUMENTS)
+
+        Implementation of the NNTP LIST command.
+
+        """
+        arguments = arguments.split()
+        keyword = arguments[0].upper() if len(arguments) > 0 else b'ACTIVE'
+        wildmat = None
+        if keyword in (b'ACTIVE', b'ACTIVE.TIMES', b'NEWSGROUPS'):
+            if len(arguments) > 2:
+                return self.respond(501)
+            if len(arguments) == 2:
+                wildmat = nntpbits.Wildmat(arguments[1])
+        elif keyword == b'HEADERS':
+            if len(arguments) > 2 or (len(arguments) == 2 and
+                                      arguments[1].upper()
+                                      not in (b'MSGID', b'RANGE')):
+                return self.respond(501)
+        elif len(arguments) > 1:
+            return self.respond(501)
+        if (b'GROUP' not in self.commands
+                and keyword not in (b'STATS', b'SLOWLOG')):
+            return self.respond(501)
+        if keyword == b'ACTIVE':
+            lines = [b'%s %d %d %s' % entry
+                     for entry in self.server.list_active(wildmat)]
+        elif keyword == b'ACTIVE.TIMES':
+            lines = [b'%s %d %s' % entry
+                     for entry in self.server.list_active_times(wildmat)]
+        elif keyword == b'NEWSGROUPS':
+            lines = [b'%s\t%s' % entry
+                     for entry in self.server.list_newsgroups(wildmat)]
+        elif keyword == b'OVERVIEW.FMT':
+            lines = self.server.overview_fmt()
+        elif keyword == b'HEADERS':
+            lines = self.server.list_headers()
+        elif keyword == b'STATS' and self.server.metrics is not None:
+            lines = self.server.metrics.report()
+        elif keyword == b'SLOWLOG' and self.server.slowlog is not None:
+            lines = self.server.slowlog.report()
+        else:
+            return self.respond(501)
+        self.respond(215, flush=False)
+        self.send_lines(lines)
+
+    def _since(self, arguments):
+        """s._since(ARGUMENTS) -> TIME | None
+
+        Parse the date and time arguments to NEWGROUPS or NEWNEWS,
+        returning a time.time() value, or None if they are malformed.
+
+        """
+        m = _newstuff_re.match(arguments)
+        if not m:
+            return None
+        date = m.group(1)
+        if len(date) == 6:
+            # 3977 7.3.2: the closest century to the current year
+            year = int(date[:2])
+            this_year = time.gmtime().tm_year
+            year += this_year - this_year % 100
+            if year > this_year + 50:
+                year -= 100
+            elif year <= this_year - 50:
+                year += 100
+            date = date[2:]
+        else:
+            year = int(date[:4])
+            date = date[4:]
+        (month, day) = (int(date[:2]), int(date[2:]))
+        clock = m.group(2)
+        (hour, minute, second) = (int(clock[:2]), int(clock[2:4]),
+                                  int(clock[4:]))
+        if (month < 1 or month > 12 or day < 1 or day > 31 or hour > 23
+                or minute > 59 or second > 60):
+            return None
+        t = (year, month, day, hour, minute, second, 0, 0, -1)
+        if m.group(3) is not None:
+            return calendar.timegm(t)
+        return time.mktime(t)
+
+    def newgroups(self, arguments):
+        """s.newgroups(ARGUMENTS)
+
+        Implementation of the NNTP NEWGROUPS command.
+
+        """
+        since = self._since(arguments)
+        if since is None:
+            return self.respond(501)
+        self.respond(231, flush=False)
+        self.send_lines(b'%s %d %d %s' % entry
+                        for entry in self.server.newgroups(since))
+
+    def newnews(self, arguments):
+        """s.newnews(ARGUMENTS)
+
+        Implementation of the NNTP NEWNEWS command.
+
+        """
+        arguments = arguments.split(b' ', 1)
+        if len(arguments) != 2:
+            return self.respond(501)
+        since = self._since(arguments[1])
+        if since is None:
+            return self.respond(501)
+        wildmat = nntpbits.Wildmat(arguments[0])
+        self.respond(230, flush=False)
+        self.send_lines(self.server.newnews(wildmat, since))
+
+    def date(self, arguments):
+        """s.date(ARGUMENTS)
+
+        Implementation of the NNTP DATE command.
+
+        """
+        if arguments != b'':
+            return self.respond(501)
+        self.respond(111, time.strftime("%Y%m%d%H%M%S", time.gmtime()))
+
+    def help(self, arguments):
+        """s.help(ARGUMENTS)
+
+        Implementation of the NNTP HELP command.
+
+        """
+        if arguments != b'':
+            return self.respond(501)
+        self.respond(100, flush=False)
+        self.send_lines(sorted(self.commands))
+
+    def post(self, arguments):
+        """s.post(ARGUMENTS)
+
+        Implementation of the NNTP POST command.
+
+        """
+        if arguments != b'':
+            return self.respond(501)
+        (rc, argument) = self._call_hook(self.server.post_check)
+        self.respond(rc, argument)
+        if rc == 340:
+            self.receive_article(self._post_article)
+
+    def _post_article(self, article):
+        """s._post_article(ARTICLE)
+
+        Second half of the NNTP POST command.
+
+        """
+        (rc, argument) = self._call_hook(self.server.post, article)
+        self.respond(rc, argument)
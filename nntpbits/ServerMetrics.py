@@ -0,0 +1,91 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+
+
+class ServerMetrics(nntpbits.LatencyAggregator):
+    """Server-side per-verb command metrics
+
+    Construction:
+    nntpbits.ServerMetrics() -> metrics
+
+    Set ns.metrics to a ServerMetrics object to have every connection
+    to news server ns record an nntpbits.Observation for each command
+    it processes.  As with nntpbits.LatencyAggregator, counts,
+    response codes, bytes and latency histograms are kept per verb.
+    On the server side the latency is the processing time, from
+    receipt of the command to the final response being queued
+    (including receipt of any article), and the first_byte time is
+    when the first response was queued.
+
+    The number of commands of each verb currently being processed,
+    and the peak number, are also recorded.
+
+    The metrics can be read by peers with LIST STATS, and written to
+    a file with m.dump().  With ns.listen_workers(), each worker
+    process updates its own copy.
+
+    """
+
+    def __init__(self):
+        nntpbits.LatencyAggregator.__init__(self)
+        self.in_flight = {}
+        self.peak = {}
+
+    def begin(self, observation):
+        """m.begin(OBSERVATION)
+
+        Record the start of a command.  The observation is passed to
+        m(OBSERVATION) when the command is complete.
+
+        """
+        verb = observation.verb
+        with self.lock:
+            n = self.in_flight[verb] = self.in_flight.get(verb, 0) + 1
+            if n > self.peak.get(verb, 0):
+                self.peak[verb] = n
+
+    def __call__(self, observation):
+        with self.lock:
+            self.in_flight[observation.verb] -= 1
+        nntpbits.LatencyAggregator.__call__(self, observation)
+
+    def report(self):
+        """m.report() -> LIST
+
+        Returns a summary, one line (as a string) per verb, as for
+        nntpbits.LatencyAggregator.report() but including the current
+        and peak number of commands in flight.
+
+        """
+        lines = []
+        for line in nntpbits.LatencyAggregator.report(self):
+            verb = line.split()[0].encode('ascii')
+            lines.append("%s inflight=%d peak=%d"
+                         % (line, self.in_flight.get(verb, 0),
+                            self.peak.get(verb, 0)))
+        return lines
+
+    def dump(self, path):
+        """m.dump(PATH)
+
+        Write m.report() to the file PATH.
+
+        """
+        with open(path, 'w') as f:
+            for line in self.report():
+                f.write(line + "\n")
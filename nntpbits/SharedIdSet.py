@@ -0,0 +1,97 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import hashlib
+import multiprocessing
+
+
+class SharedIdSet(object):
+    """Set of message IDs shared between processes
+
+    Construction:
+    nntpbits.SharedIdSet([size=SIZE]) -> set
+
+    The set lives in shared memory, so it is shared with processes
+    forked after it is created.  In particular a NewsServer subclass
+    can create one in its constructor and use it from ihave_check()
+    and ihave() to deduplicate offers across the workers started by
+    NewsServer.listen_workers().
+
+    Message IDs are stored as 64-bit hashes in an open-addressed table
+    with room for at least SIZE entries.  If the table is overfull
+    then old entries are overwritten, so a message ID may be
+    forgotten.
+
+    """
+
+    # Maximum probe sequence length
+    _probes = 16
+
+    def __init__(self, size=1 << 20):
+        self.slots = 1
+        while self.slots < size * 4 // 3:
+            self.slots *= 2
+        self.keys = multiprocessing.RawArray('Q', self.slots)
+        self.used = multiprocessing.RawValue('q', 0)
+        self.lock = multiprocessing.Lock()
+
+    def __len__(self):
+        return self.used.value
+
+    def _key(self, ident):
+        """s._key(IDENT) -> KEY
+
+        Returns the nonzero 64-bit hash of IDENT.  Unlike hash(), this
+        is the same in every process.
+
+        """
+        digest = hashlib.blake2b(nntpbits._normalize(ident),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def __contains__(self, ident):
+        key = self._key(ident)
+        mask = self.slots - 1
+        with self.lock:
+            for i in range(key, key + self._probes):
+                k = self.keys[i & mask]
+                if k == key:
+                    return True
+                if k == 0:
+                    return False
+            return False
+
+    def add(self, ident):
+        """s.add(IDENT) -> BOOL
+
+        Add IDENT to the set.  Returns True if it was added and False
+        if it was already present.
+
+        """
+        key = self._key(ident)
+        mask = self.slots - 1
+        with self.lock:
+            for i in range(key, key + self._probes):
+                k = self.keys[i & mask]
+                if k == key:
+                    return False
+                if k == 0:
+                    self.keys[i & mask] = key
+                    self.used.value += 1
+                    return True
+            self.keys[key & mask] = key
+            return True
@@ -0,0 +1,123 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections
+import threading
+import time
+
+
+class _SlowCommand(object):
+    """Slow log entry
+
+    when -- time.time() when the command completed
+    key -- connection key
+    verb -- command verb as an upper-case bytes object
+    ident -- message ID argument, or None
+    code -- final response code, or None
+    duration -- total processing time in seconds
+    receive -- time spent receiving an article
+    hook -- time spent in server hooks
+    respond -- time spent writing responses
+
+    """
+    __slots__ = ['when', 'key', 'verb', 'ident', 'code', 'duration',
+                 'receive', 'hook', 'respond']
+
+    def __init__(self, when, key, verb, ident, code, duration, receive,
+                 hook, respond):
+        self.when = when
+        self.key = key
+        self.verb = verb
+        self.ident = ident
+        self.code = code
+        self.duration = duration
+        self.receive = receive
+        self.hook = hook
+        self.respond = respond
+
+    def __repr__(self):
+        return ("%s %08x %s %s %s total=%.2fms receive=%.2fms hook=%.2fms "
+                "respond=%.2fms"
+                % (time.strftime('%Y-%m-%dT%H:%M:%S',
+                                 time.gmtime(self.when)),
+                   self.key, str(self.verb, 'ascii'),
+                   '-' if self.ident is None else str(self.ident, 'ascii'),
+                   self.code, 1000 * self.duration, 1000 * self.receive,
+                   1000 * self.hook, 1000 * self.respond))
+
+
+class SlowLog(object):
+    """Ring buffer of slow server commands
+
+    Construction:
+    nntpbits.SlowLog([threshold=SECONDS][, size=SIZE]) -> log
+
+    Set ns.slowlog to a SlowLog object to have every connection to
+    news server ns record commands that take at least SECONDS
+    (default 0.1) to process.  Only the most recent SIZE entries
+    (default 1024) are kept.
+
+    Each entry records the connection key, verb, message ID (if the
+    argument is one), final response code and processing time, broken
+    down into time spent receiving an article from the peer, time
+    spent in server hooks (such as ihave_check() and ihave()) and
+    time spent writing responses.  Commands that are faster than the
+    threshold are timed but not otherwise recorded.
+
+    The log can be read with l.entries() or l.report(), or by peers
+    with LIST SLOWLOG.
+
+    """
+
+    def __init__(self, threshold=0.1, size=1024):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.ring = collections.deque(maxlen=size)
+        self.count = 0
+
+    def add(self, key, verb, ident, code, duration, receive, hook,
+            respond):
+        """l.add(KEY, VERB, IDENT, CODE, DURATION, RECEIVE, HOOK, RESPOND)
+
+        Record a slow command.  The oldest entry is discarded if the
+        log is full.
+
+        """
+        entry = _SlowCommand(time.time(), key, verb, ident, code, duration,
+                             receive, hook, respond)
+        with self.lock:
+            self.ring.append(entry)
+            self.count += 1
+
+    def entries(self):
+        """l.entries() -> LIST
+
+        Returns the recorded entries, oldest first.  Each has the
+        attributes when, key, verb, ident, code, duration, receive,
+        hook and respond.
+
+        """
+        with self.lock:
+            return list(self.ring)
+
+    def report(self):
+        """l.report() -> LIST
+
+        Returns the recorded entries, one line (as a string) each,
+        oldest first.
+
+        """
+        return [repr(entry) for entry in self.entries()]
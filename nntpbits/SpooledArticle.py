@@ -0,0 +1,180 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import tempfile
+
+
+class SpooledArticle(object):
+    """Article received from a peer, spilled to disk if large
+
+    Construction:
+    nntpbits.SpooledArticle([threshold=BYTES][, directory=DIR]) -> article
+
+    The article is accumulated with a.write() in wire format:
+    dot-stuffed, with each line followed by CRLF, but without the
+    terminating '.' line.  Up to BYTES bytes (default 1MB) are kept in
+    memory; beyond that the article is moved to a temporary file in
+    DIR (default the system temporary directory).  If BYTES is None
+    then the article is always kept in memory.
+
+    len(a) is the size of the article in wire format and a.count is
+    the number of lines in it.  The header can be inspected with
+    a.header() without reading the body.  The article can be copied
+    with a.read() or a.readinto(), or converted to a list of bytes
+    objects with a.lines().
+
+    Call a.close() to discard the article and its temporary file.
+
+    """
+
+    def __init__(self, threshold=1 << 20, directory=None):
+        self.threshold = threshold
+        self.directory = directory
+        self.data = bytearray()
+        self.file = None
+        self.size = 0
+        self.count = 0
+        self._header = None
+        self._body_offset = None
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        """a.write(DATA)
+
+        Append DATA, a bytes-like object in wire format, to the
+        article.
+
+        """
+        if (self.file is None and self.threshold is not None
+                and self.size + len(data) > self.threshold):
+            self.file = tempfile.TemporaryFile(dir=self.directory)
+            self.file.write(self.data)
+            self.data = None
+        if self.file is not None:
+            self.file.seek(0, 2)
+            self.file.write(data)
+        else:
+            self.data += data
+        self.size += len(data)
+        self.count += data.count(b'\n')
+        self._header = None
+
+    def read(self, offset=0, size=None):
+        """a.read([OFFSET][, SIZE]) -> BYTES
+
+        Returns up to SIZE bytes of the article in wire format,
+        starting at OFFSET.  If SIZE is None then everything from
+        OFFSET to the end is returned.
+
+        """
+        if size is None or offset + size > self.size:
+            size = max(self.size - offset, 0)
+        if self.file is None:
+            return bytes(self.data[offset:offset + size])
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def readinto(self, buffer, offset=0):
+        """a.readinto(BUFFER[, OFFSET]) -> COUNT
+
+        Fill the writable bytes-like object BUFFER with the article in
+        wire format, starting at OFFSET.  Returns the number of bytes
+        copied, which is less than len(BUFFER) if the end of the
+        article is reached.
+
+        """
+        view = memoryview(buffer).cast('B')
+        size = min(len(view), max(self.size - offset, 0))
+        if self.file is None:
+            view[:size] = self.data[offset:offset + size]
+            return size
+        self.file.seek(offset)
+        done = 0
+        while done < size:
+            n = self.file.readinto(view[done:size])
+            if not n:
+                break
+            done += n
+        return done
+
+    def header(self):
+        """a.header() -> LIST
+
+        Returns the header of the article, as a list of bytes objects
+        with dot-stuffing removed.  Only the header is read.
+
+        """
+        self._parse_header()
+        return self._header
+
+    def body_offset(self):
+        """a.body_offset() -> OFFSET
+
+        Returns the offset of the start of the body in the wire
+        format, which is len(a) if there is no body.
+
+        """
+        self._parse_header()
+        return self._body_offset
+
+    def _parse_header(self):
+        """a._parse_header()
+
+        Locate the end of the header and split it into lines.
+
+        """
+        if self._header is not None:
+            return
+        if self.read(0, 2) == b'\r\n':
+            (end, self._body_offset) = (0, 2)
+        else:
+            limit = 4096
+            while True:
+                index = self.read(0, limit).find(b'\r\n\r\n')
+                if index >= 0:
+                    (end, self._body_offset) = (index + 2, index + 4)
+                    break
+                if limit >= self.size:
+                    (end, self._body_offset) = (self.size, self.size)
+                    break
+                limit *= 4
+        self._header = nntpbits.ArticleStore.decode(self.read(0, end))
+
+    def lines(self):
+        """a.lines() -> LIST
+
+        Returns the whole article as a list of bytes objects, with
+        dot-stuffing removed.
+
+        """
+        return nntpbits.ArticleStore.decode(self.read())
+
+    def close(self):
+        """a.close()
+
+        Discard the article.
+
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.data = bytearray()
+        self.size = 0
+        self.count = 0
+        self._header = None
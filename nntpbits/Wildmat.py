@@ -0,0 +1,88 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import nntpbits
+import re
+
+
+class Wildmat(object):
+    """Compiled RFC3977 wildmat
+
+    Construction:
+    nntpbits.Wildmat(PATTERN) -> wildmat object
+
+    PATTERN is a bytes object (or a string, which will be converted
+    using the ASCII encoding) containing comma-separated patterns,
+    each optionally preceded by '!'.  '*' matches any sequence of
+    characters and '?' any single character.  The last pattern that
+    matches a name determines whether the wildmat matches it.
+
+    """
+
+    def __init__(self, pattern):
+        self.pattern = nntpbits._normalize(pattern)
+        self.patterns = []
+        self.common_prefix = None
+        for element in self.pattern.split(b','):
+            negated = element[0:1] == b'!'
+            if negated:
+                element = element[1:]
+            else:
+                literal = re.match(b'[^*?]*', element).group(0)
+                if self.common_prefix is None:
+                    self.common_prefix = literal
+                else:
+                    while not literal.startswith(self.common_prefix):
+                        self.common_prefix = self.common_prefix[:-1]
+            regexp = b''.join(b'.*' if ch == b'*'
+                              else b'.' if ch == b'?'
+                              else re.escape(ch)
+                              for ch in (element[i:i+1]
+                                         for i in range(len(element))))
+            self.patterns.append((negated, re.compile(regexp + b'\\Z',
+                                                      re.DOTALL)))
+        self.patterns.reverse()
+        if self.common_prefix == b'':
+            self.common_prefix = None
+        # A single literal pattern can be answered by comparison
+        if (len(self.patterns) == 1 and not self.patterns[0][0]
+                and b'*' not in self.pattern and b'?' not in self.pattern):
+            self.literal = self.pattern
+        else:
+            self.literal = None
+
+    def match(self, name):
+        """w.match(NAME) -> BOOL
+
+        Returns True if NAME matches the wildmat.
+
+        """
+        if self.literal is not None:
+            return name == self.literal
+        for negated, regexp in self.patterns:
+            if regexp.match(name):
+                return not negated
+        return False
+
+    def prefix(self):
+        """w.prefix() -> BYTES | None
+
+        Returns a prefix shared by every name that can match, or None
+        if there is no useful prefix.  This can be used to prune
+        searches of sorted names.
+
+        """
+        return self.common_prefix
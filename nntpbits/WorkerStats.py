@@ -0,0 +1,106 @@
+#
+# Copyright 2015 Richard Kettlewell
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import multiprocessing
+
+
+class WorkerStats(object):
+    """Server statistics shared between worker processes
+
+    Construction:
+    nntpbits.WorkerStats(WORKERS) -> statistics
+
+    Counts connections and responses (by code) for each of WORKERS
+    worker processes, in shared memory.  NewsServer.listen_workers()
+    creates one as ns.stats before starting the workers; each worker
+    updates its own row, and totals can be read from any process.
+
+    """
+
+    # Slot 0 counts connections, slot 1 + CODE - 100 counts CODE
+    _slots = 501
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.counts = multiprocessing.RawArray('q', workers * self._slots)
+        self.base = 0
+
+    def select(self, worker):
+        """s.select(WORKER)
+
+        Direct subsequent updates in this process to WORKER's row.
+
+        """
+        self.base = worker * self._slots
+
+    def connection(self):
+        """s.connection()
+
+        Count a connection.
+
+        """
+        self.counts[self.base] += 1
+
+    def response(self, code):
+        """s.response(CODE)
+
+        Count a response.
+
+        """
+        if 100 <= code < 600:
+            self.counts[self.base + 1 + code - 100] += 1
+
+    def connections(self, worker=None):
+        """s.connections([WORKER]) -> COUNT
+
+        Returns the number of connections for WORKER, or for all
+        workers.
+
+        """
+        workers = range(self.workers) if worker is None else [worker]
+        return sum(self.counts[w * self._slots] for w in workers)
+
+    def responses(self, worker=None):
+        """s.responses([WORKER]) -> DICT
+
+        Returns a dict mapping response codes to counts, for WORKER
+        or for all workers.
+
+        """
+        workers = range(self.workers) if worker is None else [worker]
+        result = {}
+        for slot in range(1, self._slots):
+            n = sum(self.counts[w * self._slots + slot] for w in workers)
+            if n > 0:
+                result[slot + 99] = n
+        return result
+
+    def report(self):
+        """s.report() -> LIST
+
+        Returns a summary, one line (as a string) per worker and a
+        total.
+
+        """
+        lines = []
+        for worker in list(range(self.workers)) + [None]:
+            codes = " ".join("%d:%d" % (code, n) for code, n
+                             in sorted(self.responses(worker).items()))
+            lines.append("%-8s connections=%d codes=[%s]"
+                         % ("total" if worker is None else
+                            "worker%d" % worker,
+                            self.connections(worker), codes))
+        return lines
@@ -18,14 +18,56 @@
 
 Classes:
   nntpbits.NewsServer -- base class for news servers
+  nntpbits.MemoryNewsServer -- in-memory peering and reader news server
+  nntpbits.RelayServer -- news server forwarding articles to peers
+  nntpbits.RelayPeer -- outgoing feed from a relay to one peer
   nntpbits.ClientConnection -- an NNTP client connection
+  nntpbits.AsyncClientConnection -- an asyncio NNTP client connection
   nntpbits.ServerConnection -- an NNTP server connection
+  nntpbits.AsyncNewsServer -- base class for asyncio news servers
+  nntpbits.AsyncServerConnection -- an asyncio NNTP server connection
   nntpbits.Connection -- base class for connections
+  nntpbits.RangeSet -- compact set of article numbers
+  nntpbits.Wildmat -- compiled RFC3977 wildmat
+  nntpbits.ActiveList -- parsed, indexed active file
+  nntpbits.Observation -- timing record for a client command
+  nntpbits.LatencyAggregator -- per-verb latency histograms
+  nntpbits.ServerMetrics -- server-side per-verb command metrics
+  nntpbits.SlowLog -- ring buffer of slow server commands
+  nntpbits.OfferCache -- recently-offered message ID cache
+  nntpbits.SharedIdSet -- message ID set shared between processes
+  nntpbits.WorkerStats -- server statistics shared between processes
+  nntpbits.ArticleStore -- in-memory article storage
+  nntpbits.CycBuffStore -- memory-mapped cyclic article buffer
+  nntpbits.History -- message ID history database
+  nntpbits.OverviewStore -- per-group overview database
+  nntpbits.SpooledArticle -- received article, spilled to disk if large
 """
 from nntpbits.Connection import *
+from nntpbits.RangeSet import *
+from nntpbits.Wildmat import *
+from nntpbits.ActiveList import *
+from nntpbits.Observation import *
+from nntpbits.LatencyAggregator import *
+from nntpbits.ServerMetrics import *
+from nntpbits.SlowLog import *
+from nntpbits.OfferCache import *
+from nntpbits.SharedIdSet import *
+from nntpbits.WorkerStats import *
+from nntpbits.ArticleStore import *
+from nntpbits.CycBuffStore import *
+from nntpbits.History import *
+from nntpbits.SpooledArticle import *
 from nntpbits.ClientConnection import *
+from nntpbits.AsyncClientConnection import *
 from nntpbits.ServerConnection import *
 from nntpbits.NewsServer import *
+from nntpbits.OverviewStore import *
+from nntpbits.MemoryNewsServer import *
+from nntpbits.RelayPeer import *
+from nntpbits.RelayServer import *
+from nntpbits.AsyncServerConnection import *
+from nntpbits.AsyncNewsServer import *
 import threading,time
 
 def _normalize(s):
@@ -18,22 +18,131 @@
 import argparse,logging,sys,threading,time
 import nntpbits
 
+class SinkServer(nntpbits.NewsServer):
+    """Peering server that accepts each article once and discards it."""
+    def __init__(self, **kwargs):
+        nntpbits.NewsServer.__init__(self, **kwargs)
+        self.seen=nntpbits.SharedIdSet()
+
+    def ihave_check(self, ident):
+        if ident in self.seen:
+            return (435, b'Duplicate')
+        return (335, b'OK')
+
+    def ihave(self, ident, article):
+        if not self.seen.add(ident):
+            return (437, b'Duplicate')
+        return (235, b'OK')
+
 def main(argv):
     p=argparse.ArgumentParser()
     p.add_argument('-s', '--server', help='Server name',
                    default='news')
     p.add_argument('-p', '--port', help='Server port',
                    type=int, default=119)
+    p.add_argument('-S', '--sink', help='Accept and discard articles',
+                   action='store_true')
+    p.add_argument('-R', '--reader',
+                   help='Store articles and support reader commands',
+                   action='store_true')
+    p.add_argument('-G', '--group', help='Create a group (with --reader)',
+                   action='append', default=[])
+    p.add_argument('-P', '--spool',
+                   help='Cyclic article buffer file (with --reader)')
+    p.add_argument('-z', '--spool-size', help='Cyclic buffer size in bytes',
+                   type=int, default=1 << 30)
+    p.add_argument('-I', '--history',
+                   help='History database file (with --reader)')
+    p.add_argument('-w', '--workers', help='Number of worker processes',
+                   type=int, default=0)
+    p.add_argument('-C', '--max-connections',
+                   help='Maximum concurrent connections', type=int)
+    p.add_argument('-M', '--max-commands',
+                   help='Maximum concurrent IHAVE/CHECK commands', type=int)
+    p.add_argument('-T', '--spill',
+                   help='Spill received articles larger than this to disk',
+                   type=int)
+    p.add_argument('-L', '--max-article-size',
+                   help='Refuse received articles larger than this',
+                   type=int)
+    p.add_argument('-m', '--metrics',
+                   help='Collect command metrics and write them to this file'
+                   ' on shutdown')
+    p.add_argument('-W', '--slow',
+                   help='Log commands slower than this many seconds',
+                   type=float)
+    p.add_argument('-f', '--feed',
+                   help='Relay articles to this HOST:PORT (may be repeated)',
+                   action='append', default=[])
+    p.add_argument('-q', '--queue-size',
+                   help='Articles queued per relay peer', type=int,
+                   default=1024)
     p.add_argument('-d', '--debug', help='Enable debugging',
                    action='store_const', const='DEBUG', default='INFO')
     r=p.parse_args(argv)
+    if r.feed and r.workers > 0:
+        p.error("--feed cannot be used with --workers")
     logging.basicConfig(level=r.debug)
-    server=nntpbits.NewsServer()
+    limits={'max_connections': r.max_connections,
+            'max_commands': r.max_commands,
+            'spill_threshold': r.spill,
+            'max_article_size': r.max_article_size}
+    if r.sink:
+        server=SinkServer(**limits)
+        features=['peering']
+    elif r.reader:
+        store=None
+        if r.spool is not None:
+            store=nntpbits.CycBuffStore(r.spool, size=r.spool_size)
+        history=None
+        if r.history is not None:
+            history=nntpbits.History(r.history)
+        server=nntpbits.MemoryNewsServer(store=store, history=history,
+                                         **limits)
+        for group in r.group:
+            server.newgroup(group.encode())
+        features=['peering', 'reader']
+    elif r.feed:
+        peers=[]
+        for feed in r.feed:
+            host, _, port=feed.rpartition(':')
+            peers.append(nntpbits.RelayPeer((host, int(port)), name=feed,
+                                            queue_size=r.queue_size))
+        server=nntpbits.RelayServer(peers, **limits)
+        server.start_peers()
+        features=['peering']
+    else:
+        server=nntpbits.NewsServer(**limits)
+        features=[]
+    if r.metrics is not None:
+        server.metrics=nntpbits.ServerMetrics()
+    if r.slow is not None:
+        server.slowlog=nntpbits.SlowLog(threshold=r.slow)
     try:
-        server.listen_address(r.server, r.port, wait=True, daemon=True)
+        if r.workers > 0:
+            server.listen_workers(r.server, r.port, workers=r.workers,
+                                  wait=True, daemon=True, features=features)
+        else:
+            server.listen_address(r.server, r.port, wait=True, daemon=True,
+                                  features=features)
     except KeyboardInterrupt:
         logging.info("stopping server")
         nntpbits.stop()
+        if r.reader:
+            server.close()
+        if r.metrics is not None:
+            server.metrics.dump(r.metrics)
+        if r.feed:
+            for line in server.report():
+                logging.info("relay: %s" % line)
+        if r.slow is not None:
+            for line in server.slowlog.report():
+                logging.info("slow: %s" % line)
+        if server.stats is not None:
+            for line in server.stats.report():
+                logging.info(line)
+        else:
+            logging.info("admission %s" % server.admission)
         sys.exit(0)
 
 if __name__ == '__main__':
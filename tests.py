@@ -53,7 +53,12 @@ def main(argv):
     p.add_argument('-D', '--domain', help='Message-ID domain')
     p.add_argument('-l', '--localport', help='Test server port',
                    type=int, default=1119)
+    p.add_argument('-m', '--localmode', help='Test server mode',
+                   choices=['threads', 'selector', 'asyncio'],
+                   default='threads')
     p.add_argument('-t', '--timelimit', help='Per-test time limit',)
+    p.add_argument('-F', '--faults',
+                   help='Test server fault profile, e.g. 431=0.1,reset=100')
     p.add_argument('-a', '--arg', help="TEST:ARG=VALUE per-test argument",
                    type=str, dest='ARGS', action='append', default=[])
     p.add_argument('-d', '--debug', help='Enable debugging',
@@ -95,6 +100,8 @@ def main(argv):
                       email=r.email,
                       domain=r.domain,
                       localserveraddress=('*', r.localport),
+                      localservermode=r.localmode,
+                      profile=r.faults,
                       timelimit=r.timelimit,
                       trigger=r.trigger)
     tested = 0
@@ -167,6 +174,8 @@ def main(argv):
         logging.info("%d compatibility variations" % len(compats))
     if len(fails) > 0:
         logging.error("%d fails" % len(fails))
+    for line in inntest.latency.report():
+        logging.info("latency: %s" % line)
     if r.HTML:
         html.write("</table>\n")
         html.close()